@@ -1,9 +1,27 @@
+import os
 from chalice import Chalice
-from chalicelib.fixtures import fixtures
-from chalicelib.historical import history
-from chalicelib.match_predictions import predictions
 
 app = Chalice(app_name='football_predictions')
-app.register_blueprint(fixtures)
-app.register_blueprint(history)
-app.register_blueprint(predictions)
+
+# Every function is deployed with this file, so each handler imports the module that does the work
+# when it's first called. That way a Lambda only loads its own dependencies (e.g. get_fixtures doesn't
+# import numpy) and only creates the AWS clients it uses (see chalicelib/aws.py).
+
+
+@app.schedule('cron(0 18 * * ? *)')
+def get_fixtures(event):
+    from chalicelib import fixtures
+    return fixtures.get_fixtures(event)
+
+
+@app.schedule('cron(0 1,13 * * ? *)')
+def fetch_historical_data(event):
+    from chalicelib import historical
+    return historical.fetch_historical_data(event)
+
+
+@app.on_s3_event(bucket=os.environ['S3_BUCKET'], prefix='fixtures/',
+                 suffix='.csv', events=['s3:ObjectCreated:*'])
+def make_predictions(event):
+    from chalicelib import predictions
+    return predictions.make_predictions(event)
@@ -0,0 +1,175 @@
+import botocore.exceptions
+import hashlib
+import io
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib import aws
+
+
+# An in-memory stand-in for the parts of S3 (and SES) the functions use, so that the benchmarks measure
+# our code rather than the network. install() puts it in chalicelib.aws's registry (also in forked
+# worker processes), so aws.client('s3') and aws.resource('s3') return it. It handles Range, IfMatch,
+# IfNoneMatch and multipart uploads like S3 does and counts the requests and bytes sent.
+
+
+class LocalS3:
+
+    # Every part of a multipart upload but the last has to be at least this big (tests can make it smaller)
+    min_part_bytes = 5 * 1024 * 1024
+
+    def __init__(self):
+        self.objects = dict()
+        # Multipart uploads in progress: upload ID: (bucket, key, {part number: body})
+        self.uploads = dict()
+        self.requests = 0
+        self.bytes_read = 0
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode()
+        body = bytes(Body)
+        self.requests += 1
+        self.objects[(Bucket, Key)] = (body, _get_etag(body), datetime.now(timezone.utc))
+        return {'ETag': _get_etag(body)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.requests += 1
+        if (Bucket, Key) not in self.objects:
+            # A HEAD response has no body, so S3's error for a missing object is just the status code
+            _raise('404', 'HeadObject')
+        body, etag, last_modified = self._get(Bucket, Key, 'HeadObject')
+        return {'ETag': etag, 'LastModified': last_modified, 'ContentLength': len(body)}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self.requests += 1
+        body, etag, last_modified = self._get(Bucket, Key, 'GetObject')
+        if IfMatch is not None and IfMatch != etag:
+            _raise('PreconditionFailed', 'GetObject')
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            _raise('304', 'GetObject')
+        if Range is not None:
+            body = _get_range(body, Range)
+        self.bytes_read += len(body)
+        return {'Body': io.BytesIO(body), 'ETag': etag, 'LastModified': last_modified,
+                'ContentLength': len(body)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.requests += 1
+        self.objects.pop((Bucket, Key), None)
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.requests += 1
+        upload_id = str(self.requests)
+        self.uploads[upload_id] = (Bucket, Key, dict())
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.requests += 1
+        parts = self._get_upload(Bucket, Key, UploadId, 'UploadPart')
+        parts[PartNumber] = bytes(Body)
+        return {'ETag': _get_etag(parts[PartNumber])}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self.requests += 1
+        parts = self._get_upload(Bucket, Key, UploadId, 'CompleteMultipartUpload')
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        if numbers != sorted(numbers) or any(part['ETag'] != _get_etag(parts.get(part['PartNumber'], b''))
+                                             for part in MultipartUpload['Parts']):
+            _raise('InvalidPart', 'CompleteMultipartUpload')
+        if any(len(parts[number]) < self.min_part_bytes for number in numbers[:-1]):
+            _raise('EntityTooSmall', 'CompleteMultipartUpload')
+        del self.uploads[UploadId]
+        body = b''.join(parts[number] for number in numbers)
+        # S3's ETag for a multipart upload is the MD5 of the parts' MD5s and the number of parts
+        digests = b''.join(hashlib.md5(parts[number]).digest() for number in numbers)
+        etag = '"%s-%d"' % (hashlib.md5(digests).hexdigest(), len(numbers))
+        self.objects[(Bucket, Key)] = (body, etag, datetime.now(timezone.utc))
+        return {'ETag': etag}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.requests += 1
+        self._get_upload(Bucket, Key, UploadId, 'AbortMultipartUpload')
+        del self.uploads[UploadId]
+
+    def delete_prefix(self, bucket, prefix):
+        for key in [key for b, key in self.objects if b == bucket and key.startswith(prefix)]:
+            del self.objects[(bucket, key)]
+
+    def _get(self, bucket, key, operation):
+        if (bucket, key) not in self.objects:
+            _raise('NoSuchKey', operation)
+        return self.objects[(bucket, key)]
+
+    def _get_upload(self, bucket, key, upload_id, operation):
+        if self.uploads.get(upload_id, (None, None))[:2] != (bucket, key):
+            _raise('NoSuchUpload', operation)
+        return self.uploads[upload_id][2]
+
+
+class LocalS3Resource:
+    # boto3.resource('s3'), as far as Object(bucket, key).get()/put() goes
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def Object(self, bucket, key):
+        return LocalS3Object(self.s3, bucket, key)
+
+
+class LocalS3Object:
+
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket_name = bucket
+        self.key = key
+
+    def get(self, **kwargs):
+        return self.s3.get_object(Bucket=self.bucket_name, Key=self.key, **kwargs)
+
+    def put(self, Body, **kwargs):
+        return self.s3.put_object(Bucket=self.bucket_name, Key=self.key, Body=Body, **kwargs)
+
+
+class LocalSes:
+    # Keeps the mails instead of sending them
+
+    def __init__(self):
+        self.sent = []
+
+    def send_email(self, **kwargs):
+        self.sent.append(kwargs)
+        return {'MessageId': str(len(self.sent))}
+
+
+def install(s3=None, ses=None):
+    s3 = s3 or LocalS3()
+    ses = ses or LocalSes()
+    clients = {('client', 's3'): s3, ('resource', 's3'): LocalS3Resource(s3), ('client', 'ses'): ses}
+
+    def register():
+        aws._clients.update(clients)
+
+    register()
+    # aws forgets its clients in a forked process, so put these back
+    os.register_at_fork(after_in_child=register)
+    return s3, ses
+
+
+def _get_etag(body):
+    return '"%s"' % hashlib.md5(body).hexdigest()
+
+
+def _get_range(body, header):
+    # 'bytes=start-stop' (inclusive), 'bytes=start-' or 'bytes=-suffix_length'
+    start, _, stop = header[len('bytes='):].partition('-')
+    if not start:
+        return body[-int(stop):]
+    return body[int(start):int(stop) + 1 if stop else None]
+
+
+def _raise(code, operation):
+    raise botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': code}}, operation)
@@ -0,0 +1,220 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tablib
+import time
+from datetime import datetime, timezone
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+# Times the hot paths of the predictions on synthetic leagues, at several data sizes, and writes the
+# results as JSON. The historical data and fixtures are served from an in-memory S3 (local_s3.py).
+#
+#   python benchmarks/run.py [--sizes small,medium,large] [--repeat 5] [--output results.json]
+#                            [--compare previous.json]
+
+BUCKET = 'benchmark-bucket'
+LATEST_SEASON = '2021'
+
+# size: (leagues, teams per league, seasons)
+SIZES = {
+    'small': (2, 12, 2),
+    'medium': (4, 20, 3),
+    'large': (8, 24, 5),
+}
+
+
+def _set_environment():
+    # The functions read their configuration from the environment when they're imported, so use what
+    # they're deployed with, pointed at the local S3
+    with open(os.path.join(REPO, '.chalice', 'config.json')) as f:
+        os.environ.update(json.load(f)['environment_variables'])
+    os.environ['S3_BUCKET'] = BUCKET
+    os.environ['LATEST_SEASON'] = LATEST_SEASON
+    os.environ.pop('MODEL_CACHE_DIR', None)
+
+
+_set_environment()
+
+from benchmarks import local_s3, synthetic
+from chalicelib import columnar, common, feature_store, match_predictions, over_under_predictions, predictions
+
+
+class Event:
+    # The parts of a Chalice S3 event the functions use
+    bucket = BUCKET
+    key = 'fixtures/fixtures.csv'
+
+
+def upload(s3, n_leagues, n_teams, n_seasons):
+    # Put synthetic leagues and fixtures in S3, laid out as fetch_historical_data and get_fixtures leave them
+    divs = synthetic.DIVISIONS[:n_leagues]
+    seasons = synthetic.get_seasons(n_seasons, LATEST_SEASON)
+    prefix = os.environ['S3_PREFIX_HISTORICAL'].rstrip('/')
+    leagues = dict()
+    for seed, div in enumerate(divs):
+        data = synthetic.generate_league(div, n_teams, seasons, seed=seed)
+        s3.put_object(Bucket=BUCKET, Key='%s/%s.csv' % (prefix, div), Body=data.export('csv'))
+        table = columnar.from_dataset(data, div)
+        response = s3.put_object(Bucket=BUCKET, Key='%s/%s.cols' % (prefix, div), Body=columnar.encode(table))
+        feature_store.save_features(BUCKET, div, response['ETag'], lambda: [table])
+        leagues[div] = data
+    fixtures = synthetic.generate_fixtures(divs, n_teams)
+    s3.put_object(Bucket=BUCKET, Key=Event.key, Body=fixtures.export('csv'))
+    return leagues, fixtures
+
+
+def get_benchmarks(s3, leagues, fixtures):
+    # name: (function to time, function to run before each timing, or None)
+    div, data = next(iter(leagues.items()))
+    table = columnar.from_dataset(data, div)
+    ppg_data = _copy(data)
+    match_predictions.add_ppg_fields(ppg_data)
+    trained = match_predictions.train_classifiers(table, div)
+    classifiers = {'home_clf': trained[0], 'draw_clf': trained[1], 'away_clf': trained[2],
+                   'home_fname': trained[6], 'draw_fname': trained[7], 'away_fname': trained[8]}
+    league_fixtures = common.get_league_data(fixtures, div)
+    matches = list(zip(league_fixtures['HomeTeam'], league_fixtures['AwayTeam'],
+                       league_fixtures['Date'], league_fixtures['Time']))
+    season = table.for_season(LATEST_SEASON)
+    match_predictor = predictions.get_predictors(['match'])
+    all_predictors = predictions.get_predictors(['match', 'over_under'])
+
+    def clear_caches():
+        # As on a cold start: nothing in the container's cache and no trained models in S3
+        common.s3_cache.clear()
+        s3.delete_prefix(BUCKET, os.environ['S3_PREFIX_MODELS'].rstrip('/') + '/')
+
+    return {
+        'add_ppg_fields': (lambda: match_predictions.add_ppg_fields(_copy(data)), None),
+        'get_percentages_for_diffs': (lambda: match_predictions.get_percentages_for_diffs(ppg_data, 'PpgDiff', 'H'),
+                                      None),
+        'train_classifiers': (lambda: match_predictions.train_classifiers(table, div), None),
+        'predict': (lambda: match_predictions.predict(table, div, classifiers, matches), None),
+        'over_under_predict': (lambda: over_under_predictions.predict(div, season, matches), None),
+        'match_predictions_cold': (lambda: predictions.run(BUCKET, Event.key, match_predictor), clear_caches),
+        # A warm container, with the models from the previous run
+        'match_predictions_warm': (lambda: predictions.run(BUCKET, Event.key, match_predictor), None),
+        # The match and over/under predictions sharing each league's data
+        'all_predictors_warm': (lambda: predictions.run(BUCKET, Event.key, all_predictors), None),
+    }
+
+
+def time_benchmark(func, setup, repeat):
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def run(sizes, repeat, selected=None):
+    s3, ses = local_s3.install()
+    results = []
+    for size in sizes:
+        n_leagues, n_teams, n_seasons = SIZES[size]
+        s3.objects.clear()
+        leagues, fixtures = upload(s3, n_leagues, n_teams, n_seasons)
+        n_matches = sum(data.height for data in leagues.values())
+        size_results = []
+        # The functions print every prediction and log at INFO, which would swamp the output
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), _quiet_logging():
+            benchmarks = get_benchmarks(s3, leagues, fixtures)
+            for name, (func, setup) in benchmarks.items():
+                if selected and name not in selected:
+                    continue
+                seconds = time_benchmark(func, setup, repeat)
+                size_results.append({
+                    'benchmark': name, 'size': size,
+                    'leagues': n_leagues, 'teams': n_teams, 'seasons': n_seasons, 'matches': n_matches,
+                    'repeat': repeat, 'seconds': seconds,
+                    'min_seconds': min(seconds), 'median_seconds': statistics.median(seconds),
+                })
+        for result in size_results:
+            print("%-8s %-28s %10.2f ms" % (size, result['benchmark'], result['median_seconds'] * 1000),
+                  file=sys.stderr)
+        results += size_results
+    return results
+
+
+def compare(results, previous):
+    # Print how much each benchmark's median has changed since a previous run
+    before = {(r['benchmark'], r['size']): r['median_seconds'] for r in previous['results']}
+    for result in results:
+        key = (result['benchmark'], result['size'])
+        if key in before:
+            change = result['median_seconds'] / before[key] - 1
+            print("%-8s %-28s %10.2f ms -> %10.2f ms  %+6.1f%%" % (
+                result['size'], result['benchmark'], before[key] * 1000, result['median_seconds'] * 1000,
+                change * 100), file=sys.stderr)
+
+
+@contextlib.contextmanager
+def _quiet_logging():
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+def _copy(data):
+    # add_ppg_fields adds columns to the Dataset it's given
+    return tablib.Dataset(*data, headers=data.headers)
+
+
+def _get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the predictions on synthetic leagues")
+    parser.add_argument('--sizes', default='small,medium,large',
+                        help="comma-separated, from %s" % ', '.join(SIZES))
+    parser.add_argument('--benchmarks', help="comma-separated names of the benchmarks to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="where to write the results (default: stdout)")
+    parser.add_argument('--compare', help="results of a previous run to compare with")
+    args = parser.parse_args()
+
+    sizes = args.sizes.split(',')
+    selected = args.benchmarks.split(',') if args.benchmarks else None
+    results = run(sizes, args.repeat, selected)
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': _get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': {size: dict(zip(['leagues', 'teams', 'seasons'], SIZES[size])) for size in sizes},
+        'results': results,
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+# Reports how long each Lambda entry point takes to start: a fresh interpreter imports app.py (as Lambda
+# does), then the module that handles the entry point's events, then creates the AWS clients the entry
+# point uses (which may already exist, in a checkout that creates them at import time). It reports the
+# time taken and which of the heavier dependencies ended up loaded.
+#
+#   python benchmarks/startup.py [--repeat 5] [--json]
+
+# entry point: (module, AWS clients it uses)
+ENTRY_POINTS = {
+    'get_fixtures': ('chalicelib.fixtures', [('resource', 's3')]),
+    'fetch_historical_data': ('chalicelib.historical', [('client', 's3')]),
+    'make_predictions': ('chalicelib.predictions', [('client', 's3'), ('resource', 's3'), ('client', 'ses')]),
+}
+
+HEAVY_MODULES = ['boto3', 'numpy', 'sklearn', 'scipy', 'tablib', 'requests']
+
+CHILD = """
+import importlib, json, sys, time
+start = time.perf_counter()
+import app
+importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+try:
+    from chalicelib import aws
+except ImportError:
+    aws = None
+if aws is not None:
+    for kind, service in json.loads(sys.argv[2]):
+        getattr(aws, kind)(service)
+ready = time.perf_counter()
+print(json.dumps({'import_seconds': imported - start, 'seconds': ready - start,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+def measure(repo, module, clients, repeat):
+    env = dict(os.environ)
+    env.update(_get_config_environment(repo))
+    env.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', CHILD, module, json.dumps(clients)], cwd=repo, env=env, check=True,
+                                stdout=subprocess.PIPE).stdout
+        runs.append(json.loads(output))
+    return {'module': module,
+            'median_import_seconds': statistics.median(run['import_seconds'] for run in runs),
+            'median_seconds': statistics.median(run['seconds'] for run in runs),
+            'loaded': runs[-1]['loaded']}
+
+
+def _get_config_environment(repo):
+    # The environment variables the functions are deployed with
+    with open(os.path.join(repo, '.chalice', 'config.json')) as f:
+        return json.load(f)['environment_variables']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the start-up time of each Lambda entry point")
+    parser.add_argument('--repo', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="the checkout to measure (default: this one)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {name: measure(args.repo, module, clients, args.repeat)
+               for name, (module, clients) in ENTRY_POINTS.items()}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("%-22s %10s %10s   %s" % ('entry point', 'imports', 'ready', 'loads'))
+    for name, result in results.items():
+        print("%-22s %7.0f ms %7.0f ms   %s" % (name, result['median_import_seconds'] * 1000,
+                                              result['median_seconds'] * 1000, ', '.join(result['loaded'])))
+
+
+if __name__ == '__main__':
+    main()
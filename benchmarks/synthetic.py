@@ -0,0 +1,97 @@
+import numpy as np
+import os
+import sys
+import tablib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalicelib import columnar
+
+
+# Synthetic leagues in the historical/<league>.csv layout (columnar.CSV_HEADERS). Every season is a
+# double round robin, played in rounds through the season. Each team has a strength, and the goals are
+# Poisson-distributed around the two teams' strengths (with a home advantage), so the PPG features
+# actually say something about the results. The odds are derived from the same strengths.
+
+# Leagues to generate, in order (over/under predictions skip SP1 and SP2, so they're not used)
+DIVISIONS = ['E0', 'E1', 'D1', 'I1', 'F1', 'N1', 'P1', 'B1', 'E2', 'E3', 'D2', 'I2', 'F2', 'G1', 'T1', 'SC0']
+
+HOME_ADVANTAGE = 0.25
+MEAN_GOALS = 1.3
+
+
+def get_seasons(n_seasons, latest_season='2021'):
+    # e.g. get_seasons(3) == ['1819', '1920', '2021']
+    first_year = int(latest_season[:2])
+    return ['%02d%02d' % (year, year + 1) for year in range(first_year - n_seasons + 1, first_year + 1)]
+
+
+def get_team_names(div, n_teams):
+    return ['%s Team %02d' % (div, i) for i in range(n_teams)]
+
+
+def generate_league(div, n_teams, seasons, seed=0):
+    rng = np.random.default_rng(seed)
+    teams = get_team_names(div, n_teams)
+    strengths = rng.normal(0, 0.3, n_teams)
+
+    data = tablib.Dataset()
+    data.headers = columnar.CSV_HEADERS
+    for season in seasons:
+        # Strengths drift a little from season to season
+        strengths = 0.8 * strengths + rng.normal(0, 0.15, n_teams)
+        start_year = 2000 + int(season[:2])
+        for round_idx, pairs in enumerate(_get_rounds(n_teams, rng)):
+            date = np.datetime64('%d-08-01' % start_year) + np.timedelta64(7 * round_idx, 'D')
+            date = date.astype(object).strftime('%d/%m/%Y')
+            for home, away in pairs:
+                data.append(_generate_match(div, season, date, teams[home], teams[away],
+                                            strengths[home], strengths[away], rng))
+    return data
+
+
+def generate_fixtures(divs, n_teams, seed=0):
+    # One round of upcoming matches for each league, in the fixtures/fixtures.csv layout
+    rng = np.random.default_rng(seed)
+    fixtures = tablib.Dataset()
+    fixtures.headers = ['Div', 'Date', 'Time', 'HomeTeam', 'AwayTeam']
+    for div in divs:
+        teams = get_team_names(div, n_teams)
+        order = rng.permutation(n_teams)
+        for home, away in zip(order[0::2], order[1::2]):
+            fixtures.append([div, '01/05/2021', '15:00', teams[home], teams[away]])
+    return fixtures
+
+
+def _get_rounds(n_teams, rng):
+    # A double round robin (the circle method), as lists of (home, away) pairs
+    teams = list(rng.permutation(n_teams))
+    if n_teams % 2:
+        teams.append(None)
+    n = len(teams)
+    first_half = []
+    for round_idx in range(n - 1):
+        pairs = [(teams[i], teams[n - 1 - i]) for i in range(n // 2)]
+        # Otherwise the first team would play every first-half match at home
+        if round_idx % 2:
+            pairs[0] = pairs[0][::-1]
+        first_half.append([pair for pair in pairs if None not in pair])
+        teams = [teams[0], teams[-1]] + teams[1:-1]
+    second_half = [[(away, home) for home, away in pairs] for pairs in first_half]
+    return first_half + second_half
+
+
+def _generate_match(div, season, date, home_team, away_team, home_strength, away_strength, rng):
+    home_rate = MEAN_GOALS * np.exp(HOME_ADVANTAGE + home_strength - away_strength)
+    away_rate = MEAN_GOALS * np.exp(away_strength - home_strength)
+    home_goals, away_goals = rng.poisson(home_rate), rng.poisson(away_rate)
+    ftr = 'H' if home_goals > away_goals else 'A' if away_goals > home_goals else 'D'
+
+    # Rough outcome probabilities from the same strengths, priced with a bookmaker's margin
+    diff = HOME_ADVANTAGE + home_strength - away_strength
+    draw = 0.27 * np.exp(-diff ** 2)
+    home = (1 - draw) / (1 + np.exp(-2.5 * diff))
+    away = 1 - draw - home
+    odds = ['%.2f' % (1 / (p * margin)) for margin in [1.02, 1.06] for p in [home, draw, away]]
+
+    return [div, season, date, home_team, away_team, str(home_goals), str(away_goals), ftr] + odds
@@ -0,0 +1,48 @@
+import os
+import threading
+
+
+# AWS clients and resources, created the first time they're used rather than at import time, so a
+# Lambda only pays for (and imports boto3 for) the ones it actually needs. Everything asks for them here,
+# so each kind is created once per process and shared.
+#
+# boto3 clients are thread-safe but resources aren't, so code that runs in several threads should use
+# client() (e.g. historical.py's download threads).
+
+_lock = threading.Lock()
+_clients = dict()
+
+
+def client(service):
+    return _get(('client', service))
+
+
+def resource(service):
+    return _get(('resource', service))
+
+
+def _get(kind_and_service):
+    if kind_and_service not in _clients:
+        with _lock:
+            if kind_and_service not in _clients:
+                _clients[kind_and_service] = _create(*kind_and_service)
+    return _clients[kind_and_service]
+
+
+def _create(kind, service):
+    import boto3
+
+    if kind == 'client':
+        return boto3.client(service)
+    return boto3.resource(service)
+
+
+def _reset():
+    # boto3 clients aren't safe to share with a forked process (e.g. parallel.map_in_processes), so a
+    # child creates its own when it first needs them
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+
+
+os.register_at_fork(after_in_child=_reset)
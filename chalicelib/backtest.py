@@ -0,0 +1,257 @@
+import argparse
+import botocore
+import json
+import logging
+import numpy as np
+import os
+import re
+import time
+from . import binning
+from . import columnar
+from . import historical_data
+from . import match_predictions
+from . import parallel
+from . import team_state
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# A walk-forward backtest of the PPG models: for each league, the models are fitted (as train_classifiers
+# does) on the matches before a point in time, used to predict the matches of the next retrain_days, then
+# refitted with those matches added, and so on through the league's history. The predictions are scored
+# against the actual results, and against the bookmakers' odds for the same matches.
+#
+# The PPG features are replayed once per league: a match's features only depend on the matches before it,
+# so the features of the first N matches are the same as if only those N had been replayed. (Live
+# predictions take the teams' latest PPG from the last PREDICTION_WINDOW matches instead of the whole
+# history, so the features for a given match can differ slightly.)
+#
+# Run it with the same environment variables as the functions:
+#
+#   python -m chalicelib.backtest [--dir DIR | --bucket BUCKET] [--leagues E0,D1] [--retrain-days 7]
+#                                 [--output backtest.json]
+
+RETRAIN_DAYS = 7
+# No predictions are made until there are this many matches to train on
+MIN_TRAINING_MATCHES = 300
+# fit_classifiers bins the features of the matches after the first SETTLE_MATCHES, so it needs more than that
+MIN_FIT_MATCHES = binning.SETTLE_MATCHES + 1
+
+
+def backtest_league(table, retrain_days=RETRAIN_DAYS, min_training_matches=MIN_TRAINING_MATCHES):
+    # Returns the rows of table that were predicted, their predicted H/D/A percentages and the number of refits
+    min_training_matches = max(min_training_matches, MIN_FIT_MATCHES)
+    features, _ = team_state.get_ppg_features(table)
+    results = table['FTR']
+
+    rows = []
+    pcts = []
+    for start, stop in get_retrain_blocks(table['Date'], retrain_days, min_training_matches):
+        home_clf, draw_clf, away_clf, _, _, _, home_fname, draw_fname, away_fname = \
+            match_predictions.fit_classifiers({fname: values[:start] for fname, values in features.items()},
+                                              results[:start])
+        block = np.arange(start, stop)
+        rows.append(block)
+        pcts.append(np.column_stack([home_clf.predict(features[home_fname][block].reshape(-1, 1)),
+                                     draw_clf.predict(features[draw_fname][block].reshape(-1, 1)),
+                                     away_clf.predict(features[away_fname][block].reshape(-1, 1))]))
+
+    if not rows:
+        return np.array([], dtype=np.int64), np.empty((0, 3)), 0
+    return np.concatenate(rows), np.concatenate(pcts), len(rows)
+
+
+def get_retrain_blocks(dates, retrain_days, min_training_matches):
+    # (start, stop) for each refit: train on the rows before start, predict rows start to stop. A block
+    # starts on a new date, so the models never see a result from the day they're predicting.
+    n = len(dates)
+    start = min_training_matches
+    while 0 < start < n and dates[start] == dates[start - 1]:
+        start += 1
+    while start < n:
+        stop = start + 1
+        while stop < n and dates[stop] < dates[start] + retrain_days:
+            stop += 1
+        yield start, stop
+        start = stop
+
+
+def get_predicted_matches(table, rows, pcts):
+    # What score() needs about the predicted matches, as plain arrays (so it can be pooled across leagues)
+    return {
+        'season': np.array([table.seasons[s] for s in table['Season'][rows]], dtype=object),
+        'result': table['FTR'][rows].astype(np.int64),
+        'pcts': pcts,
+        'avg_odds': np.column_stack([table[name][rows] for name in ['AvgH', 'AvgD', 'AvgA']]).astype(np.float64),
+        'ps_odds': np.column_stack([table[name][rows] for name in ['PSH', 'PSD', 'PSA']]).astype(np.float64),
+    }
+
+
+def score(matches, cutoff):
+    known = matches['result'] >= 0
+    result = matches['result'][known]
+    scores = {'matches': int(known.sum())}
+    scores.update(_score_probabilities(_to_probabilities(matches['pcts'][known]), result))
+
+    # The bookmakers' average odds, as probabilities (without their margin), where there are any
+    odds = matches['avg_odds'][known]
+    priced = np.isfinite(odds).all(axis=1) & (odds > 1).all(axis=1)
+    implied = 1 / odds[priced]
+    bookmaker = {'matches': int(priced.sum())}
+    bookmaker.update(_score_probabilities(implied / implied.sum(axis=1, keepdims=True), result[priced]))
+    scores['bookmaker'] = bookmaker
+
+    scores['best'] = _score_best_predictions(matches['pcts'][known], result, _get_bet_odds(matches, known),
+                                             cutoff)
+    return scores
+
+
+def score_by_season(matches, cutoff):
+    return {season: score({name: values[matches['season'] == season] for name, values in matches.items()},
+                          cutoff)
+            for season in sorted(set(matches['season']))}
+
+
+def _to_probabilities(pcts):
+    # The three models are fitted separately, so their percentages don't add up to 100 (and a linear
+    # model can go below 0)
+    probabilities = np.clip(pcts / 100, 0.01, None)
+    return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+def _score_probabilities(probabilities, result):
+    if len(result) == 0:
+        return {'accuracy': None, 'brier': None, 'log_loss': None}
+    actual = np.eye(3)[result]
+    return {
+        'accuracy': float(np.mean(probabilities.argmax(axis=1) == result)),
+        'brier': float(np.mean(((probabilities - actual) ** 2).sum(axis=1))),
+        'log_loss': float(-np.mean(np.log(probabilities[np.arange(len(result)), result]))),
+    }
+
+
+def _get_bet_odds(matches, known):
+    # Pinnacle's odds, or the average where there aren't any
+    ps_odds, avg_odds = matches['ps_odds'][known], matches['avg_odds'][known]
+    return np.where(np.isfinite(ps_odds), ps_odds, avg_odds)
+
+
+def _score_best_predictions(pcts, result, odds, cutoff):
+    # The home and away wins email_best_predictions would have sent, and what a unit stake on each
+    # would have returned
+    bets = []
+    for outcome in [columnar.RESULT_CODES['H'], columnar.RESULT_CODES['A']]:
+        picked = np.flatnonzero((pcts[:, outcome] >= cutoff) & np.isfinite(odds[:, outcome]))
+        bets.append((result[picked] == outcome, odds[picked, outcome]))
+    won = np.concatenate([b[0] for b in bets])
+    odds = np.concatenate([b[1] for b in bets])
+    if len(won) == 0:
+        return {'bets': 0, 'hit_rate': None, 'roi': None}
+    return {'bets': int(len(won)), 'hit_rate': float(won.mean()),
+            'roi': float((np.where(won, odds, 0).sum() - len(won)) / len(won))}
+
+
+def run(load, leagues, retrain_days=RETRAIN_DAYS, min_training_matches=MIN_TRAINING_MATCHES,
+        cutoff=65, n_workers=1):
+    # load(league) returns the league's columnar.LeagueTable. Returns the report. A league that has no data,
+    # or not enough matches to train on, is left out of it (see 'skipped').
+    def backtest(league):
+        start = time.perf_counter()
+        try:
+            table = load(league)
+        except FileNotFoundError:
+            LOGGER.warning("Skipping %s: no data", league)
+            return None
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ['403', '404', 'AccessDenied', 'NoSuchKey']:
+                LOGGER.warning("Skipping %s: no data", league)
+                return None
+            raise
+        needed = max(min_training_matches, MIN_FIT_MATCHES)
+        if len(table) <= needed:
+            LOGGER.warning("Skipping %s: %d matches, but it takes %d to train on", league, len(table), needed)
+            return None
+        rows, pcts, n_refits = backtest_league(table, retrain_days, min_training_matches)
+        return get_predicted_matches(table, rows, pcts), n_refits, time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = dict(zip(leagues, parallel.map_in_processes(backtest, leagues, n_workers)))
+    skipped = [league for league, result in results.items() if result is None]
+    results = {league: result for league, result in results.items() if result is not None}
+
+    report = {
+        'settings': {'retrain_days': retrain_days, 'min_training_matches': min_training_matches,
+                     'cutoff': cutoff, 'leagues': list(leagues)},
+        'leagues': dict(),
+        'skipped': skipped,
+    }
+    for league, (matches, n_refits, seconds) in results.items():
+        league_report = score(matches, cutoff)
+        league_report.update({'refits': n_refits, 'seconds': round(seconds, 3),
+                              'seasons': score_by_season(matches, cutoff)})
+        report['leagues'][league] = league_report
+
+    pooled = {name: np.concatenate([matches[name] for matches, _, _ in results.values()])
+              for name in next(iter(results.values()))[0]} if results else None
+    report['overall'] = score(pooled, cutoff) if pooled is not None else None
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def format_report(report):
+    lines = ["%-6s %7s %6s %9s %7s %9s %6s %7s %7s" % ('league', 'matches', 'refits', 'accuracy', 'brier',
+                                                      'bookmaker', 'bets', 'hits', 'roi')]
+    rows = list(report['leagues'].items())
+    if report['overall'] is not None:
+        rows.append(('all', dict(report['overall'], refits=sum(r['refits'] for _, r in rows))))
+    for league, scores in rows:
+        lines.append("%-6s %7d %6d %9s %7s %9s %6d %7s %7s" % (
+            league, scores['matches'], scores['refits'], _format(scores['accuracy'], '%.3f'),
+            _format(scores['brier'], '%.4f'), _format(scores['bookmaker']['brier'], '%.4f'),
+            scores['best']['bets'], _format(scores['best']['hit_rate'], '%.3f'),
+            _format(scores['best']['roi'], '%+.3f')))
+    lines.append("(brier: lower is better; bookmaker: the brier score of the bookmakers' average odds)")
+    if report['skipped']:
+        lines.append("Skipped (not enough data): %s" % ', '.join(report['skipped']))
+    lines.append("%d leagues in %.1f s" % (len(report['leagues']), report['seconds']))
+    return '\n'.join(lines)
+
+
+def _format(value, value_format):
+    return '-' if value is None else value_format % value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the PPG models")
+    parser.add_argument('--dir', help="read <league>.cols files from this directory instead of S3")
+    parser.add_argument('--bucket', default=os.environ.get('S3_BUCKET'))
+    parser.add_argument('--leagues', help="comma-separated (default: MAIN_LEAGUES and NEW_LEAGUES)")
+    parser.add_argument('--retrain-days', type=int, default=RETRAIN_DAYS)
+    parser.add_argument('--min-training-matches', type=int, default=MIN_TRAINING_MATCHES)
+    parser.add_argument('--cutoff', type=float, default=float(os.environ.get('PREDICTION_CUTOFF', 65)))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='backtest.json', help="where to write the report (JSON)")
+    args = parser.parse_args()
+
+    if args.leagues:
+        leagues = args.leagues.split(',')
+    else:
+        leagues = re.split(r'[,\s]+', os.environ['MAIN_LEAGUES']) + re.split(r'[,\s]+', os.environ['NEW_LEAGUES'])
+
+    if args.dir:
+        def load(league):
+            return historical_data.get_historical_data_from_file(os.path.join(args.dir, league + '.cols'))
+    else:
+        def load(league):
+            return historical_data.get_historical_data_from_s3(args.bucket, league)
+
+    report = run(load, leagues, args.retrain_days, args.min_training_matches, args.cutoff, args.workers)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(format_report(report))
+    print("Report written to %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import numpy as np
+from . import columnar
+
+
+# Width of the bins used to group matches by a feature value (e.g. PpgDiff)
+BIN_STEP = 0.1
+
+# Skip the first 50 matches to allow data to 'settle down'
+SETTLE_MATCHES = 50
+
+
+def encode_results(ftrs):
+    # Map 'H'/'D'/'A' to 0/1/2; anything else (e.g. a postponed match) becomes -1
+    return np.array([columnar.RESULT_CODES.get(ftr, -1) for ftr in ftrs], dtype=np.int8)
+
+
+def get_bin_edges(values, step=BIN_STEP):
+    start, end = np.quantile(values[SETTLE_MATCHES:], [0.05, 0.95])
+    lower = np.arange(start, end, step)
+    return lower, lower + step
+
+
+def count_results_by_bin(values, results, lower, upper):
+    # Returns an (n_bins, 3) array with the H/D/A counts of every bin [lower, upper).
+    #
+    # Rather than scanning all the rows for each bin, every row is located with a binary search.
+    # lower[i] + step isn't always exactly lower[i+1], so neighbouring bins can overlap (or leave a
+    # gap) by a rounding error. The bins containing a value always form a contiguous run, so the
+    # run is recorded as +1/-1 markers and a cumulative sum turns them into counts. That gives
+    # the same counts as testing every row against every bin.
+    values = np.asarray(values, dtype=float)
+    results = np.asarray(results)
+    n_bins = len(lower)
+
+    first = np.searchsorted(upper, values, side='right')
+    last = np.searchsorted(lower, values, side='right')
+    binned = (first < last) & (results >= 0)
+    first, last, results = first[binned], last[binned], results[binned]
+
+    size = (n_bins + 1) * len(columnar.RESULTS)
+    markers = np.bincount(first * len(columnar.RESULTS) + results, minlength=size) \
+        - np.bincount(last * len(columnar.RESULTS) + results, minlength=size)
+    return np.cumsum(markers.reshape(n_bins + 1, len(columnar.RESULTS))[:-1], axis=0)
+
+
+def count_results(values, results):
+    # Bin the values and count the H/D/A results in each bin; returns (lower bin edges, counts)
+    values = np.asarray(values, dtype=float)
+    lower, upper = get_bin_edges(values)
+    return lower, count_results_by_bin(values, results, lower, upper)
+
+
+def get_percentages_for_bins(lower, counts, ftr):
+    # Returns the (diffs, pcts) series for one result type, leaving out the bins where it never happened
+    n = counts[:, columnar.RESULT_CODES[ftr]]
+    totals = counts.sum(axis=1)
+    keepers = n > 0
+    diffs = list(lower[keepers])
+    pcts = (n[keepers] / totals[keepers] * 100.0).tolist()
+    return diffs, pcts
@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class LruCache:
+    # A least-recently-used cache, bounded by the total size of its values (in bytes, as estimated by
+    # whoever puts them). Every entry carries a version (e.g. an S3 ETag), so callers can check that
+    # what they get back is still current. It can be shared by threads.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._recorded = None
+        self._lock = threading.Lock()
+        # A forked process may have been started while another thread held the lock
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def get(self, key):
+        # Returns (version, value), or (None, None) if the key isn't cached
+        with self._lock:
+            if key not in self._entries:
+                return None, None
+            self._entries.move_to_end(key)
+            version, value, _ = self._entries[key]
+            return version, value
+
+    def put(self, key, version, value, size):
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[2]
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (version, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+            if self._recorded is not None:
+                self._recorded['entries'].append((key, version, size))
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+            if self._recorded is not None:
+                self._recorded['hits'] += 1
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+            if self._recorded is not None:
+                self._recorded['misses'] += 1
+
+    def start_recording(self):
+        # Remember the key, version and size of everything put (and the hits and misses) from now on, e.g.
+        # so that a worker process can tell its parent, which merges them in. The values aren't kept: they
+        # can be whole decoded tables, and sending them to the parent would cost more than it saves.
+        self._recorded = {'pid': os.getpid(), 'entries': [], 'hits': 0, 'misses': 0}
+
+    def stop_recording(self):
+        recorded, self._recorded = self._recorded, None
+        return recorded
+
+    def merge(self, recorded):
+        # If it was recorded in this process, it's all here already. Otherwise the other process's hits and
+        # misses are counted, and anything it read a different version of is dropped, as it's out of date.
+        if recorded['pid'] == os.getpid():
+            return
+        with self._lock:
+            for key, version, _ in recorded['entries']:
+                if key in self._entries and self._entries[key][0] != version:
+                    self.size -= self._entries.pop(key)[2]
+            self.hits += recorded['hits']
+            self.misses += recorded['misses']
@@ -0,0 +1,395 @@
+import array
+import json
+import mmap
+import numpy as np
+import struct
+import tablib
+from datetime import date, datetime
+
+
+# The columns of our historical data in CSV form (the order football-data's columns are extracted in)
+CSV_HEADERS = ['Div', 'Season', 'Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'FTR', 'PSH', 'PSD', 'PSA', 'AvgH', 'AvgD', 'AvgA']
+
+# Full-time results, in the order used wherever results are stored as codes
+RESULTS = ['H', 'D', 'A']
+RESULT_CODES = {ftr: code for code, ftr in enumerate(RESULTS)}
+
+# The typed columns stored for every match. Unknown values are stored as -1 (goals, results) or NaN (odds).
+COLUMNS = [
+    ('Date', '<i4'),        # date.toordinal()
+    ('HomeTeam', '<u2'),    # index into the table's teams
+    ('AwayTeam', '<u2'),
+    ('FTHG', 'i1'),
+    ('FTAG', 'i1'),
+    ('FTR', 'i1'),          # index into RESULTS
+    ('PSH', '<f4'),
+    ('PSD', '<f4'),
+    ('PSA', '<f4'),
+    ('AvgH', '<f4'),
+    ('AvgD', '<f4'),
+    ('AvgA', '<f4'),
+]
+ODDS_COLUMNS = ['PSH', 'PSD', 'PSA', 'AvgH', 'AvgD', 'AvgA']
+
+# File layout: MAGIC, the header length (uint32), a JSON header, then the data. The data is split into
+# row groups of up to ROW_GROUP_ROWS matches from the same season, and each row group holds its rows column
+# by column (in COLUMNS order, each column padded to 8 bytes). The header lists the teams, the seasons and
+# the first row and byte offset of every row group, so a reader can fetch just the last N matches or a
+# single season with a ranged GET.
+MAGIC = b'FPCOL\x00\x01\x00'
+HEADER_PREFIX = len(MAGIC) + 4
+ALIGNMENT = 8
+ROW_GROUP_ROWS = 100
+
+
+class LeagueTable:
+    # The matches of one league as typed columns. table['FTHG'] etc. return numpy arrays; the
+    # 'Season' column holds indexes into table.seasons.
+
+    def __init__(self, div, teams, seasons, columns):
+        self.div = div
+        self.teams = teams
+        self.seasons = seasons
+        self.columns = columns
+        self._team_ids = {team: i for i, team in enumerate(teams)}
+
+    def __len__(self):
+        return len(self.columns['Season'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def team_id(self, team):
+        # Returns None for a team that isn't in the table
+        return self._team_ids.get(team)
+
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        return LeagueTable(self.div, self.teams, self.seasons,
+                           {name: column[rows] for name, column in self.columns.items()})
+
+    def tail(self, n):
+        return self.take(np.arange(max(len(self) - n, 0), len(self)))
+
+    def for_season(self, season):
+        if season not in self.seasons:
+            return self.take([])
+        return self.take(np.flatnonzero(self['Season'] == self.seasons.index(season)))
+
+    def to_dataset(self):
+        # The table as a tablib Dataset of strings, in the historical CSV layout
+        data = tablib.Dataset()
+        data.headers = CSV_HEADERS
+        columns = [
+            [self.div] * len(self),
+            [self.seasons[s] for s in self['Season']],
+            [date.fromordinal(int(d)).strftime('%d/%m/%Y') if d > 0 else '' for d in self['Date']],
+            [self.teams[t] for t in self['HomeTeam']],
+            [self.teams[t] for t in self['AwayTeam']],
+            [str(g) if g >= 0 else '' for g in self['FTHG']],
+            [str(g) if g >= 0 else '' for g in self['FTAG']],
+            [RESULTS[r] if r >= 0 else '' for r in self['FTR']],
+        ]
+        columns += [[str(o) if not np.isnan(o) else '' for o in self[name]] for name in ODDS_COLUMNS]
+        for row in zip(*columns):
+            data.append(row)
+        return data
+
+
+def from_dataset(data, div=None):
+    # Convert a tablib Dataset in the historical CSV layout. Missing columns are filled with unknowns.
+    n = data.height
+    headers = data.headers or []
+
+    def column(name):
+        return data[name] if name in headers else [''] * n
+
+    if div is None:
+        div = data['Div'][0] if n > 0 and 'Div' in headers else ''
+
+    home_teams, away_teams = column('HomeTeam'), column('AwayTeam')
+    teams = sorted(set(home_teams) | set(away_teams))
+    team_ids = {team: i for i, team in enumerate(teams)}
+
+    season_names = column('Season')
+    seasons = list(dict.fromkeys(season_names))
+    season_ids = {season: i for i, season in enumerate(seasons)}
+
+    columns = dict()
+    columns['Season'] = np.array([season_ids[s] for s in season_names], dtype=np.uint8)
+    columns['Date'] = np.array([_parse_date(d) for d in column('Date')], dtype='<i4')
+    columns['HomeTeam'] = np.array([team_ids[t] for t in home_teams], dtype='<u2')
+    columns['AwayTeam'] = np.array([team_ids[t] for t in away_teams], dtype='<u2')
+    columns['FTHG'] = np.array([_parse_int(g) for g in column('FTHG')], dtype='i1')
+    columns['FTAG'] = np.array([_parse_int(g) for g in column('FTAG')], dtype='i1')
+    columns['FTR'] = np.array([RESULT_CODES.get(r, -1) for r in column('FTR')], dtype='i1')
+    for name in ODDS_COLUMNS:
+        columns[name] = np.array([_parse_float(o) for o in column(name)], dtype='<f4')
+
+    return LeagueTable(div, teams, seasons, columns)
+
+
+def from_rows(rows, div):
+    # Like from_dataset, for rows (sequences of strings) in the CSV_HEADERS layout. Each row is parsed as
+    # it comes and only its typed values are kept, so rows can be a generator reading a file or a download
+    # without the whole of it ever being in memory.
+    season_ids = dict()
+    team_ids = dict()
+    seasons = array.array('B')
+    dates = array.array('i')
+    home_teams = array.array('H')
+    away_teams = array.array('H')
+    goals_and_results = [array.array('b') for _ in range(3)]
+    odds = [array.array('f') for _ in ODDS_COLUMNS]
+    for row in rows:
+        seasons.append(season_ids.setdefault(row[1], len(season_ids)))
+        dates.append(_parse_date(row[2]))
+        home_teams.append(team_ids.setdefault(row[3], len(team_ids)))
+        away_teams.append(team_ids.setdefault(row[4], len(team_ids)))
+        goals_and_results[0].append(_parse_int(row[5]))
+        goals_and_results[1].append(_parse_int(row[6]))
+        goals_and_results[2].append(RESULT_CODES.get(row[7], -1))
+        for column, value in zip(odds, row[8:14]):
+            column.append(_parse_float(value))
+
+    # Teams are numbered in order of appearance while reading, but sorted in a table
+    teams = sorted(team_ids)
+    team_map = np.empty(len(teams), dtype='<u2')
+    team_map[[team_ids[team] for team in teams]] = np.arange(len(teams))
+
+    columns = dict()
+    columns['Season'] = np.frombuffer(seasons, dtype=np.uint8).copy()
+    columns['Date'] = np.frombuffer(dates, dtype=np.intc).astype('<i4')
+    columns['HomeTeam'] = team_map[np.frombuffer(home_teams, dtype=np.uint16)]
+    columns['AwayTeam'] = team_map[np.frombuffer(away_teams, dtype=np.uint16)]
+    for name, column in zip(['FTHG', 'FTAG', 'FTR'], goals_and_results):
+        columns[name] = np.frombuffer(column, dtype=np.int8).copy()
+    for name, column in zip(ODDS_COLUMNS, odds):
+        columns[name] = np.frombuffer(column, dtype=np.float32).astype('<f4')
+
+    return LeagueTable(div, teams, list(season_ids), columns)
+
+
+def concatenate(tables):
+    # One table holding the rows of tables in order. The tables can have different teams and seasons; the
+    # result's teams are sorted (as from_dataset's are) and its seasons are in order of appearance.
+    if len(tables) == 1:
+        return tables[0]
+    teams = sorted(set().union(*[table.teams for table in tables]))
+    seasons = list(dict.fromkeys(season for table in tables for season in table.seasons))
+    team_ids = {team: i for i, team in enumerate(teams)}
+    season_ids = {season: i for i, season in enumerate(seasons)}
+
+    parts = {name: [] for name in tables[0].columns}
+    for table in tables:
+        team_map = np.array([team_ids[team] for team in table.teams], dtype='<u2')
+        season_map = np.array([season_ids[season] for season in table.seasons], dtype=np.uint8)
+        for name, column in table.columns.items():
+            if name in ['HomeTeam', 'AwayTeam']:
+                column = team_map[column]
+            elif name == 'Season':
+                column = season_map[column]
+            parts[name].append(column)
+
+    return LeagueTable(tables[0].div, teams, seasons,
+                       {name: np.concatenate(arrays) for name, arrays in parts.items()})
+
+
+def get_row_keys(table):
+    # A (Season, Date, HomeTeam, AwayTeam) key for each match
+    seasons = [table.seasons[s] for s in table['Season']]
+    home_teams = [table.teams[t] for t in table['HomeTeam']]
+    away_teams = [table.teams[t] for t in table['AwayTeam']]
+    return list(zip(seasons, table['Date'].tolist(), home_teams, away_teams))
+
+
+def same_rows(table, other):
+    # Whether the two tables hold the same matches, in the same order, with the same results and odds
+    if get_row_keys(table) != get_row_keys(other):
+        return False
+    return all(np.array_equal(table[name], other[name], equal_nan=name in ODDS_COLUMNS)
+               for name in ['FTHG', 'FTAG', 'FTR'] + ODDS_COLUMNS)
+
+
+def encode(table):
+    writer = TableWriter(table.div, [get_header(table)])
+    return writer.header + writer.encode_part(table)
+
+
+def get_header(table):
+    # The header that encode writes for table, without encoding the data
+    row_groups = []
+    offset = 0
+    for season, start, stop in _get_row_group_runs(table):
+        length = _get_row_group_length(stop - start)
+        row_groups.append({'season': table.seasons[season], 'start': start, 'rows': stop - start, 'offset': offset,
+                           'length': length})
+        offset += length
+    return {'div': table.div, 'teams': table.teams, 'seasons': table.seasons, 'columns': COLUMNS,
+            'rows': len(table), 'row_groups': row_groups}
+
+
+class TableWriter:
+    # Encodes a table that's made of parts (LeagueTables in row order, e.g. one per season) a part at a
+    # time, so the whole table never has to be in memory. The header comes first, so it's worked out from
+    # the parts' headers (as from get_header, or read_header of an encoded part): a row group's length only
+    # depends on how many rows it has. The file is header followed by encode_part(part) of each part in
+    # turn; unless two parts in a row are of the same season, that's the same as
+    # encode(concatenate(parts)).
+
+    def __init__(self, div, part_headers):
+        teams = sorted(set().union(*[part_header['teams'] for part_header in part_headers]))
+        seasons = list(dict.fromkeys(season for part_header in part_headers for season in part_header['seasons']))
+        self._team_ids = {team: i for i, team in enumerate(teams)}
+
+        row_groups = []
+        rows = 0
+        offset = 0
+        for part_header in part_headers:
+            for row_group in part_header['row_groups']:
+                length = _get_row_group_length(row_group['rows'])
+                row_groups.append({'season': row_group['season'], 'start': rows, 'rows': row_group['rows'],
+                                   'offset': offset, 'length': length})
+                rows += row_group['rows']
+                offset += length
+
+        header = json.dumps({'div': div, 'teams': teams, 'seasons': seasons, 'columns': COLUMNS, 'rows': rows,
+                             'row_groups': row_groups}).encode()
+        # Pad the header with spaces so that the data starts on an aligned offset
+        header += b' ' * (-(HEADER_PREFIX + len(header)) % ALIGNMENT)
+        self.header = MAGIC + struct.pack('<I', len(header)) + header
+
+    def encode_part(self, table):
+        # The part's row groups, with its teams numbered as in the whole table
+        team_map = np.array([self._team_ids[team] for team in table.teams], dtype='<u2')
+        chunks = []
+        for _, start, stop in _get_row_group_runs(table):
+            for name, dtype in COLUMNS:
+                column = table[name][start:stop]
+                if name in ['HomeTeam', 'AwayTeam']:
+                    column = team_map[column]
+                chunk = np.ascontiguousarray(column, dtype=dtype).tobytes()
+                chunks.append(chunk + b'\0' * (-len(chunk) % ALIGNMENT))
+        return b''.join(chunks)
+
+
+def decode(buffer):
+    # buffer can be bytes or a memory map; with a single row group the columns are views into it
+    header, data_start = read_header(buffer)
+    return decode_row_groups(header, header['row_groups'], buffer, data_start)
+
+
+def load(path):
+    # Memory-map a local file
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return decode(buffer)
+
+
+def get_header_length(buffer):
+    # How many bytes of the file read_header needs (buffer must hold at least the first HEADER_PREFIX bytes)
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a columnar league file")
+    header_length, = struct.unpack('<I', buffer[len(MAGIC):HEADER_PREFIX])
+    return HEADER_PREFIX + header_length
+
+
+def read_header(buffer):
+    # Returns the header and the position where the data starts
+    data_start = get_header_length(buffer)
+    header = json.loads(bytes(buffer[HEADER_PREFIX:data_start]))
+    return header, data_start
+
+
+def get_tail_row_groups(header, n):
+    # The row groups holding the last n matches
+    row_groups = header['row_groups']
+    first = len(row_groups)
+    rows = 0
+    while first > 0 and rows < n:
+        first -= 1
+        rows += row_groups[first]['rows']
+    return row_groups[first:]
+
+
+def get_season_row_groups(header, season):
+    return [row_group for row_group in header['row_groups'] if row_group['season'] == season]
+
+
+def get_data_range(row_groups):
+    # The (start, stop) byte offsets of some consecutive row groups, relative to the start of the data
+    if not row_groups:
+        return 0, 0
+    return row_groups[0]['offset'], row_groups[-1]['offset'] + row_groups[-1]['length']
+
+
+def decode_row_groups(header, row_groups, buffer, data_start):
+    # Decode the given row groups from buffer. data_start is the position in buffer where the data
+    # starts (negative if buffer only holds a range from further into the data).
+    parts = {name: [] for name, _ in header['columns']}
+    seasons = []
+    for row_group in row_groups:
+        offset = data_start + row_group['offset']
+        for name, dtype in header['columns']:
+            parts[name].append(np.frombuffer(buffer, dtype=dtype, count=row_group['rows'], offset=offset))
+            offset += _get_chunk_length(row_group['rows'], dtype)
+        seasons.append(np.full(row_group['rows'], header['seasons'].index(row_group['season']), dtype=np.uint8))
+
+    columns = {name: _concatenate(arrays, dtype) for (name, dtype), arrays in zip(header['columns'], parts.values())}
+    columns['Season'] = _concatenate(seasons, np.uint8)
+    return LeagueTable(header['div'], header['teams'], header['seasons'], columns)
+
+
+def _get_row_group_length(rows):
+    return sum(_get_chunk_length(rows, dtype) for _, dtype in COLUMNS)
+
+
+def _get_chunk_length(rows, dtype):
+    length = rows * np.dtype(dtype).itemsize
+    return length + (-length % ALIGNMENT)
+
+
+def _concatenate(arrays, dtype):
+    if len(arrays) == 1:
+        return arrays[0]
+    if not arrays:
+        return np.array([], dtype=dtype)
+    return np.concatenate(arrays)
+
+
+def _get_row_group_runs(table):
+    # (season, start, stop) for each row group: runs of consecutive rows from the same season,
+    # split into pieces of at most ROW_GROUP_ROWS
+    seasons = table['Season']
+    if len(seasons) == 0:
+        return []
+    starts = np.flatnonzero(np.r_[True, seasons[1:] != seasons[:-1]])
+    stops = np.r_[starts[1:], len(seasons)]
+    return [(int(seasons[start]), piece_start, min(piece_start + ROW_GROUP_ROWS, int(stop)))
+            for start, stop in zip(starts, stops)
+            for piece_start in range(int(start), int(stop), ROW_GROUP_ROWS)]
+
+
+def _parse_date(value):
+    # football-data uses dd/mm/yy in older files and dd/mm/yyyy in newer ones
+    for date_format in ['%d/%m/%Y', '%d/%m/%y']:
+        try:
+            return datetime.strptime(value, date_format).toordinal()
+        except ValueError:
+            pass
+    return 0
+
+
+def _parse_int(value):
+    return int(value) if value else -1
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
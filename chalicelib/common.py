@@ -1,7 +1,10 @@
-import boto3
+import botocore
 import logging
 import tablib
 import os
+from . import aws
+from . import cache
+from . import instrumentation
 
 
 # A mapping from oddsportal.com leagues to football-data.co.uk's 'Div'
@@ -202,36 +205,58 @@ ODDSPORTAL_TEAMS = {
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-s3 = boto3.resource('s3')
-ses = boto3.client('ses')
+# Objects read from S3, kept for as long as Lambda reuses the container and revalidated against their ETag
+s3_cache = cache.LruCache(int(os.environ.get('S3_CACHE_MAX_MB', 256)) * 1024 * 1024)
 
 s3_historical_prefix = os.environ['S3_PREFIX_HISTORICAL']
 to_email_address = os.environ["EMAIL_RECIPIENT"]
 from_email_address = os.environ["EMAIL_SENDER"]
 
 
-def get_team_name(name, div):
-    if div in ODDSPORTAL_TEAMS and name in ODDSPORTAL_TEAMS[div]:
-        return ODDSPORTAL_TEAMS[div][name]
-    else:
-        return name
+def get_cached_object(bucket, key, parse, **get_args):
+    # GETs an object (or part of it, e.g. with a Range) and parses it with parse(body, etag), which returns
+    # (value, approximate size in bytes). If the object is in s3_cache, the GET is conditional on the
+    # cached ETag and an unchanged object isn't downloaded or parsed again. Returns (etag, value).
+    cache_key = ('object', bucket, key, tuple(sorted(get_args.items())))
+    etag, value = s3_cache.get(cache_key)
+    try:
+        with instrumentation.stage('s3_get', key=key):
+            if etag is not None:
+                response = aws.client('s3').get_object(Bucket=bucket, Key=key, IfNoneMatch=etag, **get_args)
+            else:
+                response = aws.client('s3').get_object(Bucket=bucket, Key=key, **get_args)
+            body = response['Body'].read()
+    except botocore.exceptions.ClientError as e:
+        if etag is not None and e.response['Error']['Code'] in ['304', 'NotModified']:
+            s3_cache.record_hit()
+            return etag, value
+        raise
 
+    s3_cache.record_miss()
+    etag = response['ETag']
+    with instrumentation.stage('parse', key=key):
+        value, size = parse(body, etag)
+    s3_cache.put(cache_key, etag, value, size)
+    return etag, value
 
-def get_historical_data_from_s3(bucket, league):
-    key = s3_historical_prefix.rstrip('/') + '/' + league + '.csv'
-    matches_file = s3.Object(bucket, key).get()['Body'].read()
-    matches = tablib.Dataset()
-    matches.csv = matches_file.decode()
-    return matches
+
+def log_s3_cache_stats():
+    LOGGER.info("S3 cache: %d hits, %d misses, %d entries, %.1f MB",
+                s3_cache.hits, s3_cache.misses, len(s3_cache), s3_cache.size / (1024 * 1024))
 
 
 def get_fixtures_from_s3(bucket, key):
+    _, fixtures = get_cached_object(bucket, key, _parse_fixtures)
+    return fixtures
+
+
+def _parse_fixtures(fixtures_file, etag):
     # Read the fixtures into CSV
-    fixtures_file = s3.Object(bucket, key).get()['Body'].read()
     fixtures = tablib.Dataset()
     fixtures.csv = fixtures_file.decode()
     fixtures = fixtures.sort('Div')
-    return fixtures
+    # A Dataset of short strings takes up roughly ten times the size of the CSV
+    return fixtures, len(fixtures_file) * 10
 
 
 def get_league_data(data, league):
@@ -245,23 +270,24 @@ def get_league_data(data, league):
 def send_mail(subject, mail_message):
     LOGGER.info("Sending mail (subject: %s)...", subject)
 
-    response = ses.send_email(
-        Destination={
-            'ToAddresses': [ to_email_address ]
-        },
-        Message={
-            'Body': {
-                'Text': {
+    with instrumentation.stage('send_mail'):
+        response = aws.client('ses').send_email(
+            Destination={
+                'ToAddresses': [ to_email_address ]
+            },
+            Message={
+                'Body': {
+                    'Text': {
+                        'Charset': 'UTF-8',
+                        'Data': mail_message,
+                    }
+                },
+                'Subject': {
                     'Charset': 'UTF-8',
-                    'Data': mail_message,
+                    'Data': subject,
                 }
             },
-            'Subject': {
-                'Charset': 'UTF-8',
-                'Data': subject,
-            }
-        },
-        Source=from_email_address
-    )
+            Source=from_email_address
+        )
 
     LOGGER.info("Mail sent: %s", response)
@@ -0,0 +1,167 @@
+import botocore
+import io
+import json
+import logging
+import numpy as np
+import os
+from . import aws
+from . import columnar
+from . import common
+from . import team_state
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# The PPG features of a league's matches, worked out by fetch_historical_data whenever it writes new
+# matches, so that make_predictions doesn't have to replay the history:
+#
+#   - every match's features (as from team_state.get_ppg_features) and its result, for training
+#   - where every team stands after the last PREDICTION_WINDOW matches (a team_state.LatestState), for
+#     predicting
+#   - the teams' accumulators after the last match (a team_state.TeamState), as a checkpoint
+#
+# When fetch_historical_data appends matches to a league, the features of the new matches are worked out
+# from the checkpoint, so the cost doesn't grow with the history. Only if there's no checkpoint for the
+# data the matches were appended to (or FEATURES_FULL_REPLAY is true) is the whole league replayed.
+#
+# They're stored under S3_PREFIX_FEATURES (one .npz file per league), tagged with the version of the
+# historical data they were worked out from (see HistoricalDataReader.version). Features for any other
+# version are ignored, and make_predictions works them out from the data itself, as it does if
+# S3_PREFIX_FEATURES isn't set.
+
+# Bump this whenever what's stored changes, so that older files are ignored
+FEATURES_FORMAT = 4
+
+
+class LeagueFeatures:
+
+    def __init__(self, version, features, results, latest_state, state):
+        self.version = version
+        self.features = features
+        self.results = results
+        self.latest_state = latest_state
+        self.state = state
+
+
+def compute_features(version, tables):
+    # The LeagueFeatures of a league's matches (columnar.LeagueTables in order, e.g. one per season),
+    # replaying all of them a table at a time, so that only one of them has to be in memory
+    state = team_state.TeamState([], np.zeros((0, team_state.N_ACCUMULATORS), dtype=np.int64))
+    features = {fname: [] for fname in team_state.FEATURES}
+    results = []
+    window = None
+    for table in tables:
+        table_features, state = team_state.update_ppg_features(state, table)
+        for fname in team_state.FEATURES:
+            features[fname].append(table_features[fname])
+        results.append(table['FTR'].copy())
+        # The window has all the tables' teams, as the tail of all of them would
+        window = table if window is None else columnar.concatenate([window, table])
+        window = window.tail(team_state.PREDICTION_WINDOW)
+    features = {fname: np.concatenate(values) for fname, values in features.items()}
+    return LeagueFeatures(version, features, np.concatenate(results), team_state.get_latest_state(window), state)
+
+
+def update_features(league_features, version, tail, new_matches):
+    # The LeagueFeatures after new_matches are added to the matches of league_features, carrying on from
+    # its checkpoint. tail is (at least) the last PREDICTION_WINDOW of the matches before new_matches.
+    features, state = team_state.update_ppg_features(league_features.state, new_matches)
+    features = {fname: np.concatenate([league_features.features[fname], features[fname]])
+                for fname in team_state.FEATURES}
+    results = np.concatenate([league_features.results, new_matches['FTR']])
+    window = columnar.concatenate([tail, new_matches]).tail(team_state.PREDICTION_WINDOW)
+    return LeagueFeatures(version, features, results, team_state.get_latest_state(window), state)
+
+
+def save_features(bucket, league, version, get_tables):
+    # Works out and stores the features of the league's data, as of version. get_tables returns the data
+    # (columnar.LeagueTables in order; see compute_features); it's only called if the features are stored.
+    if 'S3_PREFIX_FEATURES' not in os.environ:
+        return
+    _put(bucket, league, compute_features(version, get_tables()))
+
+
+def save_appended_features(bucket, league, old_version, version, new_matches, get_tail, get_tables):
+    # Stores the features of the league's data after new_matches were appended to version old_version of
+    # it, making version. get_tail(n) returns the last n matches of old_version, and get_tables all the
+    # matches of version (as for save_features); they're only called if they're needed.
+    if 'S3_PREFIX_FEATURES' not in os.environ:
+        return
+    league_features = None
+    if os.environ.get('FEATURES_FULL_REPLAY', 'false').lower() != 'true':
+        league_features = load_features(bucket, league, old_version)
+    if league_features is not None:
+        tail = get_tail(team_state.PREDICTION_WINDOW)
+        # The checkpoint has to be for exactly the matches the new ones were appended to
+        last_key = columnar.get_row_keys(tail.tail(1))[0] if len(tail) > 0 else None
+        if league_features.state.last_key != last_key:
+            LOGGER.warning("The checkpoint for %s isn't for its last match; replaying the league", league)
+            league_features = None
+    if league_features is None:
+        LOGGER.info("Replaying %s to work out its features", league)
+        league_features = compute_features(version, get_tables())
+    else:
+        LOGGER.info("Updating the features for %s from its checkpoint with %d matches", league,
+                    len(new_matches))
+        league_features = update_features(league_features, version, tail, new_matches)
+    _put(bucket, league, league_features)
+
+
+def _put(bucket, league, league_features):
+    key = _get_key(league)
+    LOGGER.info("Writing features for %s (data version %s) to %s/%s", league, league_features.version,
+                bucket, key)
+    aws.client('s3').put_object(Bucket=bucket, Key=key, Body=encode(league_features))
+
+
+def load_features(bucket, league, version):
+    # Returns the league's LeagueFeatures if they're for version of its data, otherwise None
+    if 'S3_PREFIX_FEATURES' not in os.environ:
+        return None
+    try:
+        _, league_features = common.get_cached_object(bucket, _get_key(league),
+                                                      lambda body, etag: (decode(body), len(body)))
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ['403', '404', 'AccessDenied', 'NoSuchKey']:
+            LOGGER.info("No stored features for %s", league)
+            return None
+        raise
+
+    if league_features is None or league_features.version != version:
+        LOGGER.info("Stored features for %s are out of date (data version %s, expected %s)", league,
+                    league_features.version if league_features is not None else None, version)
+        return None
+    return league_features
+
+
+def encode(league_features):
+    latest_state, state = league_features.latest_state, league_features.state
+    arrays = {'format': np.array(FEATURES_FORMAT), 'version': np.array(league_features.version),
+              'results': league_features.results, 'teams': np.array(latest_state.teams, dtype=str)}
+    arrays.update({'feature_' + fname: values for fname, values in league_features.features.items()})
+    arrays.update({'latest_' + name: values for name, values in latest_state.arrays().items()})
+    arrays.update({'state_teams': np.array(state.teams, dtype=str), 'state_totals': state.totals,
+                   'state_matches': np.array(state.n_matches),
+                   'state_last_key': np.array(json.dumps(state.last_key))})
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode(body):
+    # Returns None for a file in an older format
+    with np.load(io.BytesIO(body), allow_pickle=False) as arrays:
+        if int(arrays['format']) != FEATURES_FORMAT:
+            return None
+        features = {fname: arrays['feature_' + fname] for fname in team_state.FEATURES}
+        latest = {name[len('latest_'):]: arrays[name] for name in arrays.files if name.startswith('latest_')}
+        latest_state = team_state.LatestState(arrays['teams'].tolist(), **latest)
+        last_key = json.loads(str(arrays['state_last_key']))
+        state = team_state.TeamState(arrays['state_teams'].tolist(), arrays['state_totals'],
+                                     int(arrays['state_matches']), tuple(last_key) if last_key else None)
+        return LeagueFeatures(str(arrays['version']), features, arrays['results'], latest_state, state)
+
+
+def _get_key(league):
+    return os.environ['S3_PREFIX_FEATURES'].rstrip('/') + '/' + league + '.npz'
@@ -1,23 +1,18 @@
-import boto3
 import logging
 import os
 import requests
 import tablib
-from chalice import Blueprint
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
+from . import aws
 from . import common
+from . import team_names
 
 
-fixtures = Blueprint(__name__)
-
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-s3 = boto3.resource('s3')
-
 
-@fixtures.schedule('cron(0 18 * * ? *)')
 def get_fixtures(event):
 
     # Set up the requests Session with retries
@@ -60,12 +55,8 @@ def get_fixtures(event):
         s3_bucket = os.environ['S3_BUCKET']
         s3_key = 'fixtures/fixtures.csv'
         LOGGER.info("Writing fixtures to %s/%s", s3_bucket, s3_key)
-        s3.Object(s3_bucket, s3_key).put(Body=subset.export('csv'))
-
-        # Temporarily make a copy to trigger the draw predictions
-        # Necessary because an S3 event for a particular file can't trigger > 1 lambda
-        # The 'right' thing would be to use an SNS topic
-        s3.Object(s3_bucket, 'fixtures/fixtures.copy').put(Body=subset.export('csv'))
+        # This triggers make_predictions, which runs all the predictors (see predictions.py)
+        aws.resource('s3').Object(s3_bucket, s3_key).put(Body=subset.export('csv'))
     else:
         LOGGER.info("*** No appropriate fixtures. Not writing CSV file. ***")
 
@@ -91,8 +82,17 @@ def _change_headers(data):
 
 def _convert_home_team_name(row):
     div, home_team = row[0], row[3]
-    return common.get_team_name(home_team, div)
+    return _get_team_name(home_team, div)
 
 def _convert_away_team_name(row):
     div, away_team = row[0], row[4]
-    return common.get_team_name(away_team, div)
+    return _get_team_name(away_team, div)
+
+# One index per league. The historical data isn't read here, so only ODDSPORTAL_TEAMS is used; the
+# predictions resolve the names again against the league's actual teams.
+_team_name_indexes = dict()
+
+def _get_team_name(name, div):
+    if div not in _team_name_indexes:
+        _team_name_indexes[div] = team_names.TeamNameIndex(div, [], fuzzy=False)
+    return _team_name_indexes[div].resolve(name) or name
@@ -1,22 +1,49 @@
-import boto3
 import botocore
+import codecs
+import csv
+import itertools
+import json
 import logging
 import os
 import requests
-from chalice import Blueprint
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-import tablib
+from email.utils import format_datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from . import aws
+from . import columnar
+from . import feature_store
+from . import historical_data
 
 
-history = Blueprint(__name__)
-
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-s3 = boto3.resource('s3')
+# Where each of our columns (after Div and Season; see columnar.CSV_HEADERS) is in football-data's files,
+# which name them differently in different files: the first of the names that a file has is used
+FOOTBALL_DATA_COLUMNS = [
+    ['Date'],
+    ['Home', 'HomeTeam'],
+    ['Away', 'AwayTeam'],
+    ['HG', 'FTHG'],
+    ['AG', 'FTAG'],
+    ['Res', 'FTR'],
+    ['PH', 'PSH'],
+    ['PD', 'PSD'],
+    ['PA', 'PSA'],
+    ['AvgH', 'BbAvH'],
+    ['AvgD', 'BbAvD'],
+    ['AvgA', 'BbAvA'],
+]
+
+# How much of a download to read at a time
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+# How much of a season's file to read to get its header (a season's header is about 1 KB)
+SEASON_HEADER_BYTES = 4 * 1024
 
 
-@history.schedule('cron(0 1,13 * * ? *)')
 def fetch_historical_data(event):
 
     base_url_main = 'https://www.football-data.co.uk/mmz4281/'
@@ -28,36 +55,57 @@ def fetch_historical_data(event):
     s3_bucket = os.environ['S3_BUCKET']
     s3_prefix = os.environ['S3_PREFIX_HISTORICAL']
 
-    n_updates = 0
-
-    # Check each 'main' league for updates and overwrite if necessary
-    for league in [l.strip() for l in main_leagues.split(',')]:
-        n_updates += _update_historical_data(s3_bucket, s3_prefix, base_url_main, league,
-                                             latest_season=latest_season,
-                                             previous_seasons=previous_seasons)
-    # Check each 'new' league for updates and overwrite if necessary
-    for league in [l.strip() for l in new_leagues.split(',')]:
-        n_updates += _update_historical_data(s3_bucket, s3_prefix,
-                                             base_url_new, league)
+    # How many leagues to check/download at the same time
+    concurrency = int(os.environ.get('HISTORICAL_CONCURRENCY', 8))
+    session = _get_session(concurrency)
+
+    # Check each 'main' and 'new' league for updates and overwrite if necessary
+    jobs = [(base_url_main, league, latest_season, previous_seasons)
+            for league in [l.strip() for l in main_leagues.split(',')]]
+    jobs += [(base_url_new, league, None, None)
+             for league in [l.strip() for l in new_leagues.split(',')]]
+
+    # The threads share one S3 client (clients are thread-safe; resources aren't)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        n_updates = sum(executor.map(
+            lambda job: _update_historical_data(session, s3_bucket, s3_prefix, job[0], job[1],
+                                                latest_season=job[2], previous_seasons=job[3]),
+            jobs))
+
     return {
         'statusCode': 200,
         'body': "Number of updates: {}".format(n_updates)
     }
 
 
-def _update_historical_data(s3_bucket, s3_prefix, base_url, league, latest_season=None, previous_seasons=None):
+def _get_session(concurrency):
+    # One pooled session with retries, shared by all the download threads
+    session = requests.Session()
+    retries = Retry(total=5, backoff_factor=1, status_forcelist=[ 500, 502, 503, 504 ])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
-        # Check last-modified time of our copy of the file
-        s3object = _get_historical_data_from_s3(s3_bucket, s3_prefix, league)
-        our_last_modified = _get_last_modified(s3object)
+def _update_historical_data(session, s3_bucket, s3_prefix, base_url, league, latest_season=None, previous_seasons=None):
 
-        # Download the data for the latest season
+        # Check last-modified time of our copy of the data (the manifest changes whenever matches are added)
+        s3_key = historical_data.get_base_key(s3_prefix, league)
+        manifest_key = historical_data.get_manifest_key(s3_prefix, league)
+        our_last_modified = _get_last_modified(s3_bucket, manifest_key) or _get_last_modified(s3_bucket, s3_key)
+
+        # Download the data for the latest season, unless it hasn't changed since our copy was written
         url = base_url
         if latest_season:
             url = base_url + latest_season
-        latest_data = _download_football_data(url, league)
+        latest_data = _download_football_data(session, url, league, if_modified_since=our_last_modified)
+        if latest_data is None:
+            LOGGER.info("No changes for %s.", league)
+            return 0
 
-        # Compare last-modified dates; if latest_data is not newer, then nothing to do
+        # Compare last-modified dates, in case the server ignored If-Modified-Since;
+        # if latest_data is not newer, then nothing to do
         # (Not sure if I'm doing the right thing here with UTC -- prob. should be BST)
         their_last_modified = datetime.strptime(
             latest_data.headers['Last-Modified'], "%a, %d %b %Y %H:%M:%S %Z").astimezone(timezone.utc)
@@ -67,73 +115,283 @@ def _update_historical_data(s3_bucket, s3_prefix, base_url, league, latest_seaso
             LOGGER.info("No changes for %s.", league)
             return 0
 
-        # Get the previous seasons' data (for 'main' leagues only), combine it with latest season's data, and write to S3
-        data = tablib.Dataset()
-        data.headers = ['Div', 'Season', 'Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG', 'FTR', 'PSH', 'PSD', 'PSA', 'AvgH', 'AvgD', 'AvgA']
-        if previous_seasons:
-            for season in sorted([s.strip() for s in previous_seasons.split(',')]):
-                url = base_url + season
-                past_season_data = _download_football_data(url, league)
-                [data.append(row) for row in _extract_data(past_season_data, league, season)]
-
-        [data.append(row) for row in _extract_data(latest_data, league, latest_season)]
+        latest_season_data = _read_football_data(latest_data, league, latest_season)
+        previous_seasons = sorted([s.strip() for s in previous_seasons.split(',')]) if previous_seasons else []
 
-        LOGGER.info("Writing data to %s/%s/%s.csv", s3_bucket, s3_prefix, league)
-        s3object.put(Body=data.export('csv'))
+        # Usually the latest season's file just has a few more matches at the end than we've got, so only
+        # those are uploaded, as a new segment
+        appended = _append_historical_data(s3_bucket, s3_prefix, league, latest_season, previous_seasons,
+                                           latest_season_data)
+        if appended is not None:
+            return appended
 
+        # Write the previous seasons' data (for 'main' leagues only) to S3 followed by the latest season's data,
+        # a season at a time
+        parts = [_get_past_season_part(session, s3_bucket, s3_prefix, base_url, league, season)
+                 for season in previous_seasons]
+        _write_historical_data(s3_bucket, s3_prefix, league, latest_season, previous_seasons,
+                               parts + [_get_part(latest_season_data)])
         return 1
 
 
-def _extract_data(season_data, league, season):
-    data = tablib.Dataset()
-    data.csv = season_data.text
-    div = [league] * data.height
-    season = [season] * data.height
-    dates = data['Date']
-    home_teams = data['Home'] if 'Home' in data.headers else data['HomeTeam']
-    away_teams = data['Away'] if 'Away' in data.headers else data['AwayTeam']
-    home_goals = data['HG'] if 'HG' in data.headers else data['FTHG']
-    away_goals = data['AG'] if 'AG' in data.headers else data['FTAG']
-    results = data['Res'] if 'Res' in data.headers else data['FTR']
-    pshs = data['PH'] if 'PH' in data.headers else data['PSH']
-    psds = data['PD'] if 'PD' in data.headers else data['PSD']
-    psas = data['PA'] if 'PA' in data.headers else data['PSA']
-    avgH = data['AvgH'] if 'AvgH' in data.headers else data['BbAvH']
-    avgD = data['AvgD'] if 'AvgD' in data.headers else data['BbAvD']
-    avgA = data['AvgA'] if 'AvgA' in data.headers else data['BbAvA']
+def _append_historical_data(s3_bucket, s3_prefix, league, latest_season, previous_seasons, latest):
+    # Uploads the matches at the end of latest (the latest season's columnar.LeagueTable) that we haven't
+    # got as a new segment. Returns 1 if it did, 0 if there are no new matches, or None if the data has to
+    # be rewritten instead: there's no manifest yet, the seasons have changed, there are
+    # HISTORICAL_MAX_SEGMENTS segments already, or what we've got for the latest season isn't exactly the
+    # start of latest.
+    _, manifest = historical_data.read_manifest(s3_bucket, historical_data.get_manifest_key(s3_prefix, league))
+    if manifest is None:
+        return None
+    reader = historical_data.HistoricalDataReader(s3_bucket, league)
+    if reader.manifest is None or reader.manifest['latest_season'] != latest_season \
+            or reader.manifest['previous_seasons'] != previous_seasons:
+        return None
+    # A copy, so that the reader still reads the data as it was before the new segment
+    manifest = dict(reader.manifest, segments=list(reader.manifest['segments']))
+
+    stored = reader.read_season(latest_season)
+    if len(stored) > len(latest) or not columnar.same_rows(stored, latest.take(range(len(stored)))):
+        LOGGER.info("Some of the matches we've got for %s have changed", league)
+        return None
+    if len(stored) == len(latest):
+        LOGGER.info("No new matches for %s.", league)
+        return 0
+    if len(manifest['segments']) >= int(os.environ.get('HISTORICAL_MAX_SEGMENTS', 10)):
+        LOGGER.info("%s has %d segments; compacting", league, len(manifest['segments']))
+        return None
+
+    new_matches = latest.take(range(len(stored), len(latest)))
+    segment_key = historical_data.get_segment_key(s3_prefix, league, manifest['base_etag'], len(manifest['segments']))
+    LOGGER.info("Appending %d matches to %s in %s/%s", len(new_matches), league, s3_bucket, segment_key)
+    response = aws.client('s3').put_object(Bucket=s3_bucket, Key=segment_key, Body=columnar.encode(new_matches))
+    manifest['segments'].append({'key': segment_key, 'etag': response['ETag'], 'rows': len(new_matches)})
+    version = _put_manifest(s3_bucket, s3_prefix, league, manifest)
+
+    get_tables = lambda: [reader.read_all(), new_matches]
+    feature_store.save_appended_features(s3_bucket, league, reader.version, version, new_matches,
+                                         reader.read_tail, get_tables)
+    _export_csv(s3_bucket, s3_prefix, league, get_tables)
+    return 1
+
+
+def _write_historical_data(s3_bucket, s3_prefix, league, latest_season, previous_seasons, parts):
+    # Writes a new base with all the data, and a manifest without segments. The data is in parts (see
+    # _get_part), which are read, written and let go of one at a time (see columnar.TableWriter and
+    # _upload), so however many seasons there are, only one of them is in memory at once.
+    s3_key = historical_data.get_base_key(s3_prefix, league)
+    _, old_manifest = historical_data.read_manifest(s3_bucket, historical_data.get_manifest_key(s3_prefix, league))
+    writer = columnar.TableWriter(league, [header for header, _ in parts])
+    get_tables = lambda: (get_table() for _, get_table in parts)
+    LOGGER.info("Writing data to %s/%s", s3_bucket, s3_key)
+    etag = _upload(s3_bucket, s3_key, itertools.chain([writer.header], map(writer.encode_part, get_tables())))
+
+    version = _put_manifest(s3_bucket, s3_prefix, league, {'base_etag': etag,
+                                                           'latest_season': latest_season,
+                                                           'previous_seasons': previous_seasons, 'segments': []})
+
+    feature_store.save_features(s3_bucket, league, version, get_tables)
+    _export_csv(s3_bucket, s3_prefix, league, get_tables)
+
+    # The old segments are in the new base now. Nothing reads them once the new manifest is written, so one
+    # that can't be deleted is only left behind.
+    for segment in old_manifest['segments'] if old_manifest is not None else []:
+        try:
+            aws.client('s3').delete_object(Bucket=s3_bucket, Key=segment['key'])
+        except botocore.exceptions.ClientError as e:
+            LOGGER.warning("Couldn't delete %s/%s: %s", s3_bucket, segment['key'], e)
+
+
+def _put_manifest(s3_bucket, s3_prefix, league, manifest):
+    # Returns the manifest's ETag, which is the data's new version (see HistoricalDataReader.version)
+    manifest_key = historical_data.get_manifest_key(s3_prefix, league)
+    response = aws.client('s3').put_object(Bucket=s3_bucket, Key=manifest_key, Body=json.dumps(manifest).encode(),
+                                           ContentType='application/json')
+    return response['ETag']
+
+
+def _export_csv(s3_bucket, s3_prefix, league, get_tables):
+    # The CSV version is only for looking at the data; nothing reads it
+    if os.environ.get('HISTORICAL_EXPORT_CSV', 'false').lower() == 'true':
+        csv_key = historical_data.get_base_key(s3_prefix, league)[:-len('.cols')] + '.csv'
+        LOGGER.info("Exporting data to %s/%s", s3_bucket, csv_key)
+        _upload(s3_bucket, csv_key, _iter_csv(get_tables()))
+
+
+def _iter_csv(tables):
+    # The tables' rows as one CSV file, a table at a time (with the header line only at the start)
+    for i, table in enumerate(tables):
+        text = table.to_dataset().export('csv')
+        if i > 0:
+            text = text.split('\n', 1)[1]
+        yield text.encode()
+
+
+def _upload(bucket, key, chunks):
+    # Writes the chunks (bytes) to bucket/key one after another, without holding more than about
+    # HISTORICAL_UPLOAD_PART_BYTES of them: a file that's bigger than that is uploaded in parts of that size.
+    # Returns the object's ETag.
+    s3 = aws.client('s3')
+    part_bytes = int(os.environ.get('HISTORICAL_UPLOAD_PART_BYTES', 8 * 1024 * 1024))
+    buffer = bytearray()
+    upload_id = None
+    parts = []
+    try:
+        for chunk in chunks:
+            buffer += chunk
+            if len(buffer) >= part_bytes:
+                if upload_id is None:
+                    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+                parts.append(_upload_part(s3, bucket, key, upload_id, len(parts) + 1, buffer))
+                buffer = bytearray()
+        if upload_id is None:
+            return s3.put_object(Bucket=bucket, Key=key, Body=bytes(buffer))['ETag']
+        if buffer:
+            parts.append(_upload_part(s3, bucket, key, upload_id, len(parts) + 1, buffer))
+        response = s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                MultipartUpload={'Parts': parts})
+        return response['ETag']
+    except Exception:
+        # Otherwise S3 keeps (and charges for) the parts that were uploaded
+        if upload_id is not None:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+
+def _upload_part(s3, bucket, key, upload_id, part_number, body):
+    response = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=bytes(body))
+    return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+
+def _get_part(table):
+    # A part of the data for _write_historical_data: the header table would have on its own (see
+    # columnar.TableWriter), and a function returning table
+    return columnar.get_header(table), lambda: table
+
+
+def _get_past_season_part(session, s3_bucket, s3_prefix, base_url, league, season):
+    # Finished seasons never change, so each one is only downloaded once and then kept in S3. Only the
+    # header is read now; the season's matches are read again when they're written.
+    s3_key = _get_season_key(s3_prefix, league, season)
+    header = _read_season_header_from_s3(s3_bucket, s3_key)
+    if header is None:
+        past_season_data = _download_football_data(session, base_url + season, league)
+        season_data = _read_football_data(past_season_data, league, season)
+        LOGGER.info("Caching season %s of %s in %s/%s", season, league, s3_bucket, s3_key)
+        aws.client('s3').put_object(Bucket=s3_bucket, Key=s3_key, Body=columnar.encode(season_data))
+        header = columnar.get_header(season_data)
+    return header, lambda: _read_season_from_s3(s3_bucket, s3_key)
+
+
+def _read_season_header_from_s3(bucket, key):
+    # Reads just the header (see columnar.read_header); the first range is usually enough
+    body = _read_range_from_s3(bucket, key, 0, SEASON_HEADER_BYTES)
+    if body is None:
+        return None
+    header_length = columnar.get_header_length(body)
+    if header_length > len(body):
+        body += _read_range_from_s3(bucket, key, len(body), header_length)
+    header, _ = columnar.read_header(body)
+    return header
+
+
+def _read_range_from_s3(bucket, key, start, stop):
+    try:
+        response = aws.client('s3').get_object(Bucket=bucket, Key=key, Range='bytes=%d-%d' % (start, stop - 1))
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ['403', '404', 'AccessDenied', 'NoSuchKey']:
+            # The object does not exist.
+            LOGGER.info("%s/%s does not exist", bucket, key)
+            return None
+        else:
+            # Something else has gone wrong.
+            raise
+    return response['Body'].read()
+
+
+def _read_season_from_s3(bucket, key):
+    response = aws.client('s3').get_object(Bucket=bucket, Key=key)
+    return columnar.decode(response['Body'].read())
+
+
+def _read_football_data(response, league, season):
+    # Parses a download from football-data as it arrives, into a columnar.LeagueTable
+    try:
+        return columnar.from_rows(_extract_rows(_iter_lines(response), league, season), league)
+    finally:
+        response.close()
+
+
+def _iter_lines(response):
+    # The lines of the response's text (with their line endings), decoded a chunk at a time. As with
+    # response.text, a CSV served without a charset is taken to be ISO-8859-1.
+    decoder = codecs.getincrementaldecoder(response.encoding or 'ISO-8859-1')(errors='replace')
+    rest = ''
+    for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+        lines = (rest + decoder.decode(chunk)).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    rest += decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+
+def _extract_rows(lines, league, season):
+    # Rows in our CSV layout (columnar.CSV_HEADERS) from the lines of one of football-data's CSV files
+    rows = csv.reader(lines)
+    headers = next(rows, [])
+    positions = [_get_column_position(headers, names) for names in FOOTBALL_DATA_COLUMNS]
+    for row in rows:
+        # Like tablib, skip blank lines and treat missing values at the end of a row as empty
+        if row:
+            yield [league, season] + [row[i] if i < len(row) else '' for i in positions]
+
 
-    return zip(div, season, dates, home_teams, away_teams, home_goals, away_goals, results, pshs, psds, psas, avgH, avgD, avgA)
+def _get_column_position(headers, names):
+    for name in names:
+        if name in headers:
+            return headers.index(name)
+    raise KeyError("None of the columns %s in the data from football-data" % names)
 
 
-def _get_historical_data_from_s3(bucket, prefix, league):
-    key = prefix.rstrip('/') + '/' + league + '.csv'
-    return s3.Object(bucket, key)
+def _get_season_key(prefix, league, season):
+    # e.g. historical/seasons/1920/E0.cols
+    return prefix.rstrip('/') + '/seasons/' + season + '/' + league + '.cols'
 
 
-def _get_last_modified(s3object):
+def _get_last_modified(bucket, key):
     last_modified = None
     try:
-        s3object.load()
+        response = aws.client('s3').head_object(Bucket=bucket, Key=key)
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] in ['403', '404']:
             # The object does not exist.
-            LOGGER.info("%s/%s does not exist", s3object.bucket_name, s3object.key)
+            LOGGER.info("%s/%s does not exist", bucket, key)
         else:
             # Something else has gone wrong.
             raise
     else:
         # The object does exist
-        last_modified = s3object.last_modified
+        last_modified = response['LastModified']
 
-    LOGGER.info("%s/%s last modified: %s" , s3object.bucket_name, s3object.key, last_modified)
+    LOGGER.info("%s/%s last modified: %s" , bucket, key, last_modified)
     return last_modified
 
 
-def _download_football_data(base_url, league):
+def _download_football_data(session, base_url, league, if_modified_since=None):
     # e.g https://www.football-data.co.uk/mmz4281/2021/E0.csv,
     # or https://www.football-data.co.uk/new/AUT.csv
+    # Returns None if the file hasn't been modified since if_modified_since
     url = base_url.rstrip('/') + '/' + league + '.csv'
-    response = requests.get(url)
+    headers = dict()
+    if if_modified_since is not None:
+        headers['If-Modified-Since'] = format_datetime(if_modified_since.astimezone(timezone.utc), usegmt=True)
+    # The body is streamed (see _read_football_data)
+    response = session.get(url, headers=headers, timeout=60, stream=True)
+    if response.status_code == 304:
+        LOGGER.info("%s not modified since %s", url, if_modified_since)
+        return None
     response.raise_for_status()
     if response.status_code != 200:
         raise Exception("Can't download from %s: status_code=%d, reason=%s" %
@@ -0,0 +1,162 @@
+import botocore
+import json
+import logging
+from . import aws
+from . import columnar
+from . import common
+from . import instrumentation
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Reading the historical data that fetch_historical_data stores in S3 (see columnar.py for the format).
+#
+# A league's data is a base file, historical/<league>.cols, plus the matches added since it was written,
+# in small segment files listed by a manifest, historical/<league>.segments.json:
+#
+#   {"base_etag": "...", "latest_season": "2021", "previous_seasons": ["1819", "1920"],
+#    "segments": [{"key": "historical/segments/E0/<base etag>-0.cols", "etag": "...", "rows": 10}, ...]}
+#
+# Segments are never changed once they're written. When there are too many of them, fetch_historical_data
+# writes a new base with everything in it and a manifest without segments. (If there's no manifest, the
+# base is all there is.)
+
+
+def get_historical_data_from_s3(bucket, league):
+    # Returns all the league's matches as a columnar.LeagueTable
+    return HistoricalDataReader(bucket, league).read_all()
+
+
+def get_base_key(prefix, league):
+    return prefix.rstrip('/') + '/' + league + '.cols'
+
+
+def get_manifest_key(prefix, league):
+    return prefix.rstrip('/') + '/' + league + '.segments.json'
+
+
+def get_segment_key(prefix, league, base_etag, index):
+    # e.g. historical/segments/E0/0123456789abcdef-3.cols
+    return '%s/segments/%s/%s-%d.cols' % (prefix.rstrip('/'), league, base_etag.strip('"'), index)
+
+
+class HistoricalDataReader:
+    # Reads a league's historical data with ranged GETs: first the start of the base file (which holds the
+    # header and, for a small file, often everything else), then only the row groups that are needed, plus
+    # the segments. So reading the last N matches or a single season costs bytes in proportion to what's
+    # read. Everything read is kept in common.s3_cache, so while the data is unchanged a warm container
+    # only pays for conditional GETs of the manifest and the start of the base.
+
+    # How much of the file to fetch up front
+    PREFETCH_BYTES = 16 * 1024
+
+    def __init__(self, bucket, league):
+        prefix = common.s3_historical_prefix
+        self._bucket = bucket
+        self._key = get_base_key(prefix, league)
+        self._cache_key = ('historical', bucket, self._key)
+
+        manifest_etag, self.manifest = read_manifest(bucket, get_manifest_key(prefix, league))
+        base_etag, (self._prefetched, self.header, self._data_start) = common.get_cached_object(
+            bucket, self._key, self._parse_start, Range='bytes=0-%d' % (self.PREFETCH_BYTES - 1))
+
+        if self.manifest is not None and self.manifest['base_etag'] != base_etag:
+            # The base was rewritten after the manifest was read, so the new base has every match in it
+            LOGGER.info("%s/%s was rewritten while being read; ignoring its segments", bucket, self._key)
+            self.manifest = None
+
+        # The base's ETag is what its ranges are read with; the version (which the cached tables and the
+        # models are tagged with) changes whenever fetch_historical_data adds matches
+        self._base_etag = base_etag
+        self.version = manifest_etag if self.manifest is not None else base_etag
+
+    @property
+    def teams(self):
+        # Every team in the data: the base's, and any new ones in the segments
+        return sorted(set(self.header['teams']).union(*[segment.teams for segment in self._read_segments()]))
+
+    def read_all(self):
+        return self._get_table('all', lambda: columnar.concatenate(
+            [self._read(self.header['row_groups'])] + self._read_segments()))
+
+    def read_tail(self, n):
+        # The last n matches
+        def read():
+            segments = self._read_segments()
+            n_base_rows = max(n - sum(len(segment) for segment in segments), 0)
+            base = self._read(columnar.get_tail_row_groups(self.header, n_base_rows)).tail(n_base_rows)
+            return columnar.concatenate([base] + segments).tail(n)
+
+        return self._get_table(('tail', n), read)
+
+    def read_season(self, season):
+        return self._get_table(('season', season), lambda: columnar.concatenate(
+            [self._read(columnar.get_season_row_groups(self.header, season))] +
+            [segment.for_season(season) for segment in self._read_segments()]))
+
+    def _parse_start(self, prefetched, version):
+        header_length = columnar.get_header_length(prefetched)
+        if header_length > len(prefetched):
+            prefetched += self._get_range(len(prefetched), header_length, version)
+        header, data_start = columnar.read_header(prefetched)
+        return (prefetched, header, data_start), len(prefetched)
+
+    def _get_table(self, selection, read):
+        cache_key = self._cache_key + (selection,)
+        version, table = common.s3_cache.get(cache_key)
+        if table is None or version != self.version:
+            table = read()
+            common.s3_cache.put(cache_key, self.version, table, table.nbytes)
+        return table
+
+    def _read(self, row_groups):
+        start, stop = columnar.get_data_range(row_groups)
+        if self._data_start + stop <= len(self._prefetched):
+            buffer, data_start = self._prefetched, self._data_start
+        else:
+            buffer = self._get_range(self._data_start + start, self._data_start + stop, self._base_etag)
+            data_start = -start
+        with instrumentation.stage('parse', key=self._key):
+            return columnar.decode_row_groups(self.header, row_groups, buffer, data_start)
+
+    def _get_range(self, start, stop, version):
+        # IfMatch makes sure the bytes come from the same version of the file as the header
+        with instrumentation.stage('s3_get', key=self._key):
+            response = aws.client('s3').get_object(Bucket=self._bucket, Key=self._key,
+                                                   Range='bytes=%d-%d' % (start, stop - 1), IfMatch=version)
+            return response['Body'].read()
+
+    def _read_segments(self):
+        if self.manifest is None:
+            return []
+        return [_read_segment(self._bucket, segment['key'], segment['etag'])
+                for segment in self.manifest['segments']]
+
+
+def read_manifest(bucket, key):
+    # Returns (ETag, manifest), or (None, None) if there's no manifest
+    try:
+        return common.get_cached_object(bucket, key, lambda body, etag: (json.loads(body), len(body)))
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ['403', '404', 'AccessDenied', 'NoSuchKey']:
+            return None, None
+        raise
+
+
+def _read_segment(bucket, key, etag):
+    # Segments never change, so one that's cached doesn't need checking
+    cache_key = ('segment', bucket, key)
+    cached_etag, segment = common.s3_cache.get(cache_key)
+    if segment is None or cached_etag != etag:
+        with instrumentation.stage('s3_get', key=key):
+            body = aws.client('s3').get_object(Bucket=bucket, Key=key, IfMatch=etag)['Body'].read()
+        with instrumentation.stage('parse', key=key):
+            segment = columnar.decode(body)
+        common.s3_cache.put(cache_key, etag, segment, segment.nbytes + len(body))
+    return segment
+
+
+def get_historical_data_from_file(path):
+    # Memory-maps a local copy of a league's historical data (e.g. for offline analysis)
+    return columnar.load(path)
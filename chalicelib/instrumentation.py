@@ -0,0 +1,92 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Set INSTRUMENTATION=true to log the wall time, CPU time and peak allocated memory of each stage of the
+# predictions, e.g.
+#
+#   with instrumentation.stage('fit', outcome='home', fname='PpgDiff'):
+#       ...
+#
+# Each stage is logged as a line of JSON when it ends:
+#
+#   {"stage": "fit", "league": "E0", "outcome": "home", "fname": "PpgDiff", "wall_ms": 1.2, "cpu_ms": 1.1,
+#    "peak_alloc_bytes": 52144, "pid": 8}
+#
+# A stage inherits the tags (e.g. the league) of the stages it's inside. peak_alloc_bytes is the most memory
+# allocated (as seen by tracemalloc, which includes numpy arrays) at any one time during the stage, over
+# what was allocated when it started. tracemalloc slows everything down noticeably, so this is for finding
+# out where the time goes rather than for leaving on. (Memory is traced for the whole process, so with
+# several threads a stage's peak includes what the others allocated.) When it's off, stage() does nothing.
+enabled = os.environ.get('INSTRUMENTATION', 'false').lower() == 'true'
+
+_NOT_INSTRUMENTED = contextlib.nullcontext()
+
+# The stages currently running in each thread, innermost last
+_running = threading.local()
+
+
+def stage(name, **tags):
+    if not enabled:
+        return _NOT_INSTRUMENTED
+    return _Stage(name, tags)
+
+
+class _Stage:
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.stages = _get_running_stages()
+        self.tags = dict(self.stages[-1].tags) if self.stages else dict()
+        self.tags.update(tags)
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        # Measuring this stage's peak means resetting it, so first pass on the peak so far to the
+        # stage this one is inside
+        if self.stages:
+            self.stages[-1].peak = max(self.stages[-1].peak, peak)
+        # (Before Python 3.9 the peak can't be reset, so a stage's peak may come from earlier on)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.start_memory = current
+        self.peak = current
+        self.stages.append(self)
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        # A forked worker inherits the stages that were running when it started, but only ends its own
+        if self.stages and self.stages[-1] is self:
+            self.stages.pop()
+        if self.stages:
+            self.stages[-1].peak = max(self.stages[-1].peak, self.peak)
+
+        record = {'stage': self.name}
+        record.update(self.tags)
+        record.update({'wall_ms': round(wall * 1000, 3), 'cpu_ms': round(cpu * 1000, 3),
+                       'peak_alloc_bytes': self.peak - self.start_memory, 'pid': os.getpid()})
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        LOGGER.info(json.dumps(record))
+        return False
+
+
+def _get_running_stages():
+    if not hasattr(_running, 'stages'):
+        _running.stages = []
+    return _running.stages
@@ -1,18 +1,16 @@
-import json
 import logging
 import numpy as np
 import os
 import textwrap
-from . import common
-# from . import over_under_predictions
-from chalice import Blueprint
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import StandardScaler
-from sklearn.pipeline import make_pipeline
-from collections import Counter, defaultdict
-
-
-predictions = Blueprint(__name__)
+from . import aws
+from . import binning
+from . import columnar
+from . import instrumentation
+from . import model_cache
+from . import regression
+from . import reports
+from . import team_names
+from . import team_state
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
@@ -20,220 +18,83 @@ LOGGER.setLevel(logging.INFO)
 main_leagues = os.environ['MAIN_LEAGUES']
 new_leagues = os.environ['NEW_LEAGUES']
 
-Classifier = LinearRegression
-
-
-@predictions.on_s3_event(bucket=os.environ['S3_BUCKET'], prefix='fixtures/',
-                 suffix='.csv', events=['s3:ObjectCreated:*'])
-def make_predictions(event):
-    LOGGER.info("Looks like there's a new fixtures file: %s/%s", event.bucket, event.key)
-
-    match_predictions(event)
-    # over_under_predictions.predict_over_under(event)
-
+# Creates the (unfitted) models train_classifiers fits; see regression.py
+Classifier = regression.get_backend(regression.get_backend_name())
+
+
+def is_predicted(league):
+    return league in main_leagues or league in new_leagues
+
+
+def predict_league(context):
+    # The league's predictions, from a predictions.LeagueContext
+    bucket, league, reader = context.bucket, context.div, context.reader
+
+    # Only retrain if the league's data has changed since the models were cached. The features stored
+    # with the data (see feature_store.py) are used if there are any; otherwise they're worked out from
+    # the whole history to train, or from the most recent matches to predict.
+    stored = context.features
+    with instrumentation.stage('load_models'):
+        trained = model_cache.load_classifiers(bucket, league, reader.version)
+    past_league_matches = None
+    if trained is None:
+        if stored is None:
+            with instrumentation.stage('read_historical', selection='all'):
+                past_league_matches = reader.read_all()
+        with instrumentation.stage('train'):
+            if stored is None:
+                trained = train_classifiers(past_league_matches, league)
+            else:
+                trained = fit_classifiers(stored.features, stored.results)
+        with instrumentation.stage('save_models'):
+            model_cache.save_classifiers(bucket, league, reader.version, trained)
+    elif stored is None:
+        with instrumentation.stage('read_historical', selection='tail'):
+            past_league_matches = reader.read_tail(team_state.PREDICTION_WINDOW)
+
+    home_clf, draw_clf, away_clf, best_home_score, best_draw_score, best_away_score, home_best_fname, draw_best_fname, away_best_fname = trained
+    models = reports.ModelScores(home_best_fname, best_home_score, draw_best_fname, best_draw_score,
+                                 away_best_fname, best_away_score)
+
+    classifiers = {'home_clf': home_clf, 'draw_clf': draw_clf, 'away_clf': away_clf,
+        'home_fname': home_best_fname, 'draw_fname': draw_best_fname, 'away_fname': away_best_fname}
+
+    with instrumentation.stage('predict'):
+        predictions = predict(past_league_matches, league, classifiers, context.matches, context.names,
+                              stored.latest_state if stored is not None else None)
+    return reports.LeaguePredictions(league, context.league, models, predictions, list(context.names.unresolved))
+
+
+def send_reports(bucket, fixtures_key, all_predictions):
+    all_email = reports.AllPredictionsEmail()
+    best_email = reports.BestPredictionsEmail()
+    # draw_email = reports.DrawPredictionsEmail()
+    json_report = reports.JsonReport()
+    with instrumentation.stage('report'):
+        reports.render(all_predictions, [all_email, best_email, json_report])
+    with instrumentation.stage('email', email='all'):
+        all_email.send()
+    with instrumentation.stage('email', email='best'):
+        best_email.send()
+
+    if os.environ.get('PREDICTIONS_EXPORT_JSON', 'false').lower() == 'true':
+        # e.g. fixtures/fixtures.csv -> predictions/fixtures.json
+        key = 'predictions/' + os.path.splitext(os.path.basename(fixtures_key))[0] + '.json'
+        LOGGER.info("Writing predictions to %s/%s", bucket, key)
+        aws.client('s3').put_object(Bucket=bucket, Key=key, Body=json_report.message.encode(),
+                                    ContentType='application/json')
 
-def match_predictions(event):
-    # Read the fixtures into CSV
-    fixtures = common.get_fixtures_from_s3(event.bucket, event.key)
-    # Get the unique list of leagues ('Div')
-    leagues = sorted(set(fixtures['Div']))
 
-    # For each div:
-    #   Read div CSV
-    #   Train home/draw/away classifiers for each div
-    #   Make predictions for the div
-    # Send email containing predictions
-
-    all_predictions = []
-
-    for league in leagues:
-        LOGGER.info("League: %s", league)
-        if league not in main_leagues and league not in new_leagues:
-            LOGGER.info("Skipping league %s", league)
-            continue
-
-        past_league_matches = common.get_historical_data_from_s3(event.bucket, league)
-        if past_league_matches is None:
-            LOGGER.info("Hmm, no matches for league '%s'", league)
-            continue
-
-        league_predictions = dict()
-        league_predictions['div'] = league
-        league_predictions['league'] = common.DIVISIONS_TO_LEAGUES[league]
-
-        home_clf, draw_clf, away_clf, best_home_score, best_draw_score, best_away_score, home_best_fname, draw_best_fname, away_best_fname = train_classifiers(past_league_matches, league)
-        league_predictions['home_score'] = best_home_score
-        league_predictions['draw_score'] = best_draw_score
-        league_predictions['away_score'] = best_away_score
-        league_predictions['home_fname'] = home_best_fname
-        league_predictions['draw_fname'] = draw_best_fname
-        league_predictions['away_fname'] = away_best_fname
-
-        classifiers = {'home_clf': home_clf, 'draw_clf': draw_clf, 'away_clf': away_clf,
-            'home_fname': home_best_fname, 'draw_fname': draw_best_fname, 'away_fname': away_best_fname}
-
-        next_league_fixtures = common.get_league_data(fixtures, league)
-        next_matches = zip(next_league_fixtures['HomeTeam'], next_league_fixtures['AwayTeam'],
-                           next_league_fixtures['Date'], next_league_fixtures['Time'])
-
-        predictions = predict(past_league_matches, league, classifiers, next_matches)
-        league_predictions['predictions'] = predictions
-        all_predictions.append(league_predictions)
-
-    predictions_json = json.dumps(all_predictions)
-    email_all_predictions(predictions_json)
-    email_best_predictions(predictions_json)
-    # email_draw_predictions(predictions_json)
-
-
-def email_all_predictions(all_predictions_json):
-    league_template = textwrap.dedent("""
-    ==================================================
-    %s: %s
-    ==================================================
-    Home (%s) %.2f
-    Away (%s) %.2f
-    Draw (%s) %.2f
-
-    """)
-    match_template = textwrap.dedent("""
-    %s %s -- %s v. %s
-    --------------------------------------------------
-    Home: %.2f   (%.2f)
-    Draw: %.2f   (%.2f)
-    Away: %.2f   (%.2f)
-
-    """)
-
-    all_predictions = json.loads(all_predictions_json)
-    mail_message = ""
-
-    for league in all_predictions:
-        mail_message += league_template % (league['div'], league['league'],
-                                           league['home_fname'], league['home_score'],
-                                           league['away_fname'], league['away_score'],
-                                           league['draw_fname'], league['draw_score'])
-
-        for prediction in league['predictions']:
-            mail_message += match_template % (prediction['date'], prediction['time'],
-                                              prediction['home_team'], prediction['away_team'],
-                                              prediction['home_pct'], prediction['home_odds'],
-                                              prediction['draw_pct'], prediction['draw_odds'],
-                                              prediction['away_pct'], prediction['away_odds'])
-
-
-    LOGGER.info("Football predictions (Home/Away) \n%s", mail_message)
-    common.send_mail("Football predictions (Home/Away)", mail_message)
-
-
-def email_best_predictions(all_predictions_json):
-    league_template = textwrap.dedent("""
-
-    ==================================================
-    %s: %s
-    ==================================================
-    """)
-
-    match_template = textwrap.dedent("""
-    %s %s -- %s v. %s
-    --------------------------------------------------
-    %s: %.2f   (%.2f)
-    %s
-
-    """)
-
-    cutoff = 65
-    if "PREDICTION_CUTOFF" in os.environ:
-        cutoff = int(os.environ['PREDICTION_CUTOFF'])
-
-    all_predictions = json.loads(all_predictions_json)
-    mail_message = ""
-
-    for div_predictions in all_predictions:
-        div = div_predictions['div']
-        league = div_predictions['league']
-        top_predictions = []
-
-        for prediction in div_predictions['predictions']:
-            home_team, away_team = prediction['home_team'], prediction['away_team']
-            if prediction['home_pct'] >= cutoff:
-                top_predictions.append({'home': home_team,
-                                        'away': away_team,
-                                        'winner': home_team,
-                                        'pct': prediction['home_pct'],
-                                        'odds': prediction['home_odds'],
-                                        'date': prediction['date'],
-                                        'time': prediction['time']})
-            if prediction['away_pct'] >= cutoff:
-                top_predictions.append({'home': home_team,
-                                        'away': away_team,
-                                        'winner': away_team,
-                                        'pct': prediction['away_pct'],
-                                        'odds': prediction['away_odds'],
-                                        'date': prediction['date'],
-                                        'time': prediction['time']})
-
-        if len(top_predictions) > 0:
-            mail_message += league_template % (div, league)
-            for p in top_predictions:
-                note = ""
-                if div == 'MEX':
-                    note = "Note: consider Double Chance"
-                mail_message += match_template % (p['date'], p['time'], p['home'], p['away'], p['winner'], p['pct'], p['odds'], note)
-
-    if mail_message:
-        common.send_mail("Top football predictions (cutoff = %.2f%%)" % cutoff, mail_message)
-
-
-def email_draw_predictions(all_predictions_json):
-    league_template = textwrap.dedent("""
-
-    ==================================================
-    %s: %s
-    ==================================================
-    """)
-
-    match_template = textwrap.dedent("""
-    %s v. %s
-    --------------------------------------------------
-    Draw: %.2f   (%.2f)
-
-    """)
-
-    cutoff = 30
-    if 'DRAW_CUTOFF' in os.environ:
-        cutoff = int(os.environ['DRAW_CUTOFF'])
-
-    all_predictions = json.loads(all_predictions_json)
-    mail_message = ""
-
-    for div_predictions in all_predictions:
-        div = div_predictions['div']
-        league = div_predictions['league']
-        draw_predictions = []
-
-        for prediction in div_predictions['predictions']:
-            home_team, away_team = prediction['home_team'], prediction['away_team']
-            if prediction['draw_pct'] >= cutoff:
-                home_pct = prediction['home_pct']
-                away_pct = prediction['away_pct']
-                home_away_diff = abs(home_pct - away_pct)
-                if (home_pct >= 20 and home_pct < 50) and (away_pct >= 20 and away_pct < 50) and (home_away_diff < 15):
-                    draw_predictions.append({'home': home_team, 'away': away_team, 'pct': prediction['draw_pct'], 'odds': prediction['draw_odds']})
-
-        if len(draw_predictions) > 0:
-            mail_message += league_template % (div, league)
-            for p in draw_predictions:
-                mail_message += match_template % (p['home'], p['away'], p['pct'], p['odds'])
-
-    if mail_message:
-        common.send_mail("Football draw predictions (cutoff = %.2f%%)" % cutoff, mail_message)
+def train_classifiers(data, league):
 
+    with instrumentation.stage('features'):
+        features, _ = team_state.get_ppg_features(data)
+    return fit_classifiers(features, data['FTR'])
 
-def train_classifiers(data, league):
 
-    league_data = common.get_league_data(data, league)
-    add_ppg_fields(league_data)
+def fit_classifiers(features, results):
+    # Fits the home/draw/away models on each feature (features as from team_state.get_ppg_features,
+    # results as FTR codes) and picks the best feature for each outcome
 
     home_classifiers = dict()
     draw_classifiers = dict()
@@ -243,21 +104,26 @@ def train_classifiers(data, league):
     away_scores = dict()
 
     for fname in ['PpgDiff', 'HomeAwayPpgDiff']:
-        home_diffs, home_pcts = get_percentages_for_diffs(league_data, fname, 'H')
-        draw_diffs, draw_pcts = get_percentages_for_diffs(league_data, fname, 'D')
-        away_diffs, away_pcts = get_percentages_for_diffs(league_data, fname, 'A')
-
-        X_home, y_home = np.array(home_diffs).reshape(-1, 1), home_pcts
-        home_classifiers[fname] = make_pipeline(StandardScaler(), Classifier()).fit(X_home, y_home)
-        home_scores[fname] = home_classifiers[fname].score(X_home, y_home)
-
-        X_away, y_away = np.array(away_diffs).reshape(-1, 1), away_pcts
-        away_classifiers[fname] = make_pipeline(StandardScaler(), Classifier()).fit(X_away, y_away)
-        away_scores[fname] = away_classifiers[fname].score(X_away, y_away)
-
-        X_draw, y_draw = np.array(draw_diffs).reshape(-1, 1), draw_pcts
-        draw_classifiers[fname] = make_pipeline(StandardScaler(), Classifier()).fit(X_draw, y_draw)
-        draw_scores[fname] = draw_classifiers[fname].score(X_draw, y_draw)
+        with instrumentation.stage('bin', fname=fname):
+            lower, counts = binning.count_results(features[fname], results)
+            home_diffs, home_pcts = binning.get_percentages_for_bins(lower, counts, 'H')
+            draw_diffs, draw_pcts = binning.get_percentages_for_bins(lower, counts, 'D')
+            away_diffs, away_pcts = binning.get_percentages_for_bins(lower, counts, 'A')
+
+        with instrumentation.stage('fit', outcome='home', fname=fname):
+            X_home, y_home = np.array(home_diffs).reshape(-1, 1), home_pcts
+            home_classifiers[fname] = Classifier().fit(X_home, y_home)
+            home_scores[fname] = home_classifiers[fname].score(X_home, y_home)
+
+        with instrumentation.stage('fit', outcome='away', fname=fname):
+            X_away, y_away = np.array(away_diffs).reshape(-1, 1), away_pcts
+            away_classifiers[fname] = Classifier().fit(X_away, y_away)
+            away_scores[fname] = away_classifiers[fname].score(X_away, y_away)
+
+        with instrumentation.stage('fit', outcome='draw', fname=fname):
+            X_draw, y_draw = np.array(draw_diffs).reshape(-1, 1), draw_pcts
+            draw_classifiers[fname] = Classifier().fit(X_draw, y_draw)
+            draw_scores[fname] = draw_classifiers[fname].score(X_draw, y_draw)
 
     home_best_fname = sorted(home_scores, key=home_scores.__getitem__, reverse=True)[0]
     away_best_fname = sorted(away_scores, key=away_scores.__getitem__, reverse=True)[0]
@@ -276,250 +142,108 @@ def train_classifiers(data, league):
 
 
 def add_ppg_fields(data):
-
-    n_matches_as_home_team = defaultdict(lambda: 0)
-    n_matches_as_away_team = defaultdict(lambda: 0)
-    points_as_home_team = defaultdict(lambda: 0)
-    points_as_away_team = defaultdict(lambda: 0)
-    goals = defaultdict(lambda: 0)
-
-    home_team_ppg_at_home = []
-    home_team_overall_ppg = []
-    away_team_ppg_away = []
-    away_team_overall_ppg = []
-    home_team_goals_per_game = []
-    away_team_goals_per_game = []
-
-    for row in zip(data['HomeTeam'], data['AwayTeam'], data['FTR'], data['FTHG'], data['FTAG']):
-
-        home_team, away_team, ftr, home_goals, away_goals = row
-
-        if n_matches_as_home_team[home_team] > 0:
-            home_team_ppg_at_home.append(points_as_home_team[home_team] / n_matches_as_home_team[home_team])
-        else:
-            home_team_ppg_at_home.append(0.0)
-
-        home_team_total_matches = n_matches_as_home_team[home_team] + n_matches_as_away_team[home_team]
-        if home_team_total_matches > 0:
-            home_team_overall_ppg.append((points_as_home_team[home_team] + points_as_away_team[home_team]) / home_team_total_matches)
-            home_team_goals_per_game.append(goals[home_team] / home_team_total_matches)
-        else:
-            home_team_overall_ppg.append(0.0)
-            home_team_goals_per_game.append(0.0)
-
-        if n_matches_as_away_team[away_team] > 0:
-            away_team_ppg_away.append(points_as_away_team[away_team] / n_matches_as_away_team[away_team])
-        else:
-            away_team_ppg_away.append(0.0)
-
-        away_team_total_matches = n_matches_as_home_team[away_team] + n_matches_as_away_team[away_team]
-        if away_team_total_matches > 0:
-            away_team_overall_ppg.append((points_as_home_team[away_team] + points_as_away_team[away_team]) / away_team_total_matches)
-            away_team_goals_per_game.append(goals[away_team] / away_team_total_matches)
-        else:
-            away_team_overall_ppg.append(0.0)
-            away_team_goals_per_game.append(0.0)
-
-        n_matches_as_home_team[home_team] += 1
-        n_matches_as_away_team[away_team] += 1
-        points_as_home_team[home_team] += points_for_home_team(ftr)
-        points_as_away_team[away_team] += points_for_away_team(ftr)
-        goals[home_team] += int(home_goals) if home_goals else 0
-        goals[away_team] += int(away_goals) if away_goals else 0
-
-    data.append_col(home_team_ppg_at_home, header='HomeTeamPpgAtHome')
-    data.append_col(home_team_overall_ppg, header='HomeTeamOverallPpg')
-    data.append_col(away_team_ppg_away, header='AwayTeamPpgAway')
-    data.append_col(away_team_overall_ppg, header='AwayTeamOverallPpg')
-    data.append_col(home_team_goals_per_game, header='HomeTeamGpg')
-    data.append_col(away_team_goals_per_game, header='AwayTeamGpg')
-
-    ppg_diff = get_diff(data['HomeTeamOverallPpg'], data['AwayTeamOverallPpg'])
-    data.append_col(ppg_diff, header='PpgDiff')
-    home_away_diff = get_diff(data['HomeTeamPpgAtHome'], data['AwayTeamPpgAway'])
-    data.append_col(home_away_diff, header='HomeAwayPpgDiff')
-    gpg_total = get_sum(data['HomeTeamGpg'], data['AwayTeamGpg'])
-    data.append_col(gpg_total, header='GpgTotal')
-    gpg_diff = get_diff(data['HomeTeamGpg'], data['AwayTeamGpg'])
-    data.append_col(gpg_diff, header='GpgDiff')
-
-
-def points_for_home_team(ftr):
-    if ftr == 'H':
-        return 3
-    elif ftr == 'D':
-        return 1
-    else:
-        return 0
-
-
-def points_for_away_team(ftr):
-    if ftr == 'A':
-        return 3
-    elif ftr == 'D':
-        return 1
-    else:
-        return 0
-
-
-def points_for_team(fname, ftr):
-    if fname == 'HomeTeam':
-        return points_for_home_team(ftr)
-    else:
-        return points_for_away_team(ftr)
-
-
-def get_diff(col_a, col_b):
-    return [x - y for x, y in zip(col_a, col_b)]
-
-
-def get_sum(col_a, col_b):
-    return [x + y for x, y in zip(col_a, col_b)]
+    # Adds the feature columns to a tablib Dataset in the historical CSV layout
+    features, _ = team_state.get_ppg_features(columnar.from_dataset(data))
+    for fname in team_state.FEATURES:
+        data.append_col(features[fname].tolist(), header=fname)
 
 
 def get_percentages_for_diffs(data, fname, ftr):
-    pcts = []
-    diffs = []
-    # Skip the first 50 matches to allow data to 'settle down'
-    start, end = np.quantile(data[fname][50:], [0.05, 0.95])
-    step = 0.1
-    fname_idx = data.headers.index(fname)
-    for i in np.arange(start, end, step):
-        keepers = [idx for idx, row in enumerate(data) if row[fname_idx] >= i and row[fname_idx] < i+step]
-        subset = data.subset(rows=keepers)
-        vc = Counter(subset['FTR'])
-        h, d, a = 0, 0, 0
-        n = 0
-        if 'H' in vc:
-            h = vc['H']
-        if 'D' in vc:
-            d = vc['D']
-        if 'A' in vc:
-            a = vc['A']
-
-        total = h + d + a
-
-        if ftr == 'H':
-            n = h
-        elif ftr == 'D':
-            n = d
-        elif ftr == 'A':
-            n = a
-
-        if n > 0:
-            pcts.append(n / total * 100.0 if total > 0 else 0.0)
-            diffs.append(i)
-
-    return diffs, pcts
-
-
-def get_latest_overall_ppg_for_team(data, league, team):
-    league_data = common.get_league_data(data, league)
-    add_ppg_fields(league_data)
-
-    home_teams = league_data['HomeTeam']
-    away_teams = league_data['AwayTeam']
-
-    # How many matches has the team played overall?
-    home_counts = home_teams.count(team)
-    away_counts = away_teams.count(team)
-    n = home_counts + away_counts
-
-    # Find whether the team's last match was home or away, and its index in df
-    if team not in home_teams:
-        print("Weird... {} not in home_teams".format(team))
-        print("League: [{}]".format(league))
-        print("home_teams:", home_teams)
-    # Temporary, because JPN season just started
-    if (team not in home_teams or team not in away_teams) and league in ['JPN']:
-        print("Returning 0.0 for {}".format(team))
-        return 0.0
-    last_home_game_idx = len(home_teams) - home_teams[::-1].index(team) - 1
-    last_away_game_idx = len(away_teams) - away_teams[::-1].index(team) - 1
-
-    # Use n and the last match to calculate the 'next' PPG for the team
-    if last_home_game_idx > last_away_game_idx:
-        points = points_for_home_team(league_data['FTR'][last_home_game_idx])
-        previous_ppg = league_data['HomeTeamOverallPpg'][last_home_game_idx]
-    else:
-        points = points_for_away_team(league_data['FTR'][last_away_game_idx])
-        previous_ppg = league_data['AwayTeamOverallPpg'][last_away_game_idx]
-
-    return (previous_ppg * n + points) / (n + 1)
+    lower, counts = binning.count_results(data[fname], binning.encode_results(data['FTR']))
+    return binning.get_percentages_for_bins(lower, counts, ftr)
 
 
-def get_latest_home_or_away_ppg_for_team(data, div, team, fname):
-    league_data = common.get_league_data(data, div)
-    add_ppg_fields(league_data)
+def get_latest_overall_ppg_for_team(latest_state, league, team):
+    ppg = latest_state.overall_ppg(team)
+    if ppg is None:
+        # Temporary, because JPN season just started
+        if league in ['JPN']:
+            print("Returning 0.0 for {}".format(team))
+            return 0.0
+        raise ValueError("{} has no home and away matches in league {}".format(team, league))
+    return ppg
 
-    # How many matches has the team played at home/away?
-    n = league_data[fname].count(team)
 
-    # Get the index of the last game that the team played home/away
-    teams = league_data[fname]
-    # Temporary, because JPN season just started
-    if team not in teams and div in ['JPN']:
-        print("Returning 0.0 for {}".format(team))
-        return 0.0
-    last_game_idx = len(teams) - teams[::-1].index(team) - 1
-
-    # Use n and the last match to calculate the 'next' PPG for the team
-    points = points_for_team(fname, league_data['FTR'][last_game_idx])
-    previous_ppg = league_data[fname + 'OverallPpg'][last_game_idx]
+def get_latest_home_or_away_ppg_for_team(latest_state, div, team, fname):
+    if fname == 'HomeTeam':
+        ppg = latest_state.home_ppg(team)
+    else:
+        ppg = latest_state.away_ppg(team)
+    if ppg is None:
+        # Temporary, because JPN season just started
+        if div in ['JPN']:
+            print("Returning 0.0 for {}".format(team))
+            return 0.0
+        raise ValueError("{} has no {} matches in league {}".format(team, fname, div))
+    return ppg
+
+
+def get_latest_home_ppg_for_team(latest_state, div, team):
+    return get_latest_home_or_away_ppg_for_team(latest_state, div, team, 'HomeTeam')
+
+
+def get_latest_away_ppg_for_team(latest_state, div, team):
+    return get_latest_home_or_away_ppg_for_team(latest_state, div, team, 'AwayTeam')
+
+
+def predict(data, league, classifiers, matches, names=None, latest_state=None):
+    # names is the league's team_names.TeamNameIndex; fixtures with a team it can't resolve, or that has no
+    # matches to work out its PPG from, are skipped.
+    # latest_state is the teams' team_state.LatestState, if it's already known (e.g. from the feature
+    # store); data isn't needed then.
+    if latest_state is None:
+        # Replay the last PREDICTION_WINDOW matches once; every fixture then just looks its teams up
+        latest_state = team_state.get_latest_state(data.tail(team_state.PREDICTION_WINDOW))
+    if names is None:
+        names = team_names.TeamNameIndex(league, latest_state.teams)
+
+    # Work out every fixture's features first, so that each model only has to predict once
+    fixtures = []
+    diffs_overall_ppg = []
+    diffs_home_away_ppg = []
+    for match in matches:
 
-    return (previous_ppg * n + points) / (n + 1)
+        home_team, away_team, date, time = match
+        home_team = names.resolve(home_team)
+        away_team = names.resolve(away_team)
+        if home_team is None or away_team is None:
+            LOGGER.warning("Skipping %s in %s: unknown team", match, league)
+            continue
 
+        try:
+            home_team_overall_ppg = get_latest_overall_ppg_for_team(latest_state, league, home_team)
+            away_team_overall_ppg = get_latest_overall_ppg_for_team(latest_state, league, away_team)
+            home_team_home_ppg = get_latest_home_ppg_for_team(latest_state, league, home_team)
+            away_team_away_ppg = get_latest_away_ppg_for_team(latest_state, league, away_team)
+        except ValueError as e:
+            # A team that hasn't played (at home, or away) in the last PREDICTION_WINDOW matches, e.g. one
+            # that's just been promoted
+            LOGGER.warning("Skipping %s in %s: %s", match, league, e)
+            continue
+        diffs_overall_ppg.append(home_team_overall_ppg - away_team_overall_ppg)
+        diffs_home_away_ppg.append(home_team_home_ppg - away_team_away_ppg)
 
-def get_latest_home_ppg_for_team(data, div, team):
-    return get_latest_home_or_away_ppg_for_team(data, div, team, 'HomeTeam')
+        fixtures.append((match, home_team, away_team, date, time))
 
+    if not fixtures:
+        return []
 
-def get_latest_away_ppg_for_team(data, div, team):
-    return get_latest_home_or_away_ppg_for_team(data, div, team, 'AwayTeam')
+    diffs_overall_ppg = np.array(diffs_overall_ppg).reshape(-1, 1)
+    diffs_home_away_ppg = np.array(diffs_home_away_ppg).reshape(-1, 1)
 
+    home_diffs = diffs_overall_ppg if classifiers['home_fname'] == 'PpgDiff' else diffs_home_away_ppg
+    away_diffs = diffs_overall_ppg if classifiers['away_fname'] == 'PpgDiff' else diffs_home_away_ppg
+    draw_diffs = diffs_overall_ppg if classifiers['draw_fname'] == 'PpgDiff' else diffs_home_away_ppg
 
-def predict(data, league, classifiers, matches):
-    league_data = common.get_league_data(data, league)
-    subset_rows = list(range(len(league_data) - 200, len(league_data)))
-    league_data = league_data.subset(rows=subset_rows)
+    all_home = classifiers['home_clf'].predict(home_diffs)
+    all_away = classifiers['away_clf'].predict(away_diffs)
+    all_draw = classifiers['draw_clf'].predict(draw_diffs)
 
     predictions = []
 
-    for match in matches:
-
-        home_team, away_team, date, time = match
-        home_team = common.get_team_name(home_team, league)
-        away_team = common.get_team_name(away_team, league)
-
-        home_team_overall_ppg = get_latest_overall_ppg_for_team(league_data, league, home_team)
-        away_team_overall_ppg = get_latest_overall_ppg_for_team(league_data, league, away_team)
-        diff_overall_ppg = home_team_overall_ppg - away_team_overall_ppg
-
-        home_team_home_ppg = get_latest_home_ppg_for_team(league_data, league, home_team)
-        away_team_away_ppg = get_latest_away_ppg_for_team(league_data, league, away_team)
-        diff_home_away_ppg = home_team_home_ppg - away_team_away_ppg
-
-        home_diff = diff_overall_ppg if classifiers['home_fname'] == 'PpgDiff' else diff_home_away_ppg
-        away_diff = diff_overall_ppg if classifiers['away_fname'] == 'PpgDiff' else diff_home_away_ppg
-        draw_diff = diff_overall_ppg if classifiers['draw_fname'] == 'PpgDiff' else diff_home_away_ppg
-
-        home = classifiers['home_clf'].predict([[home_diff]])[0]
-        away = classifiers['away_clf'].predict([[away_diff]])[0]
-        draw = classifiers['draw_clf'].predict([[draw_diff]])[0]
-
-        prediction = dict()
-        prediction['home_team'] = home_team
-        prediction['away_team'] = away_team
-        prediction['home_pct'] = home
-        prediction['home_odds'] = 1/home*100
-        prediction['draw_pct'] = draw
-        prediction['draw_odds'] = 1/draw*100
-        prediction['away_pct'] = away
-        prediction['away_odds'] = 1/away*100
-        prediction['date'] = date
-        prediction['time'] = time
-
-        predictions.append(prediction)
+    for (match, home_team, away_team, date, time), home, away, draw in zip(fixtures, all_home, all_away, all_draw):
+        predictions.append(reports.MatchPrediction(date, time, home_team, away_team,
+                                                   float(home), float(draw), float(away)))
 
         output = """
         %s: %s
@@ -0,0 +1,87 @@
+import botocore
+import logging
+import os
+import pickle
+from . import aws
+from . import regression
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Bump this whenever train_classifiers changes what it returns, so that older cached models are ignored
+MODEL_FORMAT = 4
+
+
+# Trained models are cached per league, tagged with the version (ETag) of the historical data they were
+# trained on. They're stored under S3_PREFIX_MODELS in the bucket or, if MODEL_CACHE_DIR is set, in a
+# local directory instead. If neither is set, caching is off.
+
+def load_classifiers(bucket, league, version):
+    body = _read(bucket, league)
+    if body is None:
+        LOGGER.info("No cached models for %s", league)
+        return None
+
+    try:
+        entry = pickle.loads(body)
+    except Exception:
+        LOGGER.exception("Can't load the cached models for %s; retraining", league)
+        return None
+
+    if entry.get('format') != MODEL_FORMAT or entry.get('version') != version \
+            or entry.get('backend') != regression.get_backend_name():
+        LOGGER.info("Cached models for %s are out of date (version %s, data version %s, backend %s)",
+                    league, entry.get('version'), version, entry.get('backend'))
+        return None
+
+    LOGGER.info("Using cached models for %s (data version %s)", league, version)
+    return entry['classifiers']
+
+
+def save_classifiers(bucket, league, version, classifiers):
+    entry = {'format': MODEL_FORMAT, 'league': league, 'version': version,
+             'backend': regression.get_backend_name(), 'classifiers': classifiers}
+    body = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+
+    local_dir = os.environ.get('MODEL_CACHE_DIR')
+    if local_dir:
+        os.makedirs(local_dir, exist_ok=True)
+        with open(_get_path(local_dir, league), 'wb') as f:
+            f.write(body)
+    elif 'S3_PREFIX_MODELS' in os.environ:
+        aws.resource('s3').Object(bucket, _get_key(league)).put(Body=body)
+    else:
+        return
+
+    LOGGER.info("Cached models for %s (data version %s)", league, version)
+
+
+def _read(bucket, league):
+    local_dir = os.environ.get('MODEL_CACHE_DIR')
+    if local_dir:
+        path = _get_path(local_dir, league)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    if 'S3_PREFIX_MODELS' not in os.environ:
+        return None
+    try:
+        return aws.resource('s3').Object(bucket, _get_key(league)).get()['Body'].read()
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ['403', '404', 'AccessDenied', 'NoSuchKey']:
+            # The object does not exist.
+            return None
+        else:
+            # Something else has gone wrong.
+            raise
+
+
+def _get_key(league):
+    return os.environ['S3_PREFIX_MODELS'].rstrip('/') + '/' + league + '.pickle'
+
+
+def _get_path(local_dir, league):
+    return os.path.join(local_dir, league + '.pickle')
@@ -1,9 +1,10 @@
-import json
 import logging
+import numpy as np
 import os
 import re
 import textwrap
-from . import common
+from . import reports
+from . import team_names
 
 # The idea for this comes from https://www.financial-spread-betting.com/sports/Goals-betting-system.html
 
@@ -16,126 +17,82 @@ for league in ['SP1', 'SP2']:
     main_leagues.remove(league)
 
 
-def predict_over_under(event):
-    LOGGER.info("Looks like there's a new fixtures file: %s/%s", event.bucket, event.key)
+def is_predicted(league):
+    return league in main_leagues
 
-    # Read the fixtures into CSV
-    fixtures = common.get_fixtures_from_s3(event.bucket, event.key)
-    # Get the unique list of leagues ('Div')
-    leagues = sorted(set(fixtures['Div']))
 
-    all_predictions = []
+def predict_league(context):
+    # The league's predictions, from a predictions.LeagueContext. Only the latest season is needed.
+    past_league_matches = context.reader.read_season(os.environ['LATEST_SEASON'])
+    predictions = predict(context.div, past_league_matches, context.matches, context.names)
+    return reports.LeaguePredictions(context.div, context.league, None, predictions, list(context.names.unresolved))
 
-    for league in leagues:
-        LOGGER.info("League: %s", league)
-        if league and league not in main_leagues:
-            LOGGER.info("Skipping league %s", league)
-            continue
-
-        past_league_matches = common.get_historical_data_from_s3(event.bucket, league)
-        if past_league_matches is None:
-            LOGGER.info("Hmm, no matches for league '%s'", league)
-            continue
-
-        league_predictions = dict()
-        league_predictions['div'] = league
-        league_predictions['league'] = common.DIVISIONS_TO_LEAGUES[league]
-
-        next_league_fixtures = common.get_league_data(fixtures, league)
-        next_matches = zip(next_league_fixtures['HomeTeam'], next_league_fixtures['AwayTeam'],
-                           next_league_fixtures['Date'], next_league_fixtures['Time'])
-
-        league_predictions['predictions'] = predict(league, past_league_matches, next_matches)
-
-        all_predictions.append(league_predictions)
-
-    predictions_json = json.dumps(all_predictions)
-    email_predictions(predictions_json)
-
-
-def email_predictions(all_predictions_json):
-    league_template = textwrap.dedent("""
-
-    ==================================================
-    %s: %s
-    ==================================================
-    """)
-
-    match_template = """
-    %s %s : %s -- %s v. %s
-    """
 
-    all_predictions = json.loads(all_predictions_json)
-    mail_message = ""
+def send_reports(bucket, fixtures_key, all_predictions):
+    email = reports.OverUnderEmail()
+    reports.render(all_predictions, [email])
+    email.send()
 
-    for div_predictions in all_predictions:
-        mail_message += league_template % (div_predictions['div'], div_predictions['league'])
 
-        for prediction in div_predictions['predictions']:
-            outcome = "over" if prediction['is_over_25'] == True else "under"
-            mail_message += match_template % (prediction['date'], prediction['time'],
-                                              outcome, prediction['home_team'], prediction['away_team'])
-
-    LOGGER.info("Football predictions (Over/Under 2.5 goals) \n%s", mail_message)
-    common.send_mail("Football predictions (Over/Under 2.5 goals)", mail_message)
-
-
-def predict(league, past_data, matches):
+def predict(league, past_data, matches, names=None):
     n = 3 # This is the number of previous matches to consider when making a prediction
 
-    league_data = common.get_league_data(past_data, league)
     latest_season = os.environ['LATEST_SEASON']
-    league_data = get_subset_for_season(league_data, latest_season)
-
-    predictions = []
-
+    league_data = get_subset_for_season(past_data, latest_season)
+    index = TeamMatchesIndex(league_data)
+    if names is None:
+        names = team_names.TeamNameIndex(league, past_data.teams)
+
+    # Find each fixture's past matches first (skipping fixtures where a team has played fewer than n
+    # home/away matches), then apply the rules to all of them at once
+    fixtures = []
+    home_team_positions = []
+    away_team_positions = []
     for match in matches:
         home_team, away_team, date, time = match
-        home_team = common.get_team_name(home_team, league)
-        away_team = common.get_team_name(away_team, league)
+        home_team = names.resolve(home_team)
+        away_team = names.resolve(away_team)
+        if home_team is None or away_team is None:
+            LOGGER.warning("Skipping %s in %s: unknown team", match, league)
+            continue
 
-        # These are tablib Datasets
-        home_team_past_matches = get_past_matches(home_team, league_data, is_home=True)
+        home_team_past_matches = index.get_last_matches(home_team, n, is_home=True)
         if len(home_team_past_matches) < n:
             continue
-        away_team_past_matches = get_past_matches(away_team, league_data, is_home=False)
+        away_team_past_matches = index.get_last_matches(away_team, n, is_home=False)
         if len(away_team_past_matches) < n:
             continue
 
-        home_team_matches_home_goals = [int(x) for x in home_team_past_matches['FTHG'][-n:]]
-        home_team_matches_away_goals = [int(x) for x in home_team_past_matches['FTAG'][-n:]]
-        home_team_match_total_goals = sum(home_team_matches_home_goals) + sum(home_team_matches_away_goals)
-        home_goals = zip(home_team_matches_home_goals, home_team_matches_away_goals)
-        is_home_team_over25 = len(list(filter(lambda x: x[0] + x[1] > 2.5, home_goals))) >= 2
+        fixtures.append((home_team, away_team, date, time))
+        home_team_positions.append(home_team_past_matches)
+        away_team_positions.append(away_team_past_matches)
 
-        away_team_matches_home_goals = [int(x) for x in away_team_past_matches['FTHG'][-n:]]
-        away_team_matches_away_goals = [int(x) for x in away_team_past_matches['FTAG'][-n:]]
-        away_team_match_total_goals = sum(away_team_matches_home_goals) + sum(away_team_matches_away_goals)
-        away_goals = zip(away_team_matches_home_goals, away_team_matches_away_goals)
-        is_away_team_over25 = len(list(filter(lambda x: x[0] + x[1] > 2.5, away_goals))) >= 2
-        is_away_team_previous_game_over25 = away_team_matches_home_goals[-1] + away_team_matches_away_goals[-1] > 2
-        is_away_team_scored_in_previous_games = len(list(filter(lambda x: x > 0, away_team_matches_away_goals))) >=2
+    if not fixtures:
+        return []
 
-        prediction = dict()
-        prediction['date'] = date
-        prediction['time'] = time
-        prediction['home_team'] = home_team
-        prediction['away_team'] = away_team
+    # (fixtures x n) arrays of the goals in each team's last n home/away matches
+    home_team_matches_home_goals, home_team_matches_away_goals = index.get_goals(np.array(home_team_positions))
+    away_team_matches_home_goals, away_team_matches_away_goals = index.get_goals(np.array(away_team_positions))
 
-        if home_team_match_total_goals >= 7 and is_home_team_over25 \
-                and away_team_match_total_goals >= 7 and is_away_team_over25 \
-                and is_away_team_previous_game_over25 \
-                and is_away_team_scored_in_previous_games:
+    home_team_match_total_goals = (home_team_matches_home_goals + home_team_matches_away_goals).sum(axis=1)
+    is_home_team_over25 = ((home_team_matches_home_goals + home_team_matches_away_goals) > 2.5).sum(axis=1) >= 2
 
-            prediction['is_over_25'] = True
+    away_team_match_total_goals = (away_team_matches_home_goals + away_team_matches_away_goals).sum(axis=1)
+    is_away_team_over25 = ((away_team_matches_home_goals + away_team_matches_away_goals) > 2.5).sum(axis=1) >= 2
+    is_away_team_previous_game_over25 = away_team_matches_home_goals[:, -1] + away_team_matches_away_goals[:, -1] > 2
+    is_away_team_scored_in_previous_games = (away_team_matches_away_goals > 0).sum(axis=1) >= 2
 
-        else:
+    is_over_25 = (home_team_match_total_goals >= 7) & is_home_team_over25 \
+        & (away_team_match_total_goals >= 7) & is_away_team_over25 \
+        & is_away_team_previous_game_over25 \
+        & is_away_team_scored_in_previous_games
 
-            prediction['is_over_25'] = False
+    predictions = []
 
-        predictions.append(prediction)
+    for (home_team, away_team, date, time), is_over in zip(fixtures, is_over_25.tolist()):
+        predictions.append(reports.OverUnderPrediction(date, time, home_team, away_team, is_over))
 
-        outcome = "over" if prediction['is_over_25'] == True else "under"
+        outcome = "over" if is_over else "under"
         output = """
         %s %s : %s -- %s  %s v. %s
         """ % (date, time, outcome, league, home_team, away_team)
@@ -146,21 +103,39 @@ def predict(league, past_data, matches):
 
 
 def get_subset_for_season(league_data, season):
-    subset_rows = []
-    for i in range(league_data.height):
-        row = league_data[i]
-        if row[1] == season:
-            subset_rows.append(i)
-
-    return league_data.subset(rows=subset_rows)
-
-
-def get_past_matches(team, data, is_home=True):
-    team_col = 3 if is_home else 4
-    rows = []
-    for i in range(data.height):
-        row = data[i]
-        if row[team_col] == team:
-            rows.append(i)
-
-    return data.subset(rows=rows)
\ No newline at end of file
+    return league_data.for_season(season)
+
+
+class TeamMatchesIndex:
+    # The positions of every team's home and away matches (in match order) in a league's matches,
+    # built in one pass so that looking up a team's last n home/away matches doesn't scan the league.
+    # A match whose goals are unknown (-1) isn't one of a team's past matches.
+
+    def __init__(self, league_data):
+        self.league_data = league_data
+        n_teams = len(league_data.teams)
+        self._home_goals = league_data['FTHG'].astype(np.int64)
+        self._away_goals = league_data['FTAG'].astype(np.int64)
+        scored = np.flatnonzero((self._home_goals >= 0) & (self._away_goals >= 0))
+        self._home_matches = _get_positions_by_team(league_data['HomeTeam'], scored, n_teams)
+        self._away_matches = _get_positions_by_team(league_data['AwayTeam'], scored, n_teams)
+
+    def get_last_matches(self, team, n, is_home=True):
+        # The positions of the team's last n (or fewer) home/away matches
+        team_id = self.league_data.team_id(team)
+        if team_id is None:
+            return np.array([], dtype=np.int64)
+        positions = self._home_matches[team_id] if is_home else self._away_matches[team_id]
+        return positions[-n:]
+
+    def get_goals(self, positions):
+        # The home and away goals of the matches at the given positions
+        return self._home_goals[positions], self._away_goals[positions]
+
+
+def _get_positions_by_team(team_ids, positions, n_teams):
+    # The positions (from positions) of each team's matches
+    team_ids = team_ids[positions]
+    order = positions[np.argsort(team_ids, kind='stable')]
+    counts = np.bincount(team_ids, minlength=n_teams)
+    return np.split(order, np.cumsum(counts)[:-1])
@@ -0,0 +1,81 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import traceback
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+
+def map_in_processes(func, items, n_workers):
+    # Like map(func, items), but spread over n_workers processes; results come back in the order of items.
+    #
+    # multiprocessing.Pool, Queue and concurrent.futures need /dev/shm, which Lambda doesn't have, so each
+    # worker is a plain Process with a Pipe of its own. The workers are given an item at a time, and send
+    # its result back as soon as they have it; then they're given the next item that no worker has had yet,
+    # so a worker with slow items doesn't hold up the rest. The workers are forked, so func and items don't
+    # need to be picklable (but the results do). If an item fails, the error is raised here once all the
+    # items have been processed.
+    items = list(items)
+    n_workers = min(n_workers, len(items))
+    if n_workers <= 1:
+        return [func(item) for item in items]
+
+    LOGGER.info("Processing %d items with %d worker processes", len(items), n_workers)
+    context = multiprocessing.get_context('fork')
+    processes = []
+    # connection: the index of the item its worker is processing
+    working = dict()
+    for idx in range(n_workers):
+        connection, worker_connection = context.Pipe()
+        process = context.Process(target=_worker, args=(func, items, worker_connection))
+        process.start()
+        worker_connection.close()
+        processes.append(process)
+        connection.send(idx)
+        working[connection] = idx
+
+    results = [None] * len(items)
+    errors = []
+    next_idx = n_workers
+    while working:
+        for connection in multiprocessing.connection.wait(list(working)):
+            idx = working.pop(connection)
+            try:
+                ok, value = connection.recv()
+            except EOFError:
+                errors.append((items[idx], "Worker process died while processing it"))
+                continue
+            if ok:
+                results[idx] = value
+            else:
+                errors.append((items[idx], value))
+            if next_idx < len(items):
+                connection.send(next_idx)
+                working[connection] = next_idx
+                next_idx += 1
+            else:
+                connection.send(None)
+    for process in processes:
+        process.join()
+
+    # If every worker died, the rest of the items weren't processed at all
+    errors += [(item, "Not processed: the worker processes died") for item in items[next_idx:]]
+    if errors:
+        for item, error in errors:
+            LOGGER.error("Failed to process %s:\n%s", item, error)
+        raise RuntimeError("Failed to process %d of %d items" % (len(errors), len(items)))
+
+    return results
+
+
+def _worker(func, items, connection):
+    # Processes the items the parent sends the indexes of, until it sends None
+    for idx in iter(connection.recv, None):
+        try:
+            connection.send((True, func(items[idx])))
+        except Exception:
+            # Including a result that can't be pickled
+            connection.send((False, traceback.format_exc()))
+    connection.close()
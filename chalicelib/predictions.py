@@ -0,0 +1,158 @@
+import importlib
+import logging
+import os
+import re
+from . import common
+from . import feature_store
+from . import historical_data
+from . import instrumentation
+from . import parallel
+from . import team_names
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# make_predictions runs every predictor against a new fixtures file. The fixtures are read once, then
+# for each league (in parallel, if PREDICTION_WORKERS > 1) a LeagueContext is made and given to each
+# predictor that covers the league. Finally each predictor sends its reports for all the leagues.
+#
+# A predictor is a module with:
+#
+#   is_predicted(league)          whether it makes predictions for the league
+#   predict_league(context)       returns the league's reports.LeaguePredictions, or None
+#   send_reports(bucket, fixtures_key, all_predictions)
+#                                 sends the emails (etc.) for the LeaguePredictions of every league
+#
+# PREDICTORS (comma-separated) says which of these to run. Their modules are only imported if they're used.
+PREDICTORS = {
+    'match': 'match_predictions',
+    'over_under': 'over_under_predictions',
+}
+
+
+def get_predictor_names():
+    return [name for name in re.split(r'[,\s]+', os.environ.get('PREDICTORS', 'match')) if name]
+
+
+def get_predictors(names):
+    # Returns {name: module}, in the order given
+    predictors = dict()
+    for name in names:
+        if name not in PREDICTORS:
+            raise ValueError("Unknown predictor %r (expected one of %s)" % (name, ', '.join(PREDICTORS)))
+        predictors[name] = importlib.import_module('.' + PREDICTORS[name], __package__)
+    return predictors
+
+
+def make_predictions(event):
+    LOGGER.info("Looks like there's a new fixtures file: %s/%s", event.bucket, event.key)
+
+    with instrumentation.stage('make_predictions'):
+        run(event.bucket, event.key, get_predictors(get_predictor_names()))
+
+
+def run(bucket, fixtures_key, predictors):
+    fixtures = common.get_fixtures_from_s3(bucket, fixtures_key)
+    matches_by_league = get_matches_by_league(fixtures)
+    leagues = sorted(matches_by_league)
+
+    n_workers = int(os.environ.get('PREDICTION_WORKERS', 1))
+    results = parallel.map_in_processes(
+        lambda league: _predict_league_and_record_reads(bucket, league, matches_by_league[league], predictors),
+        leagues, n_workers)
+
+    all_predictions = {name: [] for name in predictors}
+    for league_predictions, cache_reads in results:
+        # Count the workers' S3 reads, and forget anything here that they found has changed
+        common.s3_cache.merge(cache_reads)
+        for name, predictions in league_predictions.items():
+            if predictions is not None:
+                all_predictions[name].append(predictions)
+    common.log_s3_cache_stats()
+
+    for name, predictor in predictors.items():
+        with instrumentation.stage('reports', predictor=name):
+            predictor.send_reports(bucket, fixtures_key, all_predictions[name])
+
+
+def get_matches_by_league(fixtures):
+    # {Div: [(HomeTeam, AwayTeam, Date, Time), ...]}, in one pass over the fixtures
+    matches_by_league = dict()
+    for div, home_team, away_team, date, time in zip(fixtures['Div'], fixtures['HomeTeam'], fixtures['AwayTeam'],
+                                                     fixtures['Date'], fixtures['Time']):
+        matches_by_league.setdefault(div, []).append((home_team, away_team, date, time))
+    return matches_by_league
+
+
+def _predict_league_and_record_reads(bucket, league, matches, predictors):
+    # Also returns which objects were added to the S3 cache while predicting (see LruCache.start_recording),
+    # because a worker process's cache disappears with it
+    common.s3_cache.start_recording()
+    try:
+        with instrumentation.stage('league', league=league):
+            league_predictions = predict_league(bucket, league, matches, predictors)
+    finally:
+        cache_reads = common.s3_cache.stop_recording()
+    return league_predictions, cache_reads
+
+
+def predict_league(bucket, league, matches, predictors):
+    # Returns {predictor name: LeaguePredictions or None}
+    LOGGER.info("League: %s", league)
+    context = LeagueContext(bucket, league, matches)
+    league_predictions = dict()
+    for name, predictor in predictors.items():
+        if not predictor.is_predicted(league):
+            LOGGER.info("Skipping league %s for the %s predictions", league, name)
+            league_predictions[name] = None
+            continue
+        with instrumentation.stage('predictor', predictor=name):
+            league_predictions[name] = predictor.predict_league(context)
+    context.save()
+    return league_predictions
+
+
+class LeagueContext:
+    # What the predictors share about one league in a run: its fixtures, its historical data, the features
+    # stored with it and its team names. The historical data is only read when a predictor first asks for
+    # it, and each part of it (all, the tail, a season) is only read and decoded once (see
+    # HistoricalDataReader).
+
+    def __init__(self, bucket, div, matches):
+        self.bucket = bucket
+        self.div = div
+        self.league = common.DIVISIONS_TO_LEAGUES.get(div)
+        self.matches = matches
+        self._reader = None
+        self._names = None
+        self._features = None
+        self._features_loaded = False
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            with instrumentation.stage('read_historical', selection='header'):
+                self._reader = historical_data.HistoricalDataReader(self.bucket, self.div)
+        return self._reader
+
+    @property
+    def features(self):
+        # The feature_store.LeagueFeatures of the current version of the historical data, or None
+        if not self._features_loaded:
+            with instrumentation.stage('load_features'):
+                self._features = feature_store.load_features(self.bucket, self.div, self.reader.version)
+            self._features_loaded = True
+        return self._features
+
+    @property
+    def names(self):
+        # The league's team_names.TeamNameIndex
+        if self._names is None:
+            self._names = team_names.load_index(self.bucket, self.div, self.reader.teams)
+        return self._names
+
+    def save(self):
+        # Keeps the team names any predictor resolved (or couldn't) for the next run
+        if self._names is not None:
+            team_names.save_index(self.bucket, self._names)
@@ -0,0 +1,74 @@
+import importlib.util
+import numpy as np
+import os
+import warnings
+
+
+# The models train_classifiers fits are linear regressions on standardised features. They're tiny, so
+# rather than importing scikit-learn (which takes seconds on a cold Lambda) the default backend fits them
+# in closed form with NumPy. The sklearn backend (MODEL_BACKEND=sklearn) is only imported if it's asked for,
+# and scikit-learn isn't deployed with the functions: it's an optional dependency, in requirements-dev.txt.
+BACKENDS = ['numpy', 'sklearn']
+
+
+def get_backend_name():
+    return os.environ.get('MODEL_BACKEND', 'numpy')
+
+
+def get_backend(name):
+    # Returns a function that creates an unfitted model with fit(X, y), predict(X) and score(X, y)
+    if name == 'numpy':
+        return ScaledLinearRegression
+    if name == 'sklearn':
+        if importlib.util.find_spec('sklearn') is None:
+            raise ValueError("Model backend 'sklearn' needs scikit-learn (see requirements-dev.txt)")
+        return _make_sklearn_pipeline
+    raise ValueError("Unknown model backend %r (expected one of %s)" % (name, ', '.join(BACKENDS)))
+
+
+class ScaledLinearRegression:
+    # The same model as make_pipeline(StandardScaler(), LinearRegression()): the features are scaled to
+    # zero mean and unit variance, then fitted by least squares with an intercept
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        self.mean_ = X.mean(axis=0)
+        scale = X.std(axis=0)
+        # Like StandardScaler, leave constant features unscaled
+        scale[scale < 10 * np.finfo(scale.dtype).eps] = 1.0
+        self.scale_ = scale
+
+        X = self._scale(X)
+        X_offset = X.mean(axis=0)
+        y_offset = y.mean(axis=0)
+        self.coef_, _, _, _ = np.linalg.lstsq(X - X_offset, y - y_offset, rcond=None)
+        self.intercept_ = y_offset - X_offset @ self.coef_
+        return self
+
+    def predict(self, X):
+        return self._scale(np.asarray(X, dtype=np.float64)) @ self.coef_ + self.intercept_
+
+    def score(self, X, y):
+        # R² of the predictions for X, as sklearn's r2_score works it out (also when it's undefined)
+        y = np.asarray(y, dtype=np.float64)
+        if len(y) < 2:
+            warnings.warn("R^2 score is not well-defined with less than two samples.", UserWarning)
+            return float('nan')
+        residual = ((y - self.predict(X)) ** 2).sum()
+        total = ((y - y.mean()) ** 2).sum()
+        if total == 0:
+            return 1.0 if residual == 0 else 0.0
+        return 1 - residual / total
+
+    def _scale(self, X):
+        return (X - self.mean_) / self.scale_
+
+
+def _make_sklearn_pipeline():
+    from sklearn.linear_model import LinearRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    return make_pipeline(StandardScaler(), LinearRegression())
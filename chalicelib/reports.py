@@ -0,0 +1,246 @@
+import collections
+import json
+import logging
+import os
+import textwrap
+from . import common
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# What a run of the predictions produces, and the reports made from it. make_predictions collects a
+# LeaguePredictions for each league, then renders all its reports (the emails, and the JSON) in one pass:
+#
+#   emails = [reports.AllPredictionsEmail(), reports.BestPredictionsEmail()]
+#   reports.render(all_predictions, emails)
+#   for email in emails:
+#       email.send()
+
+
+class MatchPrediction(collections.namedtuple(
+        'MatchPrediction', ['date', 'time', 'home_team', 'away_team', 'home_pct', 'draw_pct', 'away_pct'])):
+    # The predicted percentage chance of each outcome of a fixture
+    __slots__ = ()
+
+    @property
+    def home_odds(self):
+        return 1/self.home_pct*100
+
+    @property
+    def draw_odds(self):
+        return 1/self.draw_pct*100
+
+    @property
+    def away_odds(self):
+        return 1/self.away_pct*100
+
+
+OverUnderPrediction = collections.namedtuple(
+    'OverUnderPrediction', ['date', 'time', 'home_team', 'away_team', 'is_over_25'])
+
+# The feature each of a league's models uses, and how well it fits
+ModelScores = collections.namedtuple(
+    'ModelScores', ['home_fname', 'home_score', 'draw_fname', 'draw_score', 'away_fname', 'away_score'])
+
+# models is None for the over/under predictions, which don't have any
+LeaguePredictions = collections.namedtuple(
+    'LeaguePredictions', ['div', 'league', 'models', 'predictions', 'unresolved_teams'])
+
+
+def render(all_predictions, reports):
+    # Feeds every league to every report, in one pass
+    for league_predictions in all_predictions:
+        for report in reports:
+            report.add_league(league_predictions)
+
+
+class _Report:
+
+    def __init__(self):
+        self._parts = []
+
+    @property
+    def message(self):
+        return ''.join(self._parts)
+
+
+class _Email(_Report):
+    subject = None
+    # Whether to send the email when there's nothing in it
+    send_empty = False
+
+    def send(self):
+        message = self.message
+        if message or self.send_empty:
+            common.send_mail(self.subject, message)
+
+
+class AllPredictionsEmail(_Email):
+    subject = "Football predictions (Home/Away)"
+    send_empty = True
+
+    league_template = textwrap.dedent("""
+    ==================================================
+    %s: %s
+    ==================================================
+    Home (%s) %.2f
+    Away (%s) %.2f
+    Draw (%s) %.2f
+
+    """)
+    match_template = textwrap.dedent("""
+    %s %s -- %s v. %s
+    --------------------------------------------------
+    Home: %.2f   (%.2f)
+    Draw: %.2f   (%.2f)
+    Away: %.2f   (%.2f)
+
+    """)
+
+    def add_league(self, league):
+        models = league.models
+        self._parts.append(self.league_template % (league.div, league.league,
+                                                   models.home_fname, models.home_score,
+                                                   models.away_fname, models.away_score,
+                                                   models.draw_fname, models.draw_score))
+        for p in league.predictions:
+            self._parts.append(self.match_template % (p.date, p.time, p.home_team, p.away_team,
+                                                      p.home_pct, p.home_odds, p.draw_pct, p.draw_odds,
+                                                      p.away_pct, p.away_odds))
+        if league.unresolved_teams:
+            self._parts.append("Skipped the fixtures of these unknown teams: %s\n" %
+                               ', '.join(league.unresolved_teams))
+
+    def send(self):
+        LOGGER.info("%s \n%s", self.subject, self.message)
+        super().send()
+
+
+class BestPredictionsEmail(_Email):
+    # The home and away wins that are at least cutoff percent likely
+
+    league_template = textwrap.dedent("""
+
+    ==================================================
+    %s: %s
+    ==================================================
+    """)
+    match_template = textwrap.dedent("""
+    %s %s -- %s v. %s
+    --------------------------------------------------
+    %s: %.2f   (%.2f)
+    %s
+
+    """)
+
+    def __init__(self, cutoff=None):
+        super().__init__()
+        if cutoff is None:
+            cutoff = int(os.environ.get('PREDICTION_CUTOFF', 65))
+        self.cutoff = cutoff
+        self.subject = "Top football predictions (cutoff = %.2f%%)" % cutoff
+
+    def add_league(self, league):
+        top_predictions = []
+        for p in league.predictions:
+            if p.home_pct >= self.cutoff:
+                top_predictions.append((p, p.home_team, p.home_pct, p.home_odds))
+            if p.away_pct >= self.cutoff:
+                top_predictions.append((p, p.away_team, p.away_pct, p.away_odds))
+
+        if top_predictions:
+            self._parts.append(self.league_template % (league.div, league.league))
+            note = "Note: consider Double Chance" if league.div == 'MEX' else ""
+            for p, winner, pct, odds in top_predictions:
+                self._parts.append(self.match_template % (p.date, p.time, p.home_team, p.away_team,
+                                                          winner, pct, odds, note))
+
+
+class DrawPredictionsEmail(_Email):
+    # Draws that are at least cutoff percent likely, between teams that are evenly matched
+
+    league_template = textwrap.dedent("""
+
+    ==================================================
+    %s: %s
+    ==================================================
+    """)
+    match_template = textwrap.dedent("""
+    %s v. %s
+    --------------------------------------------------
+    Draw: %.2f   (%.2f)
+
+    """)
+
+    def __init__(self, cutoff=None):
+        super().__init__()
+        if cutoff is None:
+            cutoff = int(os.environ.get('DRAW_CUTOFF', 30))
+        self.cutoff = cutoff
+        self.subject = "Football draw predictions (cutoff = %.2f%%)" % cutoff
+
+    def add_league(self, league):
+        draw_predictions = [p for p in league.predictions if p.draw_pct >= self.cutoff and _is_even(p)]
+        if draw_predictions:
+            self._parts.append(self.league_template % (league.div, league.league))
+            for p in draw_predictions:
+                self._parts.append(self.match_template % (p.home_team, p.away_team, p.draw_pct, p.draw_odds))
+
+
+def _is_even(p):
+    return 20 <= p.home_pct < 50 and 20 <= p.away_pct < 50 and abs(p.home_pct - p.away_pct) < 15
+
+
+class OverUnderEmail(_Email):
+    subject = "Football predictions (Over/Under 2.5 goals)"
+    send_empty = True
+
+    league_template = textwrap.dedent("""
+
+    ==================================================
+    %s: %s
+    ==================================================
+    """)
+    match_template = """
+    %s %s : %s -- %s v. %s
+    """
+
+    def add_league(self, league):
+        self._parts.append(self.league_template % (league.div, league.league))
+        for p in league.predictions:
+            outcome = "over" if p.is_over_25 else "under"
+            self._parts.append(self.match_template % (p.date, p.time, outcome, p.home_team, p.away_team))
+
+    def send(self):
+        LOGGER.info("%s \n%s", self.subject, self.message)
+        super().send()
+
+
+class JsonReport(_Report):
+    # The predictions as a JSON list with an object for each league
+
+    def add_league(self, league):
+        self._parts.append(', ' if self._parts else '[')
+        self._parts.append(json.dumps(to_dict(league)))
+
+    @property
+    def message(self):
+        return ''.join(self._parts) + ']' if self._parts else '[]'
+
+
+def to_dict(league):
+    # A LeaguePredictions as plain dicts and lists
+    result = {'div': league.div, 'league': league.league}
+    if league.models is not None:
+        result.update(league.models._asdict())
+    result['predictions'] = [_prediction_to_dict(p) for p in league.predictions]
+    result['unresolved_teams'] = list(league.unresolved_teams)
+    return result
+
+
+def _prediction_to_dict(p):
+    result = p._asdict()
+    if isinstance(p, MatchPrediction):
+        result.update({'home_odds': p.home_odds, 'draw_odds': p.draw_odds, 'away_odds': p.away_odds})
+    return result
@@ -0,0 +1,173 @@
+import botocore
+import difflib
+import json
+import logging
+import os
+import re
+import unicodedata
+from . import aws
+from . import common
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Resolving the team names in the fixtures (oddsportal's) to the names in the historical data
+# (football-data's). A TeamNameIndex is built once per league, from common.ODDSPORTAL_TEAMS and the teams
+# in the league's historical data, and tries in turn:
+#
+#   1. the name itself, if it's a team in the historical data, or an entry in ODDSPORTAL_TEAMS
+#   2. the same after normalizing both sides (case, accents, punctuation, 'FC', 'Utd', ...)
+#   3. a fuzzy match against the normalized names, if there's exactly one good candidate. Names that share
+#      a word (usually the place, e.g. 'Sheffield Utd' and 'Sheffield Weds') only match if the rest of
+#      them is similar too.
+#
+# Fuzzy matches are remembered, and saved with the names that couldn't be resolved at all under
+# S3_PREFIX_TEAM_NAMES (one JSON file per league), so they can be checked and added to ODDSPORTAL_TEAMS.
+
+# Words dropped when normalizing (unless that would leave nothing)
+IGNORED_WORDS = {'ac', 'afc', 'as', 'cd', 'cf', 'fc', 'fk', 'kv', 'ksv', 'sc', 'sv', 'ud'}
+ABBREVIATIONS = {'utd': 'united', 'ath': 'athletic'}
+
+# How similar (0 to 1, see difflib) a fuzzy match has to be, and how much better than the next best
+FUZZY_CUTOFF = 0.8
+FUZZY_MARGIN = 0.05
+
+# How similar a name has to be to a team's name that it's a whole-word part of (or the other way round)
+CONTAINMENT_CUTOFF = 0.7
+
+
+class TeamNameIndex:
+
+    def __init__(self, div, teams, fuzzy_matches=None, fuzzy=True):
+        # teams are the league's teams in the historical data. fuzzy_matches are ones remembered from
+        # earlier runs; any to teams that are no longer in the data are dropped. With fuzzy=False, only
+        # steps 1 and 2 are tried (and a name that isn't found isn't reported).
+        self.div = div
+        self.fuzzy = fuzzy
+        aliases = common.ODDSPORTAL_TEAMS.get(div, dict())
+        self.teams = set(teams) | set(aliases.values())
+
+        self._exact = {team: team for team in self.teams}
+        self._exact.update(aliases)
+
+        # A normalized name that two different teams share is no use
+        self._normalized = dict()
+        for name, team in sorted(self._exact.items()):
+            key = normalize(name)
+            self._normalized[key] = team if self._normalized.get(key, team) == team else None
+
+        self.fuzzy_matches = {name: team for name, team in (fuzzy_matches or dict()).items() if team in self.teams}
+        self.unresolved = []
+
+    def resolve(self, name):
+        # Returns the team, or None if there's no telling which one it is
+        if name in self._exact:
+            return self._exact[name]
+        team = self._normalized.get(normalize(name))
+        if team is not None:
+            return team
+        if name in self.fuzzy_matches:
+            return self.fuzzy_matches[name]
+        if not self.fuzzy or name in self.unresolved:
+            return None
+
+        team = self._match_fuzzily(normalize(name))
+        if team is None:
+            LOGGER.warning("Can't resolve team name %r in %s", name, self.div)
+            self.unresolved.append(name)
+        else:
+            LOGGER.info("Resolved team name %r in %s as %r", name, self.div, team)
+            self.fuzzy_matches[name] = team
+        return team
+
+    def _match_fuzzily(self, key):
+        if not key:
+            return None
+        keys = [k for k, team in self._normalized.items() if team is not None]
+
+        # A name that's a whole-word part of exactly one team's name, and most of it (e.g. 'Real Sociedad'
+        # for 'Sociedad', but not 'Dundee' for 'Dundee United')
+        words = key.split()
+        containing = {self._normalized[k] for k in keys
+                      if (_contains(k.split(), words) or _contains(words, k.split()))
+                      and _similarity(key, k) >= CONTAINMENT_CUTOFF}
+        if len(containing) == 1:
+            return containing.pop()
+
+        scores = sorted(((_similarity(key, k), k) for k in keys), reverse=True)
+        if not scores or scores[0][0] < FUZZY_CUTOFF or not _similar_apart_from_shared_words(key, scores[0][1]):
+            return None
+        if len(scores) > 1 and scores[1][0] > scores[0][0] - FUZZY_MARGIN \
+                and self._normalized[scores[1][1]] != self._normalized[scores[0][1]]:
+            return None
+        return self._normalized[scores[0][1]]
+
+
+def normalize(name):
+    # e.g. 'Manchester Utd' -> 'manchester united', 'Atl. Madrid' -> 'atl madrid', 'AC Milan' -> 'milan'
+    name = unicodedata.normalize('NFKD', name.replace('\x92', "'"))
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+    name = re.sub(r"['’]", '', name.replace('&', ' and '))
+    words = [ABBREVIATIONS.get(word, word) for word in re.findall(r'[a-z0-9]+', name)]
+    return ' '.join([word for word in words if word not in IGNORED_WORDS] or words)
+
+
+def _similarity(key, other):
+    return difflib.SequenceMatcher(None, key, other).ratio()
+
+
+def _similar_apart_from_shared_words(key, other):
+    # Whether the words that the two names don't share are similar, e.g. not 'united' and 'weds' in
+    # 'sheffield united' and 'sheffield weds'. Names with no words in common are only compared as a whole.
+    words, other_words = key.split(), other.split()
+    rest = [word for word in words if word not in other_words]
+    other_rest = [word for word in other_words if word not in words]
+    if len(rest) == len(words) or not rest or not other_rest:
+        return True
+    return _similarity(' '.join(rest), ' '.join(other_rest)) >= FUZZY_CUTOFF
+
+
+def _contains(words, part):
+    # Whether part is a run of whole words in words
+    return any(words[i:i + len(part)] == part for i in range(len(words) - len(part) + 1))
+
+
+def load_index(bucket, div, teams):
+    # A TeamNameIndex for the league, with the fuzzy matches saved by earlier runs
+    saved = _read(bucket, div)
+    return TeamNameIndex(div, teams, saved['fuzzy_matches'] if saved is not None else None)
+
+
+def save_index(bucket, index):
+    # Saves the index's fuzzy matches and unresolved names, if they've changed
+    if 'S3_PREFIX_TEAM_NAMES' not in os.environ:
+        return
+    entry = {'div': index.div, 'fuzzy_matches': index.fuzzy_matches, 'unresolved': sorted(index.unresolved)}
+    saved = _read(bucket, index.div)
+    if saved is not None and saved['fuzzy_matches'] == entry['fuzzy_matches'] \
+            and saved['unresolved'] == entry['unresolved']:
+        return
+    LOGGER.info("Saving team names for %s: %s", index.div, entry)
+    aws.client('s3').put_object(Bucket=bucket, Key=_get_key(index.div),
+                                Body=json.dumps(entry, indent=2).encode(), ContentType='application/json')
+
+
+def _read(bucket, div):
+    if 'S3_PREFIX_TEAM_NAMES' not in os.environ:
+        return None
+    try:
+        _, saved = common.get_cached_object(bucket, _get_key(div),
+                                            lambda body, etag: (json.loads(body), len(body)))
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ['403', '404', 'AccessDenied', 'NoSuchKey']:
+            # The object does not exist.
+            return None
+        else:
+            # Something else has gone wrong.
+            raise
+    return saved
+
+
+def _get_key(div):
+    return os.environ['S3_PREFIX_TEAM_NAMES'].rstrip('/') + '/' + div + '.json'
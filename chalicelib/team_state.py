@@ -0,0 +1,231 @@
+import numpy as np
+from . import columnar
+
+
+# The per-match feature columns, in the order add_ppg_fields appends them
+FEATURES = ['HomeTeamPpgAtHome', 'HomeTeamOverallPpg', 'AwayTeamPpgAway', 'AwayTeamOverallPpg',
+            'HomeTeamGpg', 'AwayTeamGpg', 'PpgDiff', 'HomeAwayPpgDiff', 'GpgTotal', 'GpgDiff']
+
+# Points for the home/away team, indexed by result code (the last entry is for unknown results, code -1)
+HOME_POINTS = np.array([3, 1, 0, 0])
+AWAY_POINTS = np.array([0, 1, 3, 0])
+
+# Columns of the per-team accumulators
+HOME_POINTS_COL, AWAY_POINTS_COL, HOME_MATCHES_COL, AWAY_MATCHES_COL, GOALS_COL = range(5)
+N_ACCUMULATORS = 5
+
+# How many of the most recent matches the teams' latest PPG (see get_latest_state) is worked out from
+PREDICTION_WINDOW = 200
+
+
+class TeamState:
+    # The per-team accumulators after replaying a league; row i belongs to teams[i]. It's a checkpoint:
+    # update_ppg_features carries on from it. n_matches is how many matches have been replayed, and
+    # last_key the key (see columnar.get_row_keys) of the last of them.
+
+    def __init__(self, teams, totals, n_matches=0, last_key=None):
+        self.teams = teams
+        self.totals = totals
+        self.n_matches = n_matches
+        self.last_key = last_key
+
+    @property
+    def home_points(self):
+        return self.totals[:, HOME_POINTS_COL]
+
+    @property
+    def away_points(self):
+        return self.totals[:, AWAY_POINTS_COL]
+
+    @property
+    def home_matches(self):
+        return self.totals[:, HOME_MATCHES_COL]
+
+    @property
+    def away_matches(self):
+        return self.totals[:, AWAY_MATCHES_COL]
+
+    @property
+    def goals(self):
+        return self.totals[:, GOALS_COL]
+
+
+class LatestState:
+    # What each team takes into its next match: overall/home/away PPG and match counts.
+    # A PPG is None for a team that hasn't played the matches it's based on.
+
+    def __init__(self, teams, overall_ppg, home_ppg, away_ppg, home_matches, away_matches):
+        self.teams = teams
+        self._ids = {team: i for i, team in enumerate(teams)}
+        self._overall_ppg = overall_ppg
+        self._home_ppg = home_ppg
+        self._away_ppg = away_ppg
+        self._home_matches = home_matches
+        self._away_matches = away_matches
+
+    def __contains__(self, team):
+        return team in self._ids
+
+    def overall_ppg(self, team):
+        return self._lookup(self._overall_ppg, team)
+
+    def home_ppg(self, team):
+        return self._lookup(self._home_ppg, team)
+
+    def away_ppg(self, team):
+        return self._lookup(self._away_ppg, team)
+
+    def home_matches(self, team):
+        return int(self._home_matches[self._ids[team]]) if team in self._ids else 0
+
+    def away_matches(self, team):
+        return int(self._away_matches[self._ids[team]]) if team in self._ids else 0
+
+    def arrays(self):
+        # The per-team values, as keyword arguments for LatestState(teams, ...)
+        return {'overall_ppg': self._overall_ppg, 'home_ppg': self._home_ppg, 'away_ppg': self._away_ppg,
+                'home_matches': self._home_matches, 'away_matches': self._away_matches}
+
+    def _lookup(self, values, team):
+        if team not in self._ids or np.isnan(values[self._ids[team]]):
+            return None
+        return float(values[self._ids[team]])
+
+
+def get_ppg_features(matches):
+    # Replay a league's matches (a columnar.LeagueTable); returns (features, TeamState)
+    home_ids, away_ids, results, home_goals, away_goals = _get_match_columns(matches)
+    features, totals = replay(home_ids, away_ids, results, home_goals, away_goals, len(matches.teams))
+    return features, TeamState(matches.teams, totals, len(matches), _get_last_key(matches))
+
+
+def update_ppg_features(state, matches):
+    # Carry on from state (a TeamState) with the matches that come after the ones it was replayed from (a
+    # columnar.LeagueTable); returns (features of those matches, TeamState after them). That's the same as
+    # get_ppg_features of all the matches, without replaying the earlier ones again.
+    teams = sorted(set(state.teams) | set(matches.teams))
+    team_ids = {team: i for i, team in enumerate(teams)}
+    totals = np.zeros((len(teams), N_ACCUMULATORS), dtype=np.int64)
+    totals[[team_ids[team] for team in state.teams]] = state.totals
+    team_map = np.array([team_ids[team] for team in matches.teams], dtype=np.int64)
+
+    home_ids, away_ids, results, home_goals, away_goals = _get_match_columns(matches)
+    features, totals = replay(team_map[home_ids], team_map[away_ids], results, home_goals, away_goals,
+                              len(teams), totals)
+    last_key = _get_last_key(matches) if len(matches) > 0 else state.last_key
+    return features, TeamState(teams, totals, state.n_matches + len(matches), last_key)
+
+
+def _get_last_key(matches):
+    return columnar.get_row_keys(matches.tail(1))[0] if len(matches) > 0 else None
+
+
+def get_latest_state(matches):
+    # Replay a league's matches (a columnar.LeagueTable) once and index where every team stands after it
+    home_ids, away_ids, results, home_goals, away_goals = _get_match_columns(matches)
+    features, _ = replay(home_ids, away_ids, results, home_goals, away_goals, len(matches.teams))
+    return latest_state(matches.teams, home_ids, away_ids, results, features)
+
+
+def latest_state(teams, home_ids, away_ids, results, features):
+    # The PPG going into a team's next match is extrapolated from its last match: the PPG before
+    # that match, the number of matches n and the points won in it give (ppg * n + points) / (n + 1).
+    # The home (away) PPG uses the team's last home (away) match and its number of home (away)
+    # matches; the overall PPG uses whichever of the two was more recent.
+    n_teams = len(teams)
+    n = len(home_ids)
+    home_matches = np.bincount(home_ids, minlength=n_teams)
+    away_matches = np.bincount(away_ids, minlength=n_teams)
+    last_home = np.full(n_teams, -1)
+    last_away = np.full(n_teams, -1)
+    np.maximum.at(last_home, home_ids, np.arange(n))
+    np.maximum.at(last_away, away_ids, np.arange(n))
+
+    home_ppg = _extrapolate(features['HomeTeamOverallPpg'], HOME_POINTS[results], last_home, home_matches)
+    away_ppg = _extrapolate(features['AwayTeamOverallPpg'], AWAY_POINTS[results], last_away, away_matches)
+
+    overall_matches = home_matches + away_matches
+    overall_from_home = _extrapolate(features['HomeTeamOverallPpg'], HOME_POINTS[results], last_home, overall_matches)
+    overall_from_away = _extrapolate(features['AwayTeamOverallPpg'], AWAY_POINTS[results], last_away, overall_matches)
+    overall_ppg = np.where(last_home > last_away, overall_from_home, overall_from_away)
+    overall_ppg[(last_home < 0) | (last_away < 0)] = np.nan
+
+    return LatestState(teams, overall_ppg, home_ppg, away_ppg, home_matches, away_matches)
+
+
+def _extrapolate(ppg_before, points, last_idx, n):
+    played = last_idx >= 0
+    last = last_idx[played]
+    extrapolated = np.full(len(last_idx), np.nan)
+    extrapolated[played] = (ppg_before[last] * n[played] + points[last]) / (n[played] + 1)
+    return extrapolated
+
+
+def _get_match_columns(matches):
+    # Unknown goals (-1) count as 0
+    return matches['HomeTeam'].astype(np.int64), matches['AwayTeam'].astype(np.int64), matches['FTR'], \
+        np.maximum(matches['FTHG'], 0).astype(np.int64), np.maximum(matches['FTAG'], 0).astype(np.int64)
+
+
+def replay(home_ids, away_ids, results, home_goals, away_goals, n_teams, initial=None):
+    # Returns a dict of feature arrays (one value per match, computed from the matches before it)
+    # and the (n_teams, N_ACCUMULATORS) totals at the end. initial is the totals to start from (the
+    # totals after the matches before these ones), if there are any.
+    n = len(home_ids)
+
+    # Each match is two appearances (home team first, then away team), each holding what it
+    # adds to that team's accumulators
+    teams = np.empty(2 * n, dtype=np.int64)
+    teams[0::2], teams[1::2] = home_ids, away_ids
+    deltas = np.zeros((2 * n, N_ACCUMULATORS), dtype=np.int64)
+    deltas[0::2, HOME_POINTS_COL] = HOME_POINTS[results]
+    deltas[0::2, HOME_MATCHES_COL] = 1
+    deltas[0::2, GOALS_COL] = home_goals
+    deltas[1::2, AWAY_POINTS_COL] = AWAY_POINTS[results]
+    deltas[1::2, AWAY_MATCHES_COL] = 1
+    deltas[1::2, GOALS_COL] = away_goals
+
+    totals = np.zeros((n_teams, N_ACCUMULATORS), dtype=np.int64) if initial is None else initial.copy()
+    np.add.at(totals, teams, deltas)
+
+    # Group the appearances by team (keeping match order) and take running totals within each
+    # group; the totals *before* an appearance are what the team had going into that match
+    before = np.zeros_like(deltas)
+    if n > 0:
+        order = np.argsort(teams, kind='stable')
+        sorted_teams = teams[order]
+        sorted_deltas = deltas[order]
+        running = np.cumsum(sorted_deltas, axis=0) - sorted_deltas
+        group_starts = np.flatnonzero(np.r_[True, sorted_teams[1:] != sorted_teams[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, 2 * n])
+        running -= np.repeat(running[group_starts], group_sizes, axis=0)
+        before[order] = running
+        if initial is not None:
+            before += initial[teams]
+
+    return _get_features(before[0::2], before[1::2]), totals
+
+
+def _get_features(home_before, away_before):
+    home_team_matches = home_before[:, HOME_MATCHES_COL] + home_before[:, AWAY_MATCHES_COL]
+    away_team_matches = away_before[:, HOME_MATCHES_COL] + away_before[:, AWAY_MATCHES_COL]
+
+    features = dict()
+    features['HomeTeamPpgAtHome'] = _per_game(home_before[:, HOME_POINTS_COL], home_before[:, HOME_MATCHES_COL])
+    features['HomeTeamOverallPpg'] = _per_game(home_before[:, HOME_POINTS_COL] + home_before[:, AWAY_POINTS_COL],
+                                               home_team_matches)
+    features['AwayTeamPpgAway'] = _per_game(away_before[:, AWAY_POINTS_COL], away_before[:, AWAY_MATCHES_COL])
+    features['AwayTeamOverallPpg'] = _per_game(away_before[:, HOME_POINTS_COL] + away_before[:, AWAY_POINTS_COL],
+                                               away_team_matches)
+    features['HomeTeamGpg'] = _per_game(home_before[:, GOALS_COL], home_team_matches)
+    features['AwayTeamGpg'] = _per_game(away_before[:, GOALS_COL], away_team_matches)
+
+    features['PpgDiff'] = features['HomeTeamOverallPpg'] - features['AwayTeamOverallPpg']
+    features['HomeAwayPpgDiff'] = features['HomeTeamPpgAtHome'] - features['AwayTeamPpgAway']
+    features['GpgTotal'] = features['HomeTeamGpg'] + features['AwayTeamGpg']
+    features['GpgDiff'] = features['HomeTeamGpg'] - features['AwayTeamGpg']
+    return features
+
+
+def _per_game(totals, matches):
+    return np.divide(totals, matches, out=np.zeros(len(totals)), where=matches > 0)
@@ -0,0 +1,11 @@
+import json
+import os
+
+# The functions read their configuration from the environment when they're imported, so the tests use what
+# they're deployed with (as the benchmarks do), with S3 replaced by benchmarks.local_s3
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+with open(os.path.join(REPO, '.chalice', 'config.json')) as f:
+    os.environ.update(json.load(f)['environment_variables'])
+os.environ.pop('MODEL_CACHE_DIR', None)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
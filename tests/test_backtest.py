@@ -0,0 +1,88 @@
+import numpy as np
+import os
+import unittest
+from unittest import mock
+from benchmarks import local_s3, synthetic
+from chalicelib import backtest, columnar, match_predictions, team_state
+
+
+class WalkForwardTest(unittest.TestCase):
+
+    def setUp(self):
+        seasons = synthetic.get_seasons(3, os.environ['LATEST_SEASON'])
+        self.table = columnar.from_dataset(synthetic.generate_league('E0', 20, seasons), 'E0')
+
+    def test_never_trains_on_what_it_predicts(self):
+        fits = []
+
+        def fit_classifiers(features, results):
+            fits.append(len(results))
+            for values in features.values():
+                self.assertEqual(len(values), len(results))
+            return fit_classifiers.original(features, results)
+
+        fit_classifiers.original = match_predictions.fit_classifiers
+        with mock.patch.object(match_predictions, 'fit_classifiers', fit_classifiers):
+            rows, pcts, n_refits = backtest.backtest_league(self.table, retrain_days=14, min_training_matches=300)
+
+        self.assertEqual(len(fits), n_refits)
+        self.assertGreater(n_refits, 10)
+        dates = self.table['Date']
+        predicted = 0
+        for n_training, (start, stop) in zip(fits, backtest.get_retrain_blocks(dates, 14, 300)):
+            # Each block is predicted by models trained only on the matches of earlier days
+            self.assertEqual(n_training, start)
+            self.assertTrue((dates[start:stop] > dates[start - 1]).all())
+            np.testing.assert_array_equal(rows[predicted:predicted + stop - start], np.arange(start, stop))
+            predicted += stop - start
+        self.assertEqual(predicted, len(rows))
+
+    def test_same_as_training_on_the_past_alone(self):
+        # The features of the matches before a block don't depend on the matches after it, so fitting on
+        # a prefix of the league's features is the same as fitting on only the matches that came before
+        rows, pcts, _ = backtest.backtest_league(self.table, retrain_days=30, min_training_matches=300)
+        features, _ = team_state.get_ppg_features(self.table)
+        for start, stop in list(backtest.get_retrain_blocks(self.table['Date'], 30, 300))[::5]:
+            past = self.table.take(range(start))
+            home_clf, draw_clf, away_clf, _, _, _, home_fname, draw_fname, away_fname = \
+                match_predictions.train_classifiers(past, 'E0')
+            block = np.flatnonzero((rows >= start) & (rows < stop))
+            expected = np.column_stack([clf.predict(features[fname][rows[block]].reshape(-1, 1)) for clf, fname in
+                                        [(home_clf, home_fname), (draw_clf, draw_fname), (away_clf, away_fname)]])
+            np.testing.assert_allclose(pcts[block], expected)
+
+
+class RunTest(unittest.TestCase):
+
+    def test_skips_leagues_without_enough_data(self):
+        seasons = synthetic.get_seasons(2, os.environ['LATEST_SEASON'])
+        tables = {div: columnar.from_dataset(synthetic.generate_league(div, 20, seasons, seed=seed), div)
+                  for seed, div in enumerate(['E0', 'E1'])}
+        tables['E1'] = tables['E1'].take(range(40))
+
+        def load(league):
+            if league == 'D1':
+                local_s3._raise('NoSuchKey', 'GetObject')
+            if league == 'D2':
+                raise FileNotFoundError(league + '.cols')
+            return tables[league]
+
+        with self.assertLogs(level='WARNING') as logs:
+            report = backtest.run(load, ['E0', 'E1', 'D1', 'D2'])
+        self.assertEqual(len([line for line in logs.output if 'Skipping' in line]), 3)
+        self.assertEqual(list(report['leagues']), ['E0'])
+        self.assertEqual(report['skipped'], ['E1', 'D1', 'D2'])
+        self.assertEqual(report['overall']['matches'], report['leagues']['E0']['matches'])
+        # (The worker processes log the same)
+        in_workers = backtest.run(load, ['E0', 'E1', 'D1', 'D2'], n_workers=2)
+        self.assertEqual((list(in_workers['leagues']), in_workers['skipped']), (['E0'], ['E1', 'D1', 'D2']))
+        self.assertIn("Skipped (not enough data): E1, D1, D2", backtest.format_report(report))
+
+        # With too few matches to train on at all
+        with self.assertLogs(level='WARNING'):
+            report = backtest.run(load, ['E1'], min_training_matches=10)
+        self.assertEqual((report['leagues'], report['skipped'], report['overall']), ({}, ['E1'], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
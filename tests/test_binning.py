@@ -0,0 +1,67 @@
+import numpy as np
+import tablib
+import unittest
+from collections import Counter
+from chalicelib import binning, columnar, match_predictions
+
+
+class BinningTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.values = np.round(rng.normal(0, 0.6, 1500), 6)
+        self.results = rng.choice([0, 1, 2, -1], len(self.values), p=[0.45, 0.25, 0.28, 0.02]).astype(np.int8)
+
+    def test_percentages_for_diffs_are_exact(self):
+        # The same as testing every match against every bin, with the bins starting at the 5th percentile
+        ftrs = [columnar.RESULTS[r] if r >= 0 else '' for r in self.results]
+        diffs, pcts = match_predictions.get_percentages_for_diffs({'PpgDiff': self.values, 'FTR': ftrs}, 'PpgDiff', 'H')
+
+        start, end = np.quantile(self.values[binning.SETTLE_MATCHES:], [0.05, 0.95])
+        expected_diffs, expected_pcts = [], []
+        for lower in np.arange(start, end, binning.BIN_STEP):
+            in_bin = (self.values >= lower) & (self.values < lower + binning.BIN_STEP) & (self.results >= 0)
+            n_home = np.sum(in_bin & (self.results == columnar.RESULT_CODES['H']))
+            if n_home > 0:
+                expected_diffs.append(lower)
+                expected_pcts.append(n_home / np.sum(in_bin) * 100.0)
+        self.assertEqual(diffs, expected_diffs)
+        np.testing.assert_allclose(pcts, expected_pcts)
+
+
+    def test_same_as_scanning_each_bin(self):
+        # Against the original get_percentages_for_diffs, which scanned every row for each bin. PPG
+        # differences are fractions such as 1/3 - 1/6, many of them right on (or a rounding error from) a
+        # bin edge, which is where the binary searches and the original comparisons could disagree.
+        rng = np.random.default_rng(1)
+        values = np.concatenate([rng.integers(-20, 20, 1000) / 10,
+                                 rng.integers(0, 40, 1000) / rng.integers(1, 20, 1000) - rng.integers(0, 40, 1000) / 20])
+        rng.shuffle(values)
+        ftrs = rng.choice(['H', 'D', 'A', ''], len(values), p=[0.45, 0.25, 0.28, 0.02])
+        data = tablib.Dataset(*zip(values.tolist(), ftrs.tolist()), headers=['PpgDiff', 'FTR'])
+        for ftr in ['H', 'D', 'A']:
+            diffs, pcts = match_predictions.get_percentages_for_diffs(data, 'PpgDiff', ftr)
+            expected_diffs, expected_pcts = _scan_each_bin(data, 'PpgDiff', ftr)
+            self.assertEqual(diffs, expected_diffs)
+            self.assertEqual(pcts, expected_pcts)
+
+
+def _scan_each_bin(data, fname, ftr):
+    # The original get_percentages_for_diffs
+    pcts = []
+    diffs = []
+    start, end = np.quantile(data[fname][50:], [0.05, 0.95])
+    step = 0.1
+    fname_idx = data.headers.index(fname)
+    for i in np.arange(start, end, step):
+        keepers = [idx for idx, row in enumerate(data) if row[fname_idx] >= i and row[fname_idx] < i+step]
+        vc = Counter(data.subset(rows=keepers)['FTR'])
+        total = vc['H'] + vc['D'] + vc['A']
+        if vc[ftr] > 0:
+            pcts.append(vc[ftr] / total * 100.0 if total > 0 else 0.0)
+            diffs.append(i)
+    return diffs, pcts
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from benchmarks import local_s3
+from chalicelib import cache, common, parallel
+
+
+BUCKET = 'test-bucket'
+
+
+class LruCacheTest(unittest.TestCase):
+
+    def test_evicts_the_least_recently_used(self):
+        lru = cache.LruCache(100)
+        for key in 'abc':
+            lru.put(key, 'v', key, 40)
+        self.assertEqual((len(lru), lru.size), (2, 80))
+        self.assertEqual(lru.get('a'), (None, None))
+        lru.get('b')
+        lru.put('d', 'v', 'd', 40)
+        self.assertEqual(lru.get('b'), ('v', 'b'))
+        self.assertEqual(lru.get('c'), (None, None))
+
+    def test_replaces_an_entry(self):
+        lru = cache.LruCache(100)
+        lru.put('a', 'v1', 'old', 60)
+        lru.put('a', 'v2', 'new', 30)
+        self.assertEqual((lru.get('a'), lru.size), (('v2', 'new'), 30))
+
+    def test_too_big_for_the_cache(self):
+        lru = cache.LruCache(100)
+        lru.put('a', 'v1', 'small', 10)
+        lru.put('a', 'v2', 'big', 101)
+        self.assertEqual((lru.get('a'), len(lru), lru.size), ((None, None), 0, 0))
+
+    def test_records_keys_not_values(self):
+        lru = cache.LruCache(100)
+        lru.put('a', 'v', 'before', 10)
+        lru.start_recording()
+        lru.put('b', 'v', 'value', 10)
+        lru.record_hit()
+        lru.record_miss()
+        recorded = lru.stop_recording()
+        self.assertEqual((recorded['entries'], recorded['hits'], recorded['misses']), ([('b', 'v', 10)], 1, 1))
+        # Recorded in this process, so there's nothing to merge
+        lru.merge(recorded)
+        self.assertEqual((len(lru), lru.hits, lru.misses), (2, 1, 1))
+
+
+class MergeFromWorkersTest(unittest.TestCase):
+    # What predictions.run does with the S3 cache of its worker processes
+
+    def setUp(self):
+        self.s3, _ = local_s3.install()
+        common.s3_cache.clear()
+        common.s3_cache.hits = common.s3_cache.misses = 0
+        for key in 'abcd':
+            self.s3.put_object(Bucket=BUCKET, Key=key, Body=key.encode())
+
+    def test_merge(self):
+        # The parent has 'a' and 'b', and then 'b' changes
+        self._get('a')
+        self._get('b')
+        self.s3.put_object(Bucket=BUCKET, Key='b', Body=b'changed')
+
+        results = parallel.map_in_processes(self._get_and_record, ['a', 'b', 'c', 'd'], 2)
+        for value, _ in results:
+            self.assertIsNotNone(value)
+        for _, recorded in results:
+            common.s3_cache.merge(recorded)
+
+        # The workers' hits ('a') and misses ('b', 'c' and 'd') are counted, after the parent's two misses
+        self.assertEqual((common.s3_cache.hits, common.s3_cache.misses), (1, 5))
+        # 'b' is out of date, so it's dropped; what the workers read isn't sent back
+        self.assertEqual(len(common.s3_cache), 1)
+        self.assertEqual(self._get('a'), b'a')
+        self.assertEqual(common.s3_cache.hits, 2)
+
+    def _get(self, key):
+        _, value = common.get_cached_object(BUCKET, key, lambda body, etag: (body, len(body)))
+        return value
+
+    def _get_and_record(self, key):
+        # As predictions._predict_league_and_record_reads does
+        common.s3_cache.start_recording()
+        try:
+            value = self._get(key)
+        finally:
+            recorded = common.s3_cache.stop_recording()
+        return value, recorded
+
+
+if __name__ == '__main__':
+    unittest.main()
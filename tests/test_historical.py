@@ -0,0 +1,133 @@
+import botocore
+import numpy as np
+import os
+import unittest
+from unittest import mock
+from benchmarks import local_s3, synthetic
+from chalicelib import columnar, common, feature_store, historical, historical_data
+
+
+BUCKET = 'test-bucket'
+LEAGUE = 'E0'
+
+
+class WriteHistoricalDataTest(unittest.TestCase):
+    # Rewriting a league that has segments (e.g. when it's compacted)
+
+    def setUp(self):
+        self.s3, _ = local_s3.install()
+        common.s3_cache.clear()
+        self.prefix = os.environ['S3_PREFIX_HISTORICAL']
+        seasons = synthetic.get_seasons(3, os.environ['LATEST_SEASON'])
+        self.latest_season, self.previous_seasons = seasons[-1], seasons[:-1]
+        self.table = columnar.from_dataset(synthetic.generate_league(LEAGUE, 20, seasons), LEAGUE)
+        stored = self.table.take(range(len(self.table) - 10))
+        historical._write_historical_data(BUCKET, self.prefix, LEAGUE, self.latest_season,
+                                          self.previous_seasons, [historical._get_part(stored)])
+        historical._append_historical_data(BUCKET, self.prefix, LEAGUE, self.latest_season, self.previous_seasons,
+                                           self.table.for_season(self.latest_season))
+        self.segment_key = historical_data.HistoricalDataReader(BUCKET, LEAGUE).manifest['segments'][0]['key']
+
+    def test_deletes_the_old_segments(self):
+        self._rewrite()
+        self.assertNotIn((BUCKET, self.segment_key), self.s3.objects)
+
+    def test_tolerates_a_failed_delete(self):
+        def delete_object(**kwargs):
+            local_s3._raise('AccessDenied', 'DeleteObject')
+
+        with mock.patch.object(self.s3, 'delete_object', delete_object):
+            self._rewrite()
+        self.assertIn((BUCKET, self.segment_key), self.s3.objects)
+
+    def _rewrite(self):
+        historical._write_historical_data(BUCKET, self.prefix, LEAGUE, self.latest_season,
+                                          self.previous_seasons, [historical._get_part(self.table)])
+        reader = historical_data.HistoricalDataReader(BUCKET, LEAGUE)
+        self.assertEqual(reader.manifest['segments'], [])
+        self.assertTrue(columnar.same_rows(reader.read_all(), self.table))
+        self.assertIsNotNone(feature_store.load_features(BUCKET, LEAGUE, reader.version))
+
+
+class WriteSeasonBySeasonTest(unittest.TestCase):
+    # Writing the seasons one at a time, as fetch_historical_data does
+
+    def setUp(self):
+        self.s3, _ = local_s3.install()
+        common.s3_cache.clear()
+        self.prefix = os.environ['S3_PREFIX_HISTORICAL']
+        seasons = synthetic.get_seasons(4, os.environ['LATEST_SEASON'])
+        self.latest_season, self.previous_seasons = seasons[-1], seasons[:-1]
+        self.table = columnar.from_dataset(synthetic.generate_league(LEAGUE, 20, seasons), LEAGUE)
+        # The past seasons as they're kept in S3, each with only its own teams
+        for season in self.previous_seasons:
+            self.s3.put_object(Bucket=BUCKET, Key=historical._get_season_key(self.prefix, LEAGUE, season),
+                               Body=columnar.encode(columnar.concatenate([self.table.for_season(season)])))
+        self.base_key = historical_data.get_base_key(self.prefix, LEAGUE)
+
+    def test_same_as_the_whole_table(self):
+        self._write()
+        body, _, _ = self.s3.objects[(BUCKET, self.base_key)]
+        self.assertEqual(body, columnar.encode(self.table))
+        reader = historical_data.HistoricalDataReader(BUCKET, LEAGUE)
+        self.assertTrue(columnar.same_rows(reader.read_all(), self.table))
+        self._check_features(reader.version)
+
+    def test_multipart_upload(self):
+        self.s3.min_part_bytes = 1024
+        with mock.patch.dict(os.environ, {'HISTORICAL_UPLOAD_PART_BYTES': '1024', 'HISTORICAL_EXPORT_CSV': 'true'}):
+            self._write()
+        body, etag, _ = self.s3.objects[(BUCKET, self.base_key)]
+        self.assertEqual(body, columnar.encode(self.table))
+        self.assertRegex(etag, r'-[2-9]"$')
+        csv, _, _ = self.s3.objects[(BUCKET, self.base_key[:-len('.cols')] + '.csv')]
+        self.assertEqual(csv.decode(), self.table.to_dataset().export('csv'))
+        self.assertEqual(self.s3.uploads, {})
+        reader = historical_data.HistoricalDataReader(BUCKET, LEAGUE)
+        self.assertTrue(columnar.same_rows(reader.read_all(), self.table))
+        self._check_features(reader.version)
+
+    def test_aborts_a_failed_upload(self):
+        def upload_part(**kwargs):
+            if kwargs['PartNumber'] > 1:
+                local_s3._raise('InternalError', 'UploadPart')
+            return upload_part.original(**kwargs)
+
+        upload_part.original = self.s3.upload_part
+        with mock.patch.dict(os.environ, {'HISTORICAL_UPLOAD_PART_BYTES': '1024'}), \
+                mock.patch.object(self.s3, 'upload_part', upload_part):
+            with self.assertRaises(botocore.exceptions.ClientError):
+                self._write()
+        self.assertEqual(self.s3.uploads, {})
+        self.assertNotIn((BUCKET, self.base_key), self.s3.objects)
+
+    def _write(self):
+        parts = [historical._get_past_season_part(None, BUCKET, self.prefix, None, LEAGUE, season)
+                 for season in self.previous_seasons]
+        parts.append(historical._get_part(self.table.for_season(self.latest_season)))
+        historical._write_historical_data(BUCKET, self.prefix, LEAGUE, self.latest_season, self.previous_seasons,
+                                          parts)
+
+    def _check_features(self, version):
+        stored = feature_store.load_features(BUCKET, LEAGUE, version)
+        expected = feature_store.compute_features(version, [self.table])
+        for fname in expected.features:
+            np.testing.assert_array_equal(stored.features[fname], expected.features[fname], err_msg=fname)
+        self.assertEqual(stored.latest_state.teams, expected.latest_state.teams)
+
+
+class GetLastModifiedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s3, _ = local_s3.install()
+
+    def test_missing_object(self):
+        self.assertIsNone(historical._get_last_modified(BUCKET, 'historical/XX.cols'))
+
+    def test_object(self):
+        self.s3.put_object(Bucket=BUCKET, Key='historical/XX.cols', Body=b'data')
+        self.assertIsNotNone(historical._get_last_modified(BUCKET, 'historical/XX.cols'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import unittest
+from benchmarks import local_s3, synthetic
+from chalicelib import columnar, common, historical, historical_data
+
+
+BUCKET = 'test-bucket'
+LEAGUE = 'E0'
+
+
+class HistoricalDataReaderTest(unittest.TestCase):
+    # A league written by fetch_historical_data always has a manifest, so its version is the manifest's
+    # ETag rather than the base's. Three seasons of a 20-team league are bigger than the prefetch, so most
+    # of the reads here are ranged GETs of the base.
+
+    def setUp(self):
+        self.s3, _ = local_s3.install()
+        common.s3_cache.clear()
+        self.prefix = os.environ['S3_PREFIX_HISTORICAL']
+        seasons = synthetic.get_seasons(3, os.environ['LATEST_SEASON'])
+        self.latest_season, self.previous_seasons = seasons[-1], seasons[:-1]
+        data = synthetic.generate_league(LEAGUE, 20, seasons)
+        self.table = columnar.from_dataset(data, LEAGUE)
+        historical._write_historical_data(BUCKET, self.prefix, LEAGUE, self.latest_season,
+                                          self.previous_seasons, [historical._get_part(self.table)])
+
+    def test_base_is_bigger_than_the_prefetch(self):
+        body, _, _ = self.s3.objects[(BUCKET, historical_data.get_base_key(self.prefix, LEAGUE))]
+        self.assertGreater(len(body), historical_data.HistoricalDataReader.PREFETCH_BYTES)
+
+    def test_reads_with_a_manifest(self):
+        reader = historical_data.HistoricalDataReader(BUCKET, LEAGUE)
+        self.assertIsNotNone(reader.manifest)
+        self.assertNotEqual(reader.version, reader.manifest['base_etag'])
+        self._check_reads(reader, self.table)
+
+    def test_reads_with_a_segment(self):
+        latest = self.table.for_season(self.latest_season)
+        stored = self.table.take(range(len(self.table) - 10))
+        historical._write_historical_data(BUCKET, self.prefix, LEAGUE, self.latest_season,
+                                          self.previous_seasons, [historical._get_part(stored)])
+        self.assertEqual(historical._append_historical_data(BUCKET, self.prefix, LEAGUE, self.latest_season,
+                                                            self.previous_seasons, latest), 1)
+
+        reader = historical_data.HistoricalDataReader(BUCKET, LEAGUE)
+        self.assertEqual(len(reader.manifest['segments']), 1)
+        self._check_reads(reader, self.table)
+
+    def _check_reads(self, reader, table):
+        self.assertTrue(columnar.same_rows(reader.read_tail(200), table.tail(200)))
+        for season in self.previous_seasons + [self.latest_season]:
+            self.assertTrue(columnar.same_rows(reader.read_season(season), table.for_season(season)))
+        self.assertTrue(columnar.same_rows(reader.read_all(), table))
+
+
+if __name__ == '__main__':
+    unittest.main()
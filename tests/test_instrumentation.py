@@ -0,0 +1,52 @@
+import json
+import tracemalloc
+import unittest
+from unittest import mock
+from chalicelib import instrumentation
+
+
+class StageTest(unittest.TestCase):
+
+    def tearDown(self):
+        # Once a stage has started tracing memory, it's left on
+        tracemalloc.stop()
+
+    def test_off(self):
+        with mock.patch.object(instrumentation, 'enabled', False), \
+                mock.patch.object(instrumentation, 'LOGGER') as logger:
+            with instrumentation.stage('outer', league='E0') as outer:
+                with instrumentation.stage('inner'):
+                    pass
+        self.assertIsNone(outer)
+        logger.info.assert_not_called()
+
+    def test_on(self):
+        with mock.patch.object(instrumentation, 'enabled', True):
+            with self.assertLogs(level='INFO') as logs:
+                with instrumentation.stage('outer', league='E0'):
+                    with instrumentation.stage('inner', fname='PpgDiff'):
+                        data = bytearray(1024 * 1024)
+                    del data
+        inner, outer = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+
+        # Inner stages are logged first, and inherit the tags of the stages they're in
+        self.assertEqual((inner['stage'], inner['league'], inner['fname']), ('inner', 'E0', 'PpgDiff'))
+        self.assertEqual((outer['stage'], outer['league']), ('outer', 'E0'))
+        self.assertNotIn('fname', outer)
+        # The inner stage's peak is part of the outer one's
+        self.assertGreaterEqual(inner['peak_alloc_bytes'], 1024 * 1024)
+        self.assertGreaterEqual(outer['peak_alloc_bytes'], inner['peak_alloc_bytes'])
+        self.assertGreaterEqual(outer['wall_ms'], inner['wall_ms'])
+        self.assertEqual(instrumentation._get_running_stages(), [])
+
+    def test_error(self):
+        with mock.patch.object(instrumentation, 'enabled', True):
+            with self.assertLogs(level='INFO') as logs, self.assertRaises(KeyError):
+                with instrumentation.stage('fails'):
+                    raise KeyError('E0')
+        self.assertEqual(json.loads(logs.output[0].split(':', 2)[2])['error'], 'KeyError')
+        self.assertEqual(instrumentation._get_running_stages(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
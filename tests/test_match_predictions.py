@@ -0,0 +1,50 @@
+import numpy as np
+import os
+import unittest
+from benchmarks import synthetic
+from chalicelib import columnar, feature_store, match_predictions, team_names
+
+
+LEAGUE = 'E0'
+
+
+class PredictTest(unittest.TestCase):
+
+    def setUp(self):
+        seasons = synthetic.get_seasons(3, os.environ['LATEST_SEASON'])
+        self.data = columnar.from_dataset(synthetic.generate_league(LEAGUE, 20, seasons), LEAGUE)
+        home_clf, draw_clf, away_clf, _, _, _, home_fname, draw_fname, away_fname = \
+            match_predictions.train_classifiers(self.data, LEAGUE)
+        self.classifiers = {'home_clf': home_clf, 'draw_clf': draw_clf, 'away_clf': away_clf,
+                            'home_fname': home_fname, 'draw_fname': draw_fname, 'away_fname': away_fname}
+        self.teams = synthetic.get_team_names(LEAGUE, 20)
+
+    def test_stored_features_train_the_same_models(self):
+        # fit_classifiers bins the stored features exactly as train_classifiers bins the replayed ones
+        stored = feature_store.compute_features('v', [self.data])
+        trained = match_predictions.fit_classifiers(stored.features, stored.results)
+        expected = match_predictions.train_classifiers(self.data, LEAGUE)
+        self.assertEqual(trained[3:], expected[3:])
+        x = np.linspace(-2, 2, 41).reshape(-1, 1)
+        for clf, expected_clf in zip(trained[:3], expected[:3]):
+            np.testing.assert_array_equal(clf.predict(x), expected_clf.predict(x))
+
+    def test_predicts_every_fixture(self):
+        matches = [(self.teams[0], self.teams[1], '2021-05-23', '16:00'),
+                   (self.teams[2], self.teams[3], '2021-05-23', '16:00')]
+        predictions = match_predictions.predict(self.data, LEAGUE, self.classifiers, matches)
+        self.assertEqual([(p.home_team, p.away_team) for p in predictions], [m[:2] for m in matches])
+
+    def test_skips_a_team_with_no_matches_in_the_window(self):
+        # e.g. a promoted team, which is in the league's history but hasn't played in the last
+        # PREDICTION_WINDOW matches
+        names = team_names.TeamNameIndex(LEAGUE, self.teams + ['Promoted Team'])
+        matches = [(self.teams[0], 'Promoted Team', '2021-05-23', '16:00'),
+                   ('Promoted Team', self.teams[1], '2021-05-23', '16:00'),
+                   (self.teams[2], self.teams[3], '2021-05-23', '16:00')]
+        predictions = match_predictions.predict(self.data, LEAGUE, self.classifiers, matches, names=names)
+        self.assertEqual([(p.home_team, p.away_team) for p in predictions], [(self.teams[2], self.teams[3])])
+
+
+if __name__ == '__main__':
+    unittest.main()
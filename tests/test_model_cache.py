@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from benchmarks import local_s3, synthetic
+from chalicelib import columnar, common, historical, historical_data, model_cache
+
+
+BUCKET = 'test-bucket'
+LEAGUE = 'E0'
+CLASSIFIERS = ('home', 'draw', 'away', 0.1, 0.2, 0.3, 'PpgDiff', 'PpgDiff', 'HomeAwayPpgDiff')
+
+
+class ModelCacheTest(unittest.TestCase):
+    # In S3 (as configured), or in MODEL_CACHE_DIR
+
+    def setUp(self):
+        self.s3, _ = local_s3.install()
+        common.s3_cache.clear()
+        self.local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.local_dir.cleanup)
+
+    def test_same_version(self):
+        for environment in self._get_environments():
+            with mock.patch.dict(os.environ, environment):
+                self.assertIsNone(model_cache.load_classifiers(BUCKET, LEAGUE, '"v1"'))
+                model_cache.save_classifiers(BUCKET, LEAGUE, '"v1"', CLASSIFIERS)
+                self.assertEqual(model_cache.load_classifiers(BUCKET, LEAGUE, '"v1"'), CLASSIFIERS)
+
+    def test_other_version(self):
+        for environment in self._get_environments():
+            with mock.patch.dict(os.environ, environment):
+                model_cache.save_classifiers(BUCKET, LEAGUE, '"v1"', CLASSIFIERS)
+                self.assertIsNone(model_cache.load_classifiers(BUCKET, LEAGUE, '"v2"'))
+                # A new version replaces the old one
+                model_cache.save_classifiers(BUCKET, LEAGUE, '"v2"', CLASSIFIERS[::-1])
+                self.assertEqual(model_cache.load_classifiers(BUCKET, LEAGUE, '"v2"'), CLASSIFIERS[::-1])
+                self.assertIsNone(model_cache.load_classifiers(BUCKET, LEAGUE, '"v1"'))
+
+    def test_other_format_or_backend(self):
+        for environment in self._get_environments():
+            with mock.patch.dict(os.environ, environment):
+                model_cache.save_classifiers(BUCKET, LEAGUE, '"v1"', CLASSIFIERS)
+                with mock.patch.object(model_cache, 'MODEL_FORMAT', model_cache.MODEL_FORMAT + 1):
+                    self.assertIsNone(model_cache.load_classifiers(BUCKET, LEAGUE, '"v1"'))
+                with mock.patch.dict(os.environ, {'MODEL_BACKEND': 'sklearn'}):
+                    self.assertIsNone(model_cache.load_classifiers(BUCKET, LEAGUE, '"v1"'))
+
+    def test_new_matches(self):
+        # The models are for a version of the historical data, which appending matches changes
+        prefix = os.environ['S3_PREFIX_HISTORICAL']
+        seasons = synthetic.get_seasons(2, os.environ['LATEST_SEASON'])
+        table = columnar.from_dataset(synthetic.generate_league(LEAGUE, 12, seasons), LEAGUE)
+        historical._write_historical_data(BUCKET, prefix, LEAGUE, seasons[-1], seasons[:-1],
+                                          [historical._get_part(table.take(range(len(table) - 5)))])
+        version = historical_data.HistoricalDataReader(BUCKET, LEAGUE).version
+        model_cache.save_classifiers(BUCKET, LEAGUE, version, CLASSIFIERS)
+
+        common.s3_cache.clear()
+        self.assertEqual(model_cache.load_classifiers(BUCKET, LEAGUE, historical_data.HistoricalDataReader(
+            BUCKET, LEAGUE).version), CLASSIFIERS)
+        historical._append_historical_data(BUCKET, prefix, LEAGUE, seasons[-1], seasons[:-1],
+                                           table.for_season(seasons[-1]))
+        new_version = historical_data.HistoricalDataReader(BUCKET, LEAGUE).version
+        self.assertNotEqual(new_version, version)
+        self.assertIsNone(model_cache.load_classifiers(BUCKET, LEAGUE, new_version))
+
+    def test_unreadable(self):
+        self.s3.put_object(Bucket=BUCKET, Key=model_cache._get_key(LEAGUE), Body=b'not a pickle')
+        with self.assertLogs(level='ERROR'):
+            self.assertIsNone(model_cache.load_classifiers(BUCKET, LEAGUE, '"v1"'))
+
+    def test_off(self):
+        with mock.patch.dict(os.environ):
+            del os.environ['S3_PREFIX_MODELS']
+            model_cache.save_classifiers(BUCKET, LEAGUE, '"v1"', CLASSIFIERS)
+            self.assertIsNone(model_cache.load_classifiers(BUCKET, LEAGUE, '"v1"'))
+        self.assertEqual(self.s3.objects, {})
+
+    def _get_environments(self):
+        # S3, then a local directory (which takes precedence)
+        return [{}, {'MODEL_CACHE_DIR': self.local_dir.name}]
+
+
+if __name__ == '__main__':
+    unittest.main()
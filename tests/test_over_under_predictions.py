@@ -0,0 +1,44 @@
+import numpy as np
+import os
+import unittest
+from benchmarks import synthetic
+from chalicelib import columnar, over_under_predictions, team_names
+
+
+LEAGUE = 'E0'
+
+
+class PredictTest(unittest.TestCase):
+
+    def setUp(self):
+        seasons = synthetic.get_seasons(2, os.environ['LATEST_SEASON'])
+        self.data = columnar.from_dataset(synthetic.generate_league(LEAGUE, 20, seasons), LEAGUE)
+        teams = synthetic.get_team_names(LEAGUE, 20)
+        self.matches = [(home, away, '01/05/2021', '15:00') for home, away in zip(teams[0::2], teams[1::2])]
+
+    def test_skips_unknown_teams(self):
+        matches = self.matches + [('Nobody FC', self.matches[0][1], '01/05/2021', '15:00')]
+        with self.assertLogs(level='WARNING') as logs:
+            predictions = self._predict(self.data, matches)
+        self.assertEqual(len(predictions), len(self.matches))
+        self.assertTrue(any("Skipping ('Nobody FC'" in line for line in logs.output))
+
+    def test_unscored_matches_arent_past_matches(self):
+        # e.g. the last matches in the file, without a score yet
+        unscored = np.zeros(len(self.data), dtype=bool)
+        unscored[-15:-5] = True
+        unscored[-40:-35] = True
+        rows = np.flatnonzero(unscored)
+        columns = dict(self.data.columns, FTHG=self.data['FTHG'].copy(), FTAG=self.data['FTAG'].copy())
+        columns['FTHG'][rows[0::2]] = -1
+        columns['FTAG'][rows[1::2]] = -1
+        data = columnar.LeagueTable(self.data.div, self.data.teams, self.data.seasons, columns)
+        self.assertEqual(self._predict(data, self.matches),
+                         self._predict(self.data.take(np.flatnonzero(~unscored)), self.matches))
+
+    def _predict(self, data, matches):
+        return over_under_predictions.predict(LEAGUE, data, matches, team_names.TeamNameIndex(LEAGUE, data.teams))
+
+
+if __name__ == '__main__':
+    unittest.main()
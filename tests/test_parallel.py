@@ -0,0 +1,58 @@
+import os
+import time
+import unittest
+from chalicelib import parallel
+
+
+def _square_or_fail(x):
+    if x % 3 == 0:
+        raise ValueError("Can't process %d" % x)
+    return x * x
+
+
+class MapInProcessesTest(unittest.TestCase):
+
+    def test_same_as_map(self):
+        items = list(range(20))
+        self.assertEqual(parallel.map_in_processes(lambda x: x * x, items, 3), [x * x for x in items])
+
+    def test_in_this_process_with_one_worker(self):
+        self.assertEqual(parallel.map_in_processes(lambda x: os.getpid(), [1, 2], 1), [os.getpid()] * 2)
+
+    def test_raises_once_every_item_has_been_processed(self):
+        with self.assertLogs(level='ERROR') as logs, self.assertRaisesRegex(RuntimeError, "4 of 10"):
+            parallel.map_in_processes(_square_or_fail, range(10), 3)
+        self.assertEqual(sum("ValueError: Can't process" in line for line in logs.output), 4)
+
+    def test_result_that_cant_be_pickled(self):
+        with self.assertLogs(level='ERROR'), self.assertRaisesRegex(RuntimeError, "1 of 3"):
+            parallel.map_in_processes(lambda x: (lambda: x) if x == 1 else x, [0, 1, 2], 2)
+
+    def test_worker_dies(self):
+        def die(x):
+            if x == 2:
+                os._exit(1)
+            return x
+
+        with self.assertLogs(level='ERROR') as logs, self.assertRaisesRegex(RuntimeError, "1 of 8"):
+            parallel.map_in_processes(die, range(8), 2)
+        self.assertIn("Worker process died", logs.output[0])
+
+    def test_every_worker_dies(self):
+        with self.assertLogs(level='ERROR'), self.assertRaisesRegex(RuntimeError, "8 of 8"):
+            parallel.map_in_processes(lambda x: os._exit(1), range(8), 2)
+
+    def test_slow_item_doesnt_hold_up_the_rest(self):
+        # While one worker is busy with the first item, the other gets all the rest
+        def process(x):
+            if x == 0:
+                time.sleep(1)
+            return os.getpid()
+
+        pids = parallel.map_in_processes(process, range(10), 2)
+        self.assertEqual(len(set(pids[1:])), 1)
+        self.assertNotEqual(pids[0], pids[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import unittest
+from unittest import mock
+from benchmarks import local_s3, synthetic
+from chalicelib import columnar, common, historical, match_predictions, over_under_predictions, predictions
+
+
+BUCKET = 'test-bucket'
+FIXTURES_KEY = 'fixtures/fixtures.csv'
+# The over/under predictions leave out SP1, and no predictor covers XX
+DIVS = ['E0', 'E1', 'SP1']
+
+
+class RunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.s3, self.ses = local_s3.install()
+        seasons = synthetic.get_seasons(3, os.environ['LATEST_SEASON'])
+        for seed, div in enumerate(DIVS):
+            table = columnar.from_dataset(synthetic.generate_league(div, 20, seasons, seed=seed), div)
+            historical._write_historical_data(BUCKET, os.environ['S3_PREFIX_HISTORICAL'], div, seasons[-1],
+                                              seasons[:-1], [historical._get_part(table)])
+        fixtures = synthetic.generate_fixtures(DIVS, 20)
+        fixtures.append(['XX', '01/05/2021', '15:00', 'Home', 'Away'])
+        self.s3.put_object(Bucket=BUCKET, Key=FIXTURES_KEY, Body=fixtures.export('csv'))
+
+    def test_get_predictors(self):
+        with mock.patch.dict(os.environ, {'PREDICTORS': 'over_under, match'}):
+            names = predictions.get_predictor_names()
+        self.assertEqual(names, ['over_under', 'match'])
+        self.assertEqual(list(predictions.get_predictors(names).items()),
+                         [('over_under', over_under_predictions), ('match', match_predictions)])
+        with self.assertRaisesRegex(ValueError, "Unknown predictor 'goals'"):
+            predictions.get_predictors(['match', 'goals'])
+
+    def test_predictors_share_the_run(self):
+        # Running both predictors at once sends the same emails as running each of them on its own
+        match_emails = self._run(PREDICTORS='match')
+        over_under_emails = self._run(PREDICTORS='over_under')
+        self.assertEqual([subject for subject, _ in match_emails + over_under_emails],
+                         ["Football predictions (Home/Away)", "Top football predictions (cutoff = 65.00%)",
+                          "Football predictions (Over/Under 2.5 goals)"])
+        self.assertEqual(self._run(PREDICTORS='match,over_under'), match_emails + over_under_emails)
+
+        all_email, over_under_email = match_emails[0][1], over_under_emails[0][1]
+        for div in DIVS:
+            self.assertIn(div + ': ', all_email)
+        self.assertNotIn('SP1: ', over_under_email)
+        self.assertNotIn('XX', all_email + over_under_email)
+
+    def test_stored_features(self):
+        # The emails are the same whether the features stored with the data are used or worked out from it.
+        # With them, only the start of each league's data (with the header) is read.
+        reads = []
+        get_object = self.s3.get_object
+
+        def record_get_object(**kwargs):
+            reads.append((kwargs['Key'], kwargs.get('Range')))
+            return get_object(**kwargs)
+
+        # (In this process, so that the reads are seen)
+        with mock.patch.object(self.s3, 'get_object', record_get_object):
+            with_features = self._run(PREDICTORS='match', PREDICTION_WORKERS='1')
+            data_reads, reads[:] = [read for read in reads if read[0].endswith('.cols')], []
+            with mock.patch.dict(os.environ):
+                del os.environ['S3_PREFIX_FEATURES']
+                self.assertEqual(self._run(PREDICTORS='match', PREDICTION_WORKERS='1'), with_features)
+        self.assertEqual(len(data_reads), len(DIVS))
+        self.assertTrue(all(data_range.startswith('bytes=0-') for _, data_range in data_reads))
+        self.assertGreater(len([read for read in reads if read[0].endswith('.cols')]), len(DIVS))
+
+    def test_workers(self):
+        expected = self._run(PREDICTORS='match,over_under', PREDICTION_WORKERS='1')
+        self.assertEqual(self._run(PREDICTORS='match,over_under', PREDICTION_WORKERS='3'), expected)
+
+    def _run(self, **environment):
+        # Returns the (subject, body) of each email sent, starting from cold caches
+        common.s3_cache.clear()
+        self.s3.delete_prefix(BUCKET, os.environ['S3_PREFIX_MODELS'])
+        del self.ses.sent[:]
+        with mock.patch.dict(os.environ, environment):
+            predictions.run(BUCKET, FIXTURES_KEY, predictions.get_predictors(predictions.get_predictor_names()))
+        return [(mail['Message']['Subject']['Data'], mail['Message']['Body']['Text']['Data'])
+                for mail in self.ses.sent]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import importlib.util
+import numpy as np
+import unittest
+import warnings
+from chalicelib import regression
+
+
+@unittest.skipUnless(importlib.util.find_spec('sklearn'), "scikit-learn isn't installed")
+class SameAsSklearnTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_fit_and_predict(self):
+        for n_features in [1, 3]:
+            X = self.rng.normal(2, 3, (200, n_features))
+            y = X @ self.rng.normal(size=n_features) + self.rng.normal(size=200)
+            if n_features > 1:
+                # A constant feature is left unscaled
+                X[:, 0] = 5.0
+            numpy_model, sklearn_model = self._fit(X, y)
+            X_test = self.rng.normal(2, 3, (50, n_features))
+            np.testing.assert_allclose(numpy_model.predict(X_test), sklearn_model.predict(X_test))
+            self.assertAlmostEqual(numpy_model.score(X_test[:20], y[:20]), sklearn_model.score(X_test[:20], y[:20]))
+
+    def test_score_with_constant_y(self):
+        X = np.array([[1.0], [2.0], [3.0]])
+        for y in [[1.0, 1.0, 1.0], [1.0, 2.0, 4.0]]:
+            numpy_model, sklearn_model = self._fit(X, y)
+            for y_test in [[1.0, 1.0], [2.0, 2.0]]:
+                self.assertEqual(numpy_model.score(X[:2], y_test), sklearn_model.score(X[:2], y_test))
+
+    def test_score_of_one_sample(self):
+        numpy_model, sklearn_model = self._fit(np.array([[1.0], [2.0], [3.0]]), [1.0, 2.0, 4.0])
+        for model in [numpy_model, sklearn_model]:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                self.assertTrue(np.isnan(model.score([[1.0]], [1.0])))
+            self.assertEqual([issubclass(w.category, UserWarning) for w in caught], [True])
+
+    def _fit(self, X, y):
+        return (regression.get_backend('numpy')().fit(X, y), regression.get_backend('sklearn')().fit(X, y))
+
+
+if __name__ == '__main__':
+    unittest.main()
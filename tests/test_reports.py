@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import random
+import textwrap
+import unittest
+from unittest import mock
+from benchmarks import local_s3
+from chalicelib import common, reports
+
+
+LOGGER = logging.getLogger()
+
+# The emails as they were sent before reports.py, from the predictions as JSON (copied from
+# match_predictions and over_under_predictions, only renamed)
+
+def _old_email_all_predictions(all_predictions_json):
+    league_template = textwrap.dedent("""
+    ==================================================
+    %s: %s
+    ==================================================
+    Home (%s) %.2f
+    Away (%s) %.2f
+    Draw (%s) %.2f
+
+    """)
+    match_template = textwrap.dedent("""
+    %s %s -- %s v. %s
+    --------------------------------------------------
+    Home: %.2f   (%.2f)
+    Draw: %.2f   (%.2f)
+    Away: %.2f   (%.2f)
+
+    """)
+
+    all_predictions = json.loads(all_predictions_json)
+    mail_message = ""
+
+    for league in all_predictions:
+        mail_message += league_template % (league['div'], league['league'],
+                                           league['home_fname'], league['home_score'],
+                                           league['away_fname'], league['away_score'],
+                                           league['draw_fname'], league['draw_score'])
+
+        for prediction in league['predictions']:
+            mail_message += match_template % (prediction['date'], prediction['time'],
+                                              prediction['home_team'], prediction['away_team'],
+                                              prediction['home_pct'], prediction['home_odds'],
+                                              prediction['draw_pct'], prediction['draw_odds'],
+                                              prediction['away_pct'], prediction['away_odds'])
+
+        if league.get('unresolved_teams'):
+            mail_message += "Skipped the fixtures of these unknown teams: %s\n" % ', '.join(league['unresolved_teams'])
+
+    LOGGER.info("Football predictions (Home/Away) \n%s", mail_message)
+    common.send_mail("Football predictions (Home/Away)", mail_message)
+
+
+def _old_email_best_predictions(all_predictions_json):
+    league_template = textwrap.dedent("""
+
+    ==================================================
+    %s: %s
+    ==================================================
+    """)
+
+    match_template = textwrap.dedent("""
+    %s %s -- %s v. %s
+    --------------------------------------------------
+    %s: %.2f   (%.2f)
+    %s
+
+    """)
+
+    cutoff = 65
+    if "PREDICTION_CUTOFF" in os.environ:
+        cutoff = int(os.environ['PREDICTION_CUTOFF'])
+
+    all_predictions = json.loads(all_predictions_json)
+    mail_message = ""
+
+    for div_predictions in all_predictions:
+        div = div_predictions['div']
+        league = div_predictions['league']
+        top_predictions = []
+
+        for prediction in div_predictions['predictions']:
+            home_team, away_team = prediction['home_team'], prediction['away_team']
+            if prediction['home_pct'] >= cutoff:
+                top_predictions.append({'home': home_team,
+                                        'away': away_team,
+                                        'winner': home_team,
+                                        'pct': prediction['home_pct'],
+                                        'odds': prediction['home_odds'],
+                                        'date': prediction['date'],
+                                        'time': prediction['time']})
+            if prediction['away_pct'] >= cutoff:
+                top_predictions.append({'home': home_team,
+                                        'away': away_team,
+                                        'winner': away_team,
+                                        'pct': prediction['away_pct'],
+                                        'odds': prediction['away_odds'],
+                                        'date': prediction['date'],
+                                        'time': prediction['time']})
+
+        if len(top_predictions) > 0:
+            mail_message += league_template % (div, league)
+            for p in top_predictions:
+                note = ""
+                if div == 'MEX':
+                    note = "Note: consider Double Chance"
+                mail_message += match_template % (p['date'], p['time'], p['home'], p['away'], p['winner'], p['pct'], p['odds'], note)
+
+    if mail_message:
+        common.send_mail("Top football predictions (cutoff = %.2f%%)" % cutoff, mail_message)
+
+
+def _old_email_draw_predictions(all_predictions_json):
+    league_template = textwrap.dedent("""
+
+    ==================================================
+    %s: %s
+    ==================================================
+    """)
+
+    match_template = textwrap.dedent("""
+    %s v. %s
+    --------------------------------------------------
+    Draw: %.2f   (%.2f)
+
+    """)
+
+    cutoff = 30
+    if 'DRAW_CUTOFF' in os.environ:
+        cutoff = int(os.environ['DRAW_CUTOFF'])
+
+    all_predictions = json.loads(all_predictions_json)
+    mail_message = ""
+
+    for div_predictions in all_predictions:
+        div = div_predictions['div']
+        league = div_predictions['league']
+        draw_predictions = []
+
+        for prediction in div_predictions['predictions']:
+            home_team, away_team = prediction['home_team'], prediction['away_team']
+            if prediction['draw_pct'] >= cutoff:
+                home_pct = prediction['home_pct']
+                away_pct = prediction['away_pct']
+                home_away_diff = abs(home_pct - away_pct)
+                if (home_pct >= 20 and home_pct < 50) and (away_pct >= 20 and away_pct < 50) and (home_away_diff < 15):
+                    draw_predictions.append({'home': home_team, 'away': away_team, 'pct': prediction['draw_pct'], 'odds': prediction['draw_odds']})
+
+        if len(draw_predictions) > 0:
+            mail_message += league_template % (div, league)
+            for p in draw_predictions:
+                mail_message += match_template % (p['home'], p['away'], p['pct'], p['odds'])
+
+    if mail_message:
+        common.send_mail("Football draw predictions (cutoff = %.2f%%)" % cutoff, mail_message)
+
+
+def _old_email_over_under_predictions(all_predictions_json):
+    league_template = textwrap.dedent("""
+
+    ==================================================
+    %s: %s
+    ==================================================
+    """)
+
+    match_template = """
+    %s %s : %s -- %s v. %s
+    """
+
+    all_predictions = json.loads(all_predictions_json)
+    mail_message = ""
+
+    for div_predictions in all_predictions:
+        mail_message += league_template % (div_predictions['div'], div_predictions['league'])
+
+        for prediction in div_predictions['predictions']:
+            outcome = "over" if prediction['is_over_25'] == True else "under"
+            mail_message += match_template % (prediction['date'], prediction['time'],
+                                              outcome, prediction['home_team'], prediction['away_team'])
+
+    LOGGER.info("Football predictions (Over/Under 2.5 goals) \n%s", mail_message)
+    common.send_mail("Football predictions (Over/Under 2.5 goals)", mail_message)
+
+
+class SameAsTheOldEmailsTest(unittest.TestCase):
+
+    def setUp(self):
+        _, self.ses = local_s3.install()
+        self.rng = random.Random(0)
+
+    def test_match_emails(self):
+        for cutoffs in [{}, {'PREDICTION_CUTOFF': '50', 'DRAW_CUTOFF': '25'}, {'PREDICTION_CUTOFF': '101'}]:
+            all_predictions = [self._get_league_predictions(div) for div in ['E0', 'MEX', 'SP1']]
+            all_predictions.append(self._get_league_predictions('D1', n_matches=0))
+            with mock.patch.dict(os.environ, cutoffs):
+                for email, old_email in [(reports.AllPredictionsEmail(), _old_email_all_predictions),
+                                         (reports.BestPredictionsEmail(), _old_email_best_predictions),
+                                         (reports.DrawPredictionsEmail(), _old_email_draw_predictions)]:
+                    self._check(all_predictions, email, old_email)
+
+    def test_over_under_email(self):
+        all_predictions = [reports.LeaguePredictions(div, common.DIVISIONS_TO_LEAGUES[div], None, [
+            reports.OverUnderPrediction('01/01/21', '15:00', 'Team %d' % i, 'Team %d' % (i + 1),
+                                        self.rng.random() < 0.5)
+            for i in range(self.rng.randint(1, 5))], []) for div in ['E0', 'E1']]
+        self._check(all_predictions, reports.OverUnderEmail(), _old_email_over_under_predictions)
+
+    def _check(self, all_predictions, email, old_email):
+        # The same mails (if any), with the same subject and body
+        old_email(self._to_json(all_predictions))
+        old_sent = list(self.ses.sent)
+        del self.ses.sent[:]
+        reports.render(all_predictions, [email])
+        email.send()
+        self.assertEqual(self.ses.sent, old_sent, type(email).__name__)
+        del self.ses.sent[:]
+
+    def _to_json(self, all_predictions):
+        report = reports.JsonReport()
+        reports.render(all_predictions, [report])
+        return report.message
+
+    def _get_league_predictions(self, div, n_matches=40):
+        models = reports.ModelScores('PpgDiff', self.rng.random(), 'HomeAwayPpgDiff', self.rng.random(),
+                                     'PpgDiff', self.rng.random())
+        predictions = []
+        for i in range(n_matches):
+            # Whole percentages, so that some are right on the cutoffs
+            home, draw, away = [float(self.rng.randint(low, high)) for low, high in [(15, 70), (20, 35), (15, 70)]]
+            predictions.append(reports.MatchPrediction('01/01/21', '15:00', 'Team %d' % i, 'Team %d' % (i + 1),
+                                                       home, draw, away))
+        unresolved = ['Unknown FC'] if div == 'SP1' else []
+        return reports.LeaguePredictions(div, common.DIVISIONS_TO_LEAGUES[div], models, predictions, unresolved)
+
+
+if __name__ == '__main__':
+    unittest.main()
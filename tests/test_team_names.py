@@ -0,0 +1,33 @@
+import unittest
+from chalicelib import team_names
+
+
+class TeamNameIndexTest(unittest.TestCase):
+
+    def test_normalized(self):
+        index = team_names.TeamNameIndex('E1', ['Sheffield United', 'Nott\'m Forest', 'Barnsley'])
+        self.assertEqual(index.resolve('Sheffield Utd'), 'Sheffield United')
+        self.assertEqual(index.resolve('Barnsley FC'), 'Barnsley')
+        self.assertEqual(index.unresolved, [])
+
+    def test_fuzzy(self):
+        index = team_names.TeamNameIndex('XX', ['Sociedad', 'Betis', 'Olympiacos Piraeus'])
+        self.assertEqual(index.resolve('Real Sociedad'), 'Sociedad')
+        self.assertEqual(index.resolve('Olympiakos Piraeus'), 'Olympiacos Piraeus')
+        self.assertEqual(index.fuzzy_matches, {'Real Sociedad': 'Sociedad',
+                                               'Olympiakos Piraeus': 'Olympiacos Piraeus'})
+
+    def test_not_a_different_team_with_a_longer_name(self):
+        index = team_names.TeamNameIndex('SC1', ['Dundee United', 'Arbroath', 'Ayr'])
+        self.assertIsNone(index.resolve('Dundee'))
+        self.assertIsNone(index.resolve('Dundee FC'))
+        self.assertEqual(index.unresolved, ['Dundee', 'Dundee FC'])
+
+    def test_not_a_different_team_from_the_same_place(self):
+        index = team_names.TeamNameIndex('E1', ['Sheffield Weds', 'Barnsley', 'Hull'])
+        self.assertIsNone(index.resolve('Sheffield Utd'))
+        self.assertEqual(index.unresolved, ['Sheffield Utd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
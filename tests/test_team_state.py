@@ -0,0 +1,141 @@
+import numpy as np
+import random
+import tablib
+import unittest
+from collections import defaultdict
+from benchmarks import synthetic
+from chalicelib import columnar, feature_store, team_state
+
+
+# The vectorised replay (team_state.replay), carrying on from a checkpoint (update_ppg_features and
+# feature_store.update_features) and replaying everything (get_ppg_features and
+# feature_store.compute_features) must all give the features that add_ppg_fields gave when it went through
+# the matches one row at a time. _replay_row_by_row is that original loop.
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(0)
+
+    def test_full_replay(self):
+        for seed in range(4):
+            table = self._get_league(seed)
+            features, state = team_state.get_ppg_features(table)
+            expected = _replay_row_by_row(table)
+            for fname in team_state.FEATURES:
+                np.testing.assert_allclose(features[fname], expected[fname], rtol=0, atol=1e-12, err_msg=fname)
+            self.assertEqual(state.n_matches, len(table))
+            self.assertEqual(state.last_key, columnar.get_row_keys(table)[-1])
+
+    def test_replay_from_checkpoints(self):
+        for seed in range(4):
+            table = self._get_league(seed)
+            full, full_state = team_state.get_ppg_features(table)
+            for _ in range(5):
+                state = team_state.TeamState([], np.zeros((0, team_state.N_ACCUMULATORS), dtype=np.int64))
+                parts = []
+                for start, stop in self._get_chunks(len(table)):
+                    features, state = team_state.update_ppg_features(state, self._take(table, start, stop))
+                    parts.append(features)
+                for fname in team_state.FEATURES:
+                    np.testing.assert_array_equal(np.concatenate([part[fname] for part in parts]), full[fname],
+                                                  err_msg=fname)
+                self.assertEqual(state.teams, full_state.teams)
+                np.testing.assert_array_equal(state.totals, full_state.totals)
+                self.assertEqual((state.n_matches, state.last_key), (full_state.n_matches, full_state.last_key))
+
+    def test_update_stored_features(self):
+        for seed in range(4):
+            table = self._get_league(seed)
+            full = feature_store.compute_features('v', [table])
+            for _ in range(3):
+                chunks = self._get_chunks(len(table))
+                start, stop = chunks[0]
+                league_features = feature_store.compute_features('v0', [self._take(table, start, stop)])
+                for start, stop in chunks[1:]:
+                    league_features = feature_store.update_features(
+                        league_features, 'v', table.take(range(max(start - team_state.PREDICTION_WINDOW, 0), start)),
+                        self._take(table, start, stop))
+                self._assert_same_features(league_features, full)
+
+    def test_stored_features_a_table_at_a_time(self):
+        for seed in range(4):
+            table = self._get_league(seed)
+            full = feature_store.compute_features('v', [table])
+            features, state = team_state.get_ppg_features(table)
+            for fname in team_state.FEATURES:
+                np.testing.assert_array_equal(full.features[fname], features[fname], err_msg=fname)
+            np.testing.assert_array_equal(full.state.totals, state.totals)
+            for _ in range(3):
+                tables = [self._take(table, start, stop) for start, stop in self._get_chunks(len(table))]
+                self._assert_same_features(feature_store.compute_features('v', tables), full)
+            self._assert_same_features(
+                feature_store.compute_features('v', [table.for_season(season) for season in table.seasons]), full)
+
+    def _assert_same_features(self, league_features, expected):
+        for fname in team_state.FEATURES:
+            np.testing.assert_array_equal(league_features.features[fname], expected.features[fname], err_msg=fname)
+        np.testing.assert_array_equal(league_features.results, expected.results)
+        self.assertEqual(league_features.latest_state.teams, expected.latest_state.teams)
+        for name, values in expected.latest_state.arrays().items():
+            np.testing.assert_array_equal(league_features.latest_state.arrays()[name], values, err_msg=name)
+
+    def _get_league(self, seed):
+        # A synthetic league with a few unknown results and goals, and some teams that only turn up at the end
+        data = synthetic.generate_league('E0', 10 + seed, ['1819', '1920', '2021'], seed=seed)
+        rows = [list(row) for row in data]
+        for row in self.rng.sample(rows, 5):
+            row[5] = row[6] = row[7] = ''
+        for row in rows[-20:]:
+            if self.rng.random() < 0.3:
+                row[3] += ' B'
+        return columnar.from_dataset(tablib.Dataset(*rows, headers=columnar.CSV_HEADERS), 'E0')
+
+    def _get_chunks(self, n):
+        # Random split points, starting with an empty chunk
+        cuts = [0, 0] + sorted(self.rng.sample(range(1, n), self.rng.randint(1, 8))) + [n]
+        return list(zip(cuts[:-1], cuts[1:]))
+
+    def _take(self, table, start, stop):
+        # As a segment would be: decoded on its own, it only knows its own teams
+        return columnar.concatenate([table.take(range(start, stop))])
+
+
+def _replay_row_by_row(table):
+    n_home = defaultdict(int)
+    n_away = defaultdict(int)
+    home_points = defaultdict(int)
+    away_points = defaultdict(int)
+    goals = defaultdict(int)
+    features = defaultdict(list)
+
+    for home_id, away_id, ftr, home_goals, away_goals in zip(table['HomeTeam'], table['AwayTeam'], table['FTR'],
+                                                             table['FTHG'], table['FTAG']):
+        home, away = table.teams[home_id], table.teams[away_id]
+        home_total = n_home[home] + n_away[home]
+        away_total = n_home[away] + n_away[away]
+        features['HomeTeamPpgAtHome'].append(home_points[home] / n_home[home] if n_home[home] else 0.0)
+        features['HomeTeamOverallPpg'].append((home_points[home] + away_points[home]) / home_total if home_total else 0.0)
+        features['HomeTeamGpg'].append(goals[home] / home_total if home_total else 0.0)
+        features['AwayTeamPpgAway'].append(away_points[away] / n_away[away] if n_away[away] else 0.0)
+        features['AwayTeamOverallPpg'].append((home_points[away] + away_points[away]) / away_total if away_total else 0.0)
+        features['AwayTeamGpg'].append(goals[away] / away_total if away_total else 0.0)
+
+        n_home[home] += 1
+        n_away[away] += 1
+        home_points[home] += {columnar.RESULT_CODES['H']: 3, columnar.RESULT_CODES['D']: 1}.get(ftr, 0)
+        away_points[away] += {columnar.RESULT_CODES['A']: 3, columnar.RESULT_CODES['D']: 1}.get(ftr, 0)
+        goals[home] += max(int(home_goals), 0)
+        goals[away] += max(int(away_goals), 0)
+
+    features = {fname: np.array(values) for fname, values in features.items()}
+    features['PpgDiff'] = features['HomeTeamOverallPpg'] - features['AwayTeamOverallPpg']
+    features['HomeAwayPpgDiff'] = features['HomeTeamPpgAtHome'] - features['AwayTeamPpgAway']
+    features['GpgTotal'] = features['HomeTeamGpg'] + features['AwayTeamGpg']
+    features['GpgDiff'] = features['HomeTeamGpg'] - features['AwayTeamGpg']
+    return features
+
+
+if __name__ == '__main__':
+    unittest.main()